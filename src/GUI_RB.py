@@ -1,33 +1,102 @@
-import random
-
 import dash
-from dash import dcc, html, Input, Output
+from dash import dcc, html, ctx, Input, Output, State
 import numpy as np
-import plotly.graph_objs as go
-import plotly.express as px
 import dash_bootstrap_components as dbc
-import collections
+import threading
 
-from numpy.core.defchararray import title
+from alarm_engine import VITALS, AlarmEngine, check_vital_signs
+from decimation import bucket_size
+from figure_stream import base_figure, extend_data, window_data
+from heart_rate_engine import BeatDetector, format_heart_rate
+import metrics
+from metrics import timed
+from numeric_channel import NumericChannel
+from push_stream import BufferPublisher, StreamHub, WindowPublisher
+from pyramid import Pyramid
+from recorder import Recorder, session_path
+from render_pacer import REQUEST, RUNNING, pace, pacer_components
+from respiration_engine import RespirationEstimator, format_respiratory_rate
+from ring_buffer import RingBuffer
+from spo2_engine import SpO2Engine, format_spo2
 
-from alarm_engine import check_vital_signs
-import sys
+CONNECTING = 'Connecting…'  # status line until the engines and the device / recording are up
+CONNECTION_FAILED = 'Connection failed: {}'  # status line once loading or acquisition raised
+VITAL_CARDS = ('heart-rate-card', 'spo2-card', 'respiratory-rate-card', 'body-temp-card')  # in VITALS order
 
 class Constants:
     port = 'COM9'
     baud_rate = 9600
+    serial_format = 'text'  # 'text' (one line per sample) or 'binary' (framed, see serial_ingest.py)
+    serial_channels = 1  # ECG[, PPG (infrared)[, red PPG[, body temperature]]]
     sampling_rate = 500
     window_size = 5*sampling_rate
+    max_window = 20*sampling_rate  # longest window served from the ring buffer
+    # Window lengths (s) selectable with my-slider; longer than max_window are drawn from the pyramid
+    window_choices = (2, 5, 10, 20, 60, 300, 1800, 7200, 86400)
+    window_labels = ('2 s', '5 s', '10 s', '20 s', '1 min', '5 min', '30 min', '2 h', '24 h')
+    window_choice = 2  # initial my-slider position (10 s)
+    plot_width = 1000  # points per trace the plots are decimated to (about their pixel width)
+    decimation = {'ecg': 'minmax', 'ppg': 'lttb'}
+    replay_speed = 1.0  # recording playback speed without a device (0.5-50), None = as fast as possible
+    # 'push': samples and vitals are streamed to the browser over Server-Sent Events, one stream per
+    # my-slider window (/stream/<choice>); 'poll': dcc.Interval callbacks
+    transport = 'push'
+    # Push transport only: 'binary' sends traces as base64 typed arrays with x as start + step
+    # (waveform_codec.py), 'json' as lists of numbers
+    waveform_encoding = 'binary'
+    record_channels = ('ecg', 'ppg', 'ppg_red')  # written to data/sessions/ while the Record button is on
+    server_port = 8050
+    numeric_history = 86400  # changes kept per slow numeric (temperature), see numeric_channel.py
+    # main_RB.py should answer HTTP (showing CONNECTING) within this many seconds of a cold start,
+    # checked by benchmark.py -k startup
+    startup_budget = 3.0
 
 class GUI():
     def __init__(self):
         super().__init__()
-        self.xticks = collections.deque(maxlen=Constants.window_size)
-        self.ecg = None
-        self.ppg = None
+        # Written by the acquisition thread, read by the callbacks. Twice the longest window so a
+        # rendered window stays valid for another window's worth of samples.
+        self.buffer = RingBuffer(('t', 'ecg', 'ppg', 'ppg_red'), 2 * Constants.max_window)
+        # Engines are built by load(), which runs while the server already answers
+        self.beat_detector = self.respiration = self.spo2 = None
+        self.ready = threading.Event()
+        self.acquisition_error = None  # exception that stopped run_farzad(), shown on the status line
+        # Body temperature, change-only (it was carried at waveform rate before)
+        self.temperature = NumericChannel(max_changes=Constants.numeric_history)
+        # Latest vitals, replaced by the acquisition thread after every block (process_block)
+        self.vitals = dict.fromkeys(VITALS, np.nan)
+        # Hysteresis and debounce for the vitals' card colours, evaluated once per second of data
+        self.alarms = AlarmEngine(1)
+        # Min/max/mean history for windows longer than the ring buffer, as far back as the longest window
+        self.pyramid = Pyramid(('ecg', 'ppg'), Constants.sampling_rate, raw_fn=self.raw_samples,
+                               retention=int(max(Constants.window_choices) * Constants.sampling_rate))
+        self.recorder = None
         self.app = dash.Dash(__name__, external_stylesheets=[dbc.themes.CYBORG, dbc.icons.BOOTSTRAP],
                              meta_tags=[{'name': 'viewport',
                                          'content': 'width=device-width, initial-scale=1.0'}])
+        # Push transport: the acquisition thread notifies the publishers, which stream to every browser.
+        # One stream per my-slider window; a browser follows the slider by switching streams. Windows
+        # longer than the ring buffer are pyramid envelopes, redrawn about once a second.
+        dx = 1 / Constants.sampling_rate if Constants.waveform_encoding == 'binary' else None
+        self.publishers = {}
+        for choice, seconds in enumerate(Constants.window_choices):
+            window = int(seconds * Constants.sampling_rate)
+            if window <= Constants.max_window:
+                self.publishers[choice] = BufferPublisher(
+                    StreamHub(), self.buffer, {'ecg-plot': 'ecg', 'ppg-plot': 'ppg'}, window,
+                    bucket_size(window, Constants.plot_width, Constants.decimation), Constants.decimation,
+                    vitals_fn=self.push_vital_signs, dx=dx)
+            else:
+                self.publishers[choice] = WindowPublisher(StreamHub(), lambda window=window: self.envelopes(window),
+                                                          vitals_fn=self.push_vital_signs, dx=dx)
+        self.app.server.add_url_rule('/stream/<int:choice>', 'stream', self.stream)
+        metrics.serve(self.app.server)
+
+    def load(self):
+        # The signal processing engines (their filters import scipy, the slowest part of a cold start)
+        self.beat_detector = BeatDetector(Constants.sampling_rate)
+        self.respiration = RespirationEstimator(Constants.sampling_rate, self.beat_detector)
+        self.spo2 = SpO2Engine(Constants.sampling_rate)
 
     def set_layout(self):
         # create Cardas
@@ -43,7 +112,7 @@ class GUI():
                      ], className='text-danger'
                 ),
                 html.H3(id='heart-rate-value', children='')
-            ], style={'fontSize': '60px', 'color': 'white', 'fontWeight': 'bold'})
+            ], style={'fontSize': '60px', 'color': 'white', 'fontWeight': 'bold'}), id='heart-rate-card'
         )
         card_respiration = dbc.Card(
             dbc.CardBody([
@@ -52,7 +121,7 @@ class GUI():
                      ], className='text-primary'
                 ),
                 html.H3(id='respiratory-rate-value', children='')
-            ],style={'fontSize': '60px', 'color': 'white', 'fontWeight': 'bold'})
+            ],style={'fontSize': '60px', 'color': 'white', 'fontWeight': 'bold'}), id='respiratory-rate-card'
         )
         card_spO2 = dbc.Card(
             dbc.CardBody([
@@ -61,7 +130,7 @@ class GUI():
                      ], className='text-primary'
                 ),
                 html.H3(id='spo2-value', children='')
-            ],style={'fontSize': '60px', 'color': 'white', 'fontWeight': 'bold'})
+            ],style={'fontSize': '60px', 'color': 'white', 'fontWeight': 'bold'}), id='spo2-card'
         )
         card_temp = dbc.Card(
             dbc.CardBody([
@@ -70,27 +139,33 @@ class GUI():
                      ], className='text-success'
                 ),
                 html.H3(id='body-temp-value', children='')
-            ],style={'fontSize': '60px', 'color': 'white', 'fontWeight': 'bold'})
+            ],style={'fontSize': '60px', 'color': 'white', 'fontWeight': 'bold'}), id='body-temp-card'
         )
 
         main_card = dbc.Card(dbc.CardBody([
-            dcc.Interval(id='interval-component-graphs', interval=100, n_intervals=0),
-            dcc.Interval(id='interval-component-vitals', interval=1000, n_intervals=0),
+            *pacer_components('interval-component-graphs', interval=100, disabled=Constants.transport == 'push'),
+            dcc.Store(id='graph-seq'),
+            dcc.Interval(id='interval-component-vitals', interval=1000, n_intervals=0,
+                         disabled=Constants.transport == 'push'),
+            html.Div(id='push-stream', **{'data-url': self.stream_url(Constants.window_choice)
+                                          if Constants.transport == 'push' else ''}),
             dbc.Row([
-                dbc.Col(html.H1('VitalSign',
-                                className='text-center text-success mb-2'))
+                dbc.Col([html.H1('VitalSign', className='text-center text-success mb-2'),
+                         html.Div(CONNECTING, id='connection-status', className='text-center text-warning')])
             ],style={'margin-left': 1, 'margin-right': 1, 'margin-bottom': 1, 'margin-top': 2}),
             dbc.Row([
                 dbc.Col([
                     dbc.Row([
                         dbc.Col([
-                            dcc.Graph(id='ecg-plot',figure={}, config={'displayModeBar': False})
+                            dcc.Graph(id='ecg-plot', figure=base_figure('ECG', 'red'), config={'displayModeBar': False})
                         ])
                     ]),
                     dbc.Row([
                         dbc.Col([
-                            dcc.Graph(id='ppg-plot', figure={}, config={'displayModeBar': False}),
-                            dcc.Slider(0, 20, 1, value=10, id='my-slider')
+                            dcc.Graph(id='ppg-plot', figure=base_figure('PPG', 'lightblue'), config={'displayModeBar': False}),
+                            dcc.Slider(0, len(Constants.window_choices) - 1, 1, value=Constants.window_choice,
+                                       id='my-slider',
+                                       marks=dict(enumerate(Constants.window_labels)))
                             ])
                         ])
                 ], width=10),
@@ -111,44 +186,158 @@ class GUI():
     def setup_callbacks(self):
         @self.app.callback(
             [Output('ecg-plot', 'figure'),
-             Output('ppg-plot', 'figure')],
-             Input('interval-component-graphs', 'n_intervals')
+             Output('ppg-plot', 'figure'),
+             Output('ecg-plot', 'extendData'),
+             Output('ppg-plot', 'extendData'),
+             Output('graph-seq', 'data')],
+             Input(REQUEST, 'data'),
+             Input('my-slider', 'value'),
+             State('graph-seq', 'data'),
+             running=RUNNING
         )
+        @timed('callback_compute_seconds', 'Callback time before serialization', callback='update_graphs')
+        def update_graphs(n, choice, since):
+            # my-slider picks the window length; the window is decimated to about the plot width
+            window = int(Constants.window_choices[choice] * Constants.sampling_rate)
+            if window > Constants.max_window:
+                # Older than the ring buffer: min/max envelope from the pyramid, refreshed about once a second
+                if ctx.triggered_id != 'my-slider' and (n or 0) % 10:
+                    return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
+                (ecg_x, ecg_y), (ppg_x, ppg_y) = self.envelopes(window).values()
+                return (base_figure('ECG', 'red', x=ecg_x, y=ecg_y), base_figure('PPG', 'lightblue', x=ppg_x, y=ppg_y),
+                        dash.no_update, dash.no_update, None)
+            bucket = bucket_size(window, Constants.plot_width, Constants.decimation)
 
-        def update_graphs(n):
-            #if len(ecg) < 10:
-             #   return None, None
+            if since is None or ctx.triggered_id == 'my-slider':
+                # Full redraw of the decimated window, then keep extending from there
+                since, ((ecg_x, ecg_y), (ppg_x, ppg_y)) = window_data(self.buffer, ('ecg', 'ppg'), window, bucket,
+                                                                      Constants.decimation)
+                return (base_figure('ECG', 'red', x=ecg_x, y=ecg_y), base_figure('PPG', 'lightblue', x=ppg_x, y=ppg_y),
+                        dash.no_update, dash.no_update, since)
 
-            xticks = np.array(self.xticks)
-            ecg_fig = go.Figure()
-            ecg_fig.add_trace(go.Scatter(x=xticks, y=self.ecg, mode='lines', name='ECG', line=dict(color='red', width=5)))
-            ecg_fig.update_layout(title='ECG', plot_bgcolor='black', paper_bgcolor='black', font_color='white')
+            # Only the samples this browser has not seen yet
+            since, updates = extend_data(self.buffer, ('ecg', 'ppg'), since, window, bucket, Constants.decimation)
+            if updates is None:
+                return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
+            return dash.no_update, dash.no_update, updates[0], updates[1], since
+        pace(self.app, 'interval-component-graphs')
 
-            ppg_fig = go.Figure()
-            ppg_fig.add_trace(go.Scatter(x=xticks, y=self.ppg, mode='lines', name='PPG', line=dict(color='lightblue', width=5)))
-            ppg_fig.update_layout(title='PPG', plot_bgcolor='black', paper_bgcolor='black', font_color='white')
-            return ecg_fig, ppg_fig
+        if Constants.transport == 'push':
+            # Switch to the stream of the selected window; assets/stream.js reconnects when the URL changes
+            self.app.callback(Output('push-stream', 'data-url'), Input('my-slider', 'value'),
+                              prevent_initial_call=True)(self.stream_url)
 
         @self.app.callback(
             [Output('heart-rate-value', 'children'),
              Output('spo2-value', 'children'),
              Output('respiratory-rate-value', 'children'),
-             Output('body-temp-value', 'children')],
+             Output('body-temp-value', 'children'),
+             Output('connection-status', 'children'),
+             *[Output(card, 'style') for card in VITAL_CARDS]],
              Input('interval-component-vitals', 'n_intervals')
         )
+        @timed('callback_compute_seconds', 'Callback time before serialization', callback='update_vital_signs')
         def update_vital_signs(n):
+            return self.vital_signs() + tuple({'backgroundColor': color} for color in self.vital_colors())
+
+        @self.app.callback(
+            Output('btn_record', 'children'),
+            Input('btn_record', 'n_clicks'),
+            Input('interval-component-vitals', 'n_intervals'),
+            prevent_initial_call=True
+        )
+        def toggle_recording(n, n_vitals):
+            # The recorder copies from the ring buffer in its own thread, acquisition never waits for the disk.
+            # The vitals timer (or the push stream's vitals) refreshes the label in case the writer stopped.
+            if ctx.triggered_id == 'btn_record':
+                if self.recorder is not None and self.recorder.recording:
+                    self.recorder.stop()
+                else:
+                    self.recorder = Recorder(self.buffer, session_path(), Constants.record_channels,
+                                             Constants.sampling_rate)
+                    try:
+                        self.recorder.start()
+                    except OSError as e:
+                        self.recorder.error = e
+            return self.record_label()
+
+    def vital_signs(self):
+        if self.acquisition_error is not None:
+            return '--', '--', '--', '--', CONNECTION_FAILED.format(self.acquisition_error)
+        if not self.ready.is_set():
+            return '--', '--', '--', '--', CONNECTING
+        vitals = self.vitals
+        heart_rate = vitals['heart_rate']
+        spo2 = vitals['spo2']
+        respiratory_rate = vitals['respiratory_rate']  # NaN until it has a consistent estimate
+        body_temp = vitals['body_temp']  # NaN while the source has no temperature
+
+        return (
+            format_heart_rate(heart_rate), format_spo2(spo2), format_respiratory_rate(respiratory_rate),
+            '--' if np.isnan(body_temp) else f"{body_temp:.1f} °C", ''
+        )
+
+    def vital_colors(self):
+        # Card colours in VITALS order from the alarm engine's state (grey for vitals without a value)
+        vitals = self.vitals
+        return check_vital_signs(*(vitals[name] for name in VITALS), self.alarms.state[0])
+
+    def stream_url(self, choice):
+        return f'/stream/{choice}'
+
+    def envelopes(self, window):
+        # Min/max envelopes of the last `window` samples from the pyramid, per graph
+        end = self.pyramid.n_samples
+        return {graph_id: self.pyramid.envelope(channel, end - window, end, Constants.plot_width)
+                for graph_id, channel in (('ecg-plot', 'ecg'), ('ppg-plot', 'ppg'))}
+
+    def stream(self, choice):
+        # Flask view of /stream/<choice>
+        if choice not in self.publishers:
+            return 'Unknown window', 404
+        return self.publishers[choice].hub.response()
+
+    def notify_publishers(self):
+        # Called by acquisition after every write
+        for publisher in self.publishers.values():
+            publisher.notify()
+
+    def record_label(self):
+        # Record button text from the recorder's actual state
+        if self.recorder is not None and self.recorder.recording:
+            return 'Stop'
+        if self.recorder is not None and self.recorder.error is not None:
+            return f'Record (failed: {self.recorder.error})'
+        return 'Record'
 
-            heart_rate = np.random.randint(42, 140)
-            spo2 = np.random.randint(92, 100)
-            respiratory_rate = np.random.randint(12, 20)
-            body_temp = np.random.randint(34, 40)
+    def push_vital_signs(self):
+        ids = ('heart-rate-value', 'spo2-value', 'respiratory-rate-value', 'body-temp-value', 'connection-status')
+        vitals = {element_id: {'text': text} for element_id, text in zip(ids, self.vital_signs())}
+        vitals.update({card: {'color': color} for card, color in zip(VITAL_CARDS, self.vital_colors())})
+        vitals['btn_record'] = {'text': self.record_label()}
+        return vitals
 
-            #heart_rate_color, spo2_color, respiratory_rate_color, body_temp_color = check_vital_signs(
-             #   heart_rate, spo2, respiratory_rate, body_temp)
+    def raw_samples(self, start, stop):
+        # Raw ECG/PPG for the pyramid's short ranges, while the ring buffer still has them
+        if not self.buffer.is_valid(start) or stop > self.buffer.write_seq:
+            return None
+        _, view = self.buffer.read(start)
+        block = view[[self.buffer.index['ecg'], self.buffer.index['ppg']], :stop - start]
+        return block if self.buffer.is_valid(start) else None
 
-            return (
-                f"{heart_rate:.1f} bpm", f"{spo2} %", f"{respiratory_rate} /min", f"{body_temp:.1f} °C"
-            )
+    def process_block(self, ecg, ppg, ppg_red):
+        # Called by acquisition with every new block, so the beat detector, respiration and SpO2 engines see
+        # the whole stream however often (or whether) a browser asks for the vitals
+        self.respiration.process(ppg, self.beat_detector.process(ecg))
+        self.spo2.process(ppg, ppg_red)
+        self.vitals = {'heart_rate': self.beat_detector.heart_rate or np.nan, 'spo2': self.spo2.spo2,
+                       'respiratory_rate': self.respiration.respiratory_rate, 'body_temp': self.temperature.latest}
+        end = self.buffer.write_seq
+        if (end - len(ecg)) // Constants.sampling_rate != end // Constants.sampling_rate:
+            self.alarms.update([[self.vitals[name] for name in VITALS]])
 
     def run_soheil(self):
-        self.app.run(debug=True, use_reloader=False)
+        if Constants.transport == 'push':
+            for publisher in self.publishers.values():
+                publisher.start()
+        self.app.run(debug=True, use_reloader=False, port=Constants.server_port)
@@ -0,0 +1,172 @@
+# acquisition.py
+"""
+Acquisition and signal processing in a dedicated process, published through shared memory so
+several web worker processes (wsgi.py) can serve the UI without competing with it for the GIL.
+
+    python acquisition.py --beds 8                 # writer: <name>-bed<slot> buffers + <name>-status
+    gunicorn -w 4 --threads 16 -b :8050 wsgi:server  # readers, see wsgi.py
+
+Shared blocks (all read-only for the workers):
+    <name>-bed<slot>  SharedRingBuffer per bed with bed_registry.BUFFER_CHANNELS
+    <name>-status     SharedArray (max beds, 2 * len(VITALS)): current vitals, then alarm codes;
+                      its header lists the beds and is created last, so it also signals readiness
+"""
+import argparse
+import multiprocessing
+import signal
+import threading
+import time
+
+import numpy as np
+
+from alarm_engine import VITALS
+from bed_registry import synthetic_registry
+from shared_buffer import SharedArray, SharedRingBuffer
+
+DEFAULT_NAME = 'vitals'
+window_size = 2500
+
+
+def run_acquisition(name=DEFAULT_NAME, n_beds=1, window_size=window_size, ready=None, stop=None):
+    """
+    Runs the bed registry on the bundled recording (with its synthetic red PPG) and publishes it until `stop` is set (or
+    SIGTERM / Ctrl+C). Removes the shared blocks on the way out.
+
+    :param ready: Optional multiprocessing.Event set once the shared blocks exist
+    :param stop: Optional multiprocessing.Event to shut down
+    """
+    from spo2_engine import load_dual_recording
+
+    buffers = []
+
+    def shared_buffer(bed_id, slot, channels, capacity):
+        buffer = SharedRingBuffer.create(f'{name}-bed{slot}', channels, capacity, bed_id=bed_id)
+        buffers.append(buffer)
+        return buffer
+
+    registry = synthetic_registry(n_beds, load_dual_recording(), window_size, buffer_factory=shared_buffer)
+    n_vitals = len(VITALS)
+    beds = [[bed.bed_id, bed.slot, bed.buffer.name] for bed in registry.beds.values()]
+    status = SharedArray.create(f'{name}-status', (len(registry.alarms.state), 2 * n_vitals), fill=np.nan,
+                                beds=beds, vitals=list(VITALS), sampling_rate=registry.sampling_rate,
+                                window_size=window_size, block_time=registry.block_time)
+    status.array[:, n_vitals:] = 0
+
+    def publish_status():
+        for bed in list(registry.beds.values()):
+            status.array[bed.slot, :n_vitals] = [bed.vitals[v] for v in VITALS]
+        status.array[:, n_vitals:] = registry.alarms.state
+
+    registry.listeners.append(publish_status)
+    stop = stop or threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    registry.start()
+    if ready is not None:
+        ready.set()
+    try:
+        while not stop.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        registry.stop()
+        status.close()
+        for buffer in buffers:
+            buffer.close()
+
+
+def start_acquisition(name=DEFAULT_NAME, n_beds=1, window_size=window_size, timeout=30):
+    """
+    Starts run_acquisition in a child process and waits until its shared blocks exist.
+
+    :return: (process, stop event)
+    """
+    ready, stop = multiprocessing.Event(), multiprocessing.Event()
+    process = multiprocessing.Process(target=run_acquisition, args=(name, n_beds, window_size, ready, stop),
+                                      name='acquisition', daemon=True)
+    process.start()
+    if not ready.wait(timeout):
+        process.terminate()
+        raise RuntimeError('Acquisition process did not start')
+    return process, stop
+
+
+class SharedBed:
+    """
+    Read-only view of one bed published by the acquisition process; same attributes as
+    bed_registry.Bed as far as the web UI is concerned.
+    """
+    def __init__(self, bed_id, slot, buffer, status, sampling_rate):
+        self.bed_id = bed_id
+        self.slot = slot
+        self.buffer = buffer
+        self.sampling_rate = sampling_rate
+        self._status = status
+
+    @property
+    def vitals(self):
+        return dict(zip(VITALS, self._status.array[self.slot, :len(VITALS)].tolist()))
+
+
+class SharedRegistry:
+    """
+    Web-worker side of the multi-process deployment: attaches to the blocks of an acquisition
+    process and offers the BedRegistry interface multi_bed.create_app() uses (beds, alarm_codes,
+    listeners). start() runs the listeners (the push publishers) every block_time, since the pump
+    that would trigger them lives in the other process.
+    """
+    def __init__(self, status):
+        self.status = status
+        meta = status.meta
+        self.sampling_rate = meta['sampling_rate']
+        self.window_size = meta['window_size']
+        self.block_time = meta['block_time']
+        self.beds = {bed_id: SharedBed(bed_id, slot, SharedRingBuffer.attach(buffer), status, self.sampling_rate)
+                     for bed_id, slot, buffer in meta['beds']}
+        self.listeners = []
+        self._stop = threading.Event()
+
+    @classmethod
+    def attach(cls, name=DEFAULT_NAME, timeout=30):
+        """
+        Waits up to `timeout` seconds for the acquisition process to publish its blocks.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return cls(SharedArray.attach(f'{name}-status'))
+            except FileNotFoundError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f'No acquisition process publishing {name!r}; start acquisition.py first')
+                time.sleep(0.2)
+
+    def __getitem__(self, bed_id):
+        return self.beds[bed_id]
+
+    def __len__(self):
+        return len(self.beds)
+
+    def alarm_codes(self, bed_id):
+        return self.status.array[self.beds[bed_id].slot, len(VITALS):].astype(int)
+
+    def _run(self):
+        while not self._stop.wait(self.block_time):
+            for listener in self.listeners:
+                listener()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--beds', type=int, default=1)
+    parser.add_argument('--name', default=DEFAULT_NAME, help='prefix of the shared memory blocks')
+    args = parser.parse_args()
+    print(f'Publishing {args.beds} bed(s) as {args.name}-*; Ctrl+C to stop')
+    run_acquisition(args.name, args.beds)
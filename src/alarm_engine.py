@@ -1,4 +1,5 @@
 # alarm_engine.py
+import numpy as np
 
 # Define threshold ranges for vital signs
 HEART_RATE_RANGE = (60, 140)  # Normal heart rate range: 60-100 bpm
@@ -6,16 +7,113 @@ SPO2_RANGE = (95, 100)  # Normal SpO2 range: 95-100%
 RESPIRATORY_RATE_RANGE = (12, 20)  # Normal respiratory rate: 12-20 breaths per minute
 TEMP_RANGE = (36.5, 37.5)  # Normal body temperature range: 36.5-37.5 °C
 
-def check_vital_signs(heart_rate, spo2, respiratory_rate, body_temp):
+# Parameter order used by the vectorized engine (columns of the vitals arrays)
+VITALS = ('heart_rate', 'spo2', 'respiratory_rate', 'body_temp')
+DEFAULT_LIMITS = np.array([HEART_RATE_RANGE, SPO2_RANGE, RESPIRATORY_RATE_RANGE, TEMP_RANGE], dtype=float)
+# How far a value has to come back inside the range before an active alarm clears
+DEFAULT_HYSTERESIS = np.array([3, 1, 1, 0.2])
+
+# Severity codes
+NORMAL = 0
+LOW = 1
+HIGH = 2
+SEVERITY_COLORS = np.array(['black', '#66ccff', '#ff6666'])
+NO_VALUE_COLOR = '#444444'  # a vital without a value (e.g. before the first estimate) and no active alarm
+
+
+def evaluate_limits(values, low, high):
+    """
+    Stateless classification of any array of values against low/high limits (broadcasting).
+
+    :return: int8 array of severity codes (NORMAL, LOW or HIGH)
+    """
+    values = np.asarray(values, dtype=float)
+    return np.where(values < low, LOW, np.where(values > high, HIGH, NORMAL)).astype(np.int8)
+
+
+class AlarmEngine:
+    """
+    Alarm state for N beds x M parameters, evaluated in one numpy pass per update.
+
+    An active LOW/HIGH alarm only clears once the value is `hysteresis` back inside the range, and
+    a new severity only becomes the reported state after `debounce` consecutive updates agree, so
+    values hovering around a limit don't make alarms flicker. Missing values (NaN) keep the
+    current state.
+    """
+    def __init__(self, n_beds, limits=DEFAULT_LIMITS, hysteresis=DEFAULT_HYSTERESIS, debounce=3):
+        """
+        :param n_beds: Number of beds
+        :param limits: (low, high) per parameter, shape (M, 2), or per bed, shape (N, M, 2)
+        :param hysteresis: Per parameter, shape (M,)
+        :param debounce: Consecutive updates needed before the state changes
+        """
+        limits = np.asarray(limits, dtype=float)
+        self.limits = np.array(np.broadcast_to(limits, (n_beds,) + limits.shape[-2:]))
+        self._initial_limits = self.limits.copy()
+        self.hysteresis = np.asarray(hysteresis, dtype=float)
+        self.debounce = debounce
+        shape = self.limits.shape[:2]
+        self.state = np.zeros(shape, dtype=np.int8)
+        self._candidate = np.zeros(shape, dtype=np.int8)
+        self._count = np.zeros(shape, dtype=np.int16)
+
+    def set_limits(self, bed, limits):
+        """
+        Configures the (low, high) limits of one bed, shape (M, 2).
+        """
+        self.limits[bed] = limits
+
+    def reset(self, bed):
+        """
+        Clears one bed's alarms, pending debounce and limits (e.g. when its slot is reused).
+        """
+        self.limits[bed] = self._initial_limits[bed]
+        self.state[bed] = 0
+        self._candidate[bed] = 0
+        self._count[bed] = 0
+
+    def update(self, values):
+        """
+        :param values: Current vitals, shape (N, M), in VITALS order
+        :return: Severity codes after hysteresis and debounce, shape (N, M) (the engine's state array)
+        """
+        values = np.asarray(values, dtype=float)
+        low = self.limits[..., 0] + np.where(self.state == LOW, self.hysteresis, 0)
+        high = self.limits[..., 1] - np.where(self.state == HIGH, self.hysteresis, 0)
+        raw = evaluate_limits(values, low, high)
+        raw = np.where(np.isnan(values), self.state, raw)
+
+        changing = raw != self.state
+        same_candidate = changing & (raw == self._candidate)
+        self._count = np.where(same_candidate, self._count + 1, np.where(changing, 1, 0)).astype(np.int16)
+        self._candidate = np.where(changing, raw, self.state)
+
+        settled = self._count >= self.debounce
+        self.state[settled] = raw[settled]
+        self._count[settled] = 0
+        return self.state
+
+
+def severity_colors(codes, values=None):
+    """
+    Maps severity codes (any shape) to the display colours.
+
+    :param values: The vitals the codes are for; missing ones (NaN) without an active alarm are
+                   NO_VALUE_COLOR instead of the normal colour
+    """
+    codes = np.asarray(codes)
+    colors = SEVERITY_COLORS[codes]
+    if values is None:
+        return colors
+    return np.where(np.isnan(np.asarray(values, dtype=float)) & (codes == NORMAL), NO_VALUE_COLOR, colors)
+
+
+def check_vital_signs(heart_rate, spo2, respiratory_rate, body_temp, codes):
     """
-    This function checks if each vital sign is within its normal range.
-    It returns the color (blue, red, or black) for each vital sign based on whether 
-    it falls below or above the normal range.
+    Colours (black, blue, red, or grey without a value) of one patient's vitals: a view over the
+    severity codes an AlarmEngine reported for them, e.g. `alarms.state[0]` of a 1-bed engine.
     """
-    # Check if each vital sign is below or above the normal range
-    heart_rate_color = '#66ccff' if heart_rate < HEART_RATE_RANGE[0] else '#ff6666' if heart_rate > HEART_RATE_RANGE[1] else 'black'
-    spo2_color = '#66ccff' if spo2 < SPO2_RANGE[0] else '#ff6666' if spo2 > SPO2_RANGE[1] else 'black'
-    respiratory_rate_color = '#66ccff' if respiratory_rate < RESPIRATORY_RATE_RANGE[0] else '#ff6666' if respiratory_rate > RESPIRATORY_RATE_RANGE[1] else 'black'
-    body_temp_color = '#66ccff' if body_temp < TEMP_RANGE[0] else '#ff6666' if body_temp > TEMP_RANGE[1] else 'black'
+    heart_rate_color, spo2_color, respiratory_rate_color, body_temp_color = severity_colors(
+        codes, [heart_rate, spo2, respiratory_rate, body_temp]).tolist()
 
-    return heart_rate_color, spo2_color, respiratory_rate_color, body_temp_color
\ No newline at end of file
+    return heart_rate_color, spo2_color, respiratory_rate_color, body_temp_color
@@ -1,15 +1,23 @@
 import dash
 from dash import dcc, html
 import dash.dependencies as dd
-import plotly.graph_objs as go
-import pandas as pd
 import numpy as np
 import os
-from scipy.signal import butter, filtfilt
 
 # Import external processing engines
-from heart_rate_engine import calculate_heart_rate  # For heart rate calculation
-from alarm_engine import check_vital_signs  # For alarm checks
+from heart_rate_engine import BeatDetector, format_heart_rate  # For heart rate calculation
+from alarm_engine import AlarmEngine, check_vital_signs  # For alarm checks
+from decimation import bucket_size
+from figure_stream import base_figure, extend_data
+import metrics
+from metrics import timed
+from render_pacer import REQUEST, RUNNING, pace, pacer_components
+from replay import ReplaySource
+from respiration_engine import RespirationEstimator, format_respiratory_rate
+from ring_buffer import RingBuffer
+from spo2_engine import SpO2Engine, format_spo2, load_dual_recording
+from streaming_filter import StreamingFilter
+from tick_cache import TickCache, Ticker, cache_callbacks
 
 # Get the directory of the current script
 script_dir = os.path.dirname(os.path.realpath(__file__))
@@ -18,26 +26,37 @@ os.chdir(script_dir)
 # Initialize Dash app
 app = dash.Dash(__name__)
 app.title = "Vital Signs Monitoring System"
+metrics.serve(app.server)  # Prometheus metrics at /metrics
 
-# Load data
-ecg_df = pd.read_csv('../data/ECG.csv', header=None, names=['ECG'])
-ppg_df = pd.read_csv('../data/PPG.csv', header=None, names=['PPG'])
-temp_df = pd.read_csv('../data/TEMP.csv', header=None, names=['Temp'])
+# Load data (memory-mapped, converted from the CSVs on first run); PPG is the infrared channel and
+# PPG_RED its synthetic red pair for SpO2
+recording = load_dual_recording()
+ecg_data = recording['ECG']
+ppg_data = recording['PPG']
+temperature = recording.numeric('TEMP')  # change-only, looked up at the replayed sample times
 
-# Generate time series (1 ms per step)
-sampling_rate = 400  # 250 Hz sampling rate
-time_series = np.arange(0, len(ecg_df) * (1 / sampling_rate), 1 / sampling_rate)
+# Sampling rate from the recording header (time values are generated per window instead of for the whole recording)
+sampling_rate = recording.sampling_rate
 
 # Define a sliding window size
-window_size = 1000  # Display 1 second of data at 250 Hz
+window_size = 1000  # Display 2 seconds of data at 500 Hz
+plot_width = 1000  # Points per trace the plots are decimated to (about their pixel width)
+decimation = {'ecg': 'minmax', 'ppg': 'lttb'}  # Peak-preserving for ECG, shape-preserving for PPG
+# 'binary': traces go to the browser as base64 typed arrays with x as start + step (waveform_codec.py),
+# 'json': plain lists of numbers. assets/waveform.js turns either into the graphs' extendData.
+waveform_encoding = 'binary'
+waveform_dx = 1 / sampling_rate if waveform_encoding == 'binary' else None
 
 # Define layout
 app.layout = html.Div(style={'backgroundColor': 'black', 'color': 'white', 'padding': '20px'}, children=[
-    dcc.Interval(id='interval-component-graphs', interval=40, n_intervals=0),
+    # Graph refresh every 40 ms, slower while frames take longer (render_pacer.py)
+    *pacer_components('interval-component-graphs', interval=40),
+    dcc.Store(id='graph-seq'),
+    dcc.Store(id='graph-data'),
     dcc.Interval(id='interval-component-vitals', interval=1000, n_intervals=0),
     html.Div(style={'display': 'grid', 'gridTemplateColumns': 'repeat(5, 1fr)', 'gap': '10px'}, children=[
         html.Div(style={'gridColumn': 'span 4', 'gridRow': 'span 2', 'border': '1px solid white', 'padding': '10px'},
-                 children=[dcc.Graph(id='ecg-plot', config={'displayModeBar': False})]),
+                 children=[dcc.Graph(id='ecg-plot', figure=base_figure('ECG', 'red'), config={'displayModeBar': False})]),
         html.Div(id='heart-rate-container', style={'border': '1px solid white', 'padding': '10px'}, children=[
             html.Div(style={'display': 'flex', 'alignItems': 'center'}, children=[
                 html.H3("♥", style={'color': 'red', 'fontSize': '60px', 'margin': '0 10px 0 0'}),
@@ -51,7 +70,7 @@ app.layout = html.Div(style={'backgroundColor': 'black', 'color': 'white', 'padd
             ])
         ]),
         html.Div(style={'gridColumn': 'span 4', 'gridRow': 'span 2', 'border': '1px solid white', 'padding': '10px'},
-                 children=[dcc.Graph(id='ppg-plot', config={'displayModeBar': False})]),
+                 children=[dcc.Graph(id='ppg-plot', figure=base_figure('PPG', 'lightblue'), config={'displayModeBar': False})]),
         html.Div(id='spo2-container', style={'border': '1px solid white', 'padding': '10px'}, children=[
             html.Div(style={'display': 'flex', 'alignItems': 'center'}, children=[
                 html.H3("🫁", style={'color': 'white', 'fontSize': '60px', 'margin': '0 10px 0 0'}),
@@ -67,59 +86,95 @@ app.layout = html.Div(style={'backgroundColor': 'black', 'color': 'white', 'padd
     ]),
 ])
 
-# Global index to keep track of streaming data
-current_index = 0
-
-
-# Filter function
-def low_pass_filter(signal, cutoff_freq, sampling_rate, order=4, padding=True):
-    nyquist = 0.5 * sampling_rate
-    normal_cutoff = cutoff_freq / nyquist
-    b, a = butter(order, normal_cutoff, btype='low', analog=False)
-
-    if padding:
-        pad_len = 3 * max(len(b), len(a))
-        padded_signal = np.concatenate([signal[pad_len - 1::-1], signal, signal[:-pad_len - 1:-1]])
-        filtered_signal = filtfilt(b, a, padded_signal)
-        return filtered_signal[pad_len:-pad_len]
-    else:
-        return filtfilt(b, a, signal)
+# Replay speed of the recording (0.5-50, None = as fast as possible). Samples are due by the clock, not per poll.
+replay_speed = 1.0
+
+# Streaming filters: designed once, each frame only filters the samples that arrived since the last one.
+# The fixed-lag smoother (0.25 s) gives the display a near zero-phase trace like filtfilt did.
+display_lag = int(0.25 * sampling_rate)
+ecg_filter = StreamingFilter(cutoff_freq=40, sampling_rate=sampling_rate, smoothing_lag=display_lag, stage='ecg')
+ppg_filter = StreamingFilter(cutoff_freq=5, sampling_rate=sampling_rate, smoothing_lag=display_lag, stage='ppg')
+filtered = RingBuffer(('t', 'ecg', 'ppg'), 2 * window_size)
+# Incremental beat detection on the same stream, shared by HR and respiration
+ecg_detector = BeatDetector(sampling_rate)
+# Respiratory rate from the ECG beat amplitudes and the PPG pulse amplitude/baseline of the same stream
+respiration = RespirationEstimator(sampling_rate, ecg_detector)
+spo2_engine = SpO2Engine(sampling_rate)
+# Hysteresis and debounce for the vitals' colours, evaluated once per second of data
+alarms = AlarmEngine(1)
+alarm_tick = int(sampling_rate)
+# The first window (plus the smoother's lag) is due right away so the plots start full
+replay = ReplaySource(recording, ('ECG', 'PPG', 'PPG_RED'), speed=replay_speed,
+                      preroll=window_size + display_lag)
+latest_temp = temperature.at(replay.position(0))
+
+
+def advance_stream():
+    """
+    Filters the samples the replay clock says are due into the `filtered` buffer. Runs once per
+    data tick (see `ticker`), however many clients are polling.
+    """
+    global latest_temp
+    # After a long gap between polls (hidden tab, paced-down clients) only the newest window is
+    # processed instead of the whole backlog
+    skipped = replay.skipped
+    seq, block = replay.read(max_n=window_size + display_lag, skip=True)
+    if replay.skipped != skipped:
+        # The engines would take the jump for one continuous signal (false beats and intervals)
+        for engine in (ecg_detector, respiration, spo2_engine):
+            engine.reset()
+    if block.shape[1] == 0:
+        return
+    ecg, ppg, ppg_red = block
+    latest_temp = temperature.at(replay.position(seq + block.shape[1] - 1))
+
+    respiration.process(ppg, ecg_detector.process(ecg))
+    spo2_engine.process(ppg, ppg_red)
+    if seq // alarm_tick != (seq + block.shape[1]) // alarm_tick:
+        alarms.update([[ecg_detector.heart_rate or np.nan, spo2_engine.spo2, respiration.respiratory_rate,
+                        latest_temp]])
+    ecg_new = ecg_filter.process(ecg)
+    ppg_new = ppg_filter.process(ppg)
+    # Smoothed output lags the input, so timestamps follow the output sample count
+    t_new = (filtered.write_seq + np.arange(len(ecg_new))) / sampling_rate
+    filtered.extend(np.vstack([t_new, ecg_new, ppg_new]))
+
+
+# One data tick per graph poll interval: the stream advances once per tick and every client polling
+# within the tick sees the same samples, so identical requests get the same cached response bytes
+ticker = Ticker(lambda: filtered.write_seq, interval=0.04, on_tick=advance_stream)
+tick_cache = TickCache(max_age=2 * int(sampling_rate))
 
 
 @app.callback(
-    [dd.Output('ecg-plot', 'figure'),
-     dd.Output('ppg-plot', 'figure')],
-    [dd.Input('interval-component-graphs', 'n_intervals')]
+    [dd.Output('graph-data', 'data'),
+     dd.Output('graph-seq', 'data')],
+    [dd.Input(REQUEST, 'data')],
+    [dd.State('graph-seq', 'data')],
+    running=RUNNING
 )
-def update_graphs(n):
-    global current_index, ecg_df, ppg_df, time_series, window_size
-
-    start_index = current_index
-    end_index = current_index + window_size
-    if end_index > len(ecg_df):
-        end_index = len(ecg_df)
-        start_index = end_index - window_size
-        if start_index < 0:
-            start_index = 0
-
-    current_index = (current_index + 10) % len(ecg_df)
-
-    ecg_window = ecg_df['ECG'].iloc[start_index:end_index:2].to_numpy()
-    ppg_window = ppg_df['PPG'].iloc[start_index:end_index:2].to_numpy()
-    time_window = time_series[start_index:end_index:2]
-
-    ecg_filtered = low_pass_filter(ecg_window, cutoff_freq=40, sampling_rate=sampling_rate, padding=True)
-    ppg_filtered = low_pass_filter(ppg_window, cutoff_freq=5, sampling_rate=sampling_rate, padding=True)
-
-    ecg_fig = go.Figure()
-    ecg_fig.add_trace(go.Scatter(x=time_window, y=ecg_filtered, mode='lines', name='ECG', line=dict(color='red', width=5)))
-    ecg_fig.update_layout(title='ECG', plot_bgcolor='black', paper_bgcolor='black', font_color='white')
-
-    ppg_fig = go.Figure()
-    ppg_fig.add_trace(go.Scatter(x=time_window, y=ppg_filtered, mode='lines', name='PPG', line=dict(color='lightblue', width=5)))
-    ppg_fig.update_layout(title='PPG', plot_bgcolor='black', paper_bgcolor='black', font_color='white')
-
-    return ecg_fig, ppg_fig
+@timed('callback_compute_seconds', 'Callback time before serialization', callback='update_graphs')
+def update_graphs(n, since):
+    # Only the samples that arrived (by the replay clock) since the last tick are filtered
+    tick = ticker.seq()
+
+    # Send only the samples this browser has not seen (decimated); the figures were sent with the layout
+    bucket = bucket_size(window_size, plot_width, decimation)
+    since, updates = extend_data(filtered, ('ecg', 'ppg'), since, window_size, bucket, decimation, until=tick,
+                                 dx=waveform_dx)
+    if updates is None:
+        return dash.no_update, dash.no_update
+    return updates, since
+
+
+# Decoded in the browser into the graphs' extendData
+app.clientside_callback(
+    dd.ClientsideFunction(namespace='waveform', function_name='extendData'),
+    [dd.Output('ecg-plot', 'extendData'),
+     dd.Output('ppg-plot', 'extendData')],
+    [dd.Input('graph-data', 'data')]
+)
+pace(app, 'interval-component-graphs')
 
 
 @app.callback(
@@ -133,23 +188,19 @@ def update_graphs(n):
      dd.Output('body-temp-container', 'style')],
     [dd.Input('interval-component-vitals', 'n_intervals')]
 )
+@timed('callback_compute_seconds', 'Callback time before serialization', callback='update_vital_signs')
 def update_vital_signs(n):
-    global current_index, ecg_df, ppg_df, temp_df
-
-    start_index = current_index
-    end_index = current_index + window_size
-    ecg_window = ecg_df['ECG'].iloc[start_index:end_index]
-
-    heart_rate = calculate_heart_rate(ecg_window)
-    spo2 = np.random.randint(92, 100)
-    respiratory_rate = np.random.randint(12, 20)
-    body_temp = temp_df['Temp'].iloc[start_index % len(temp_df)]
+    heart_rate = ecg_detector.heart_rate or np.nan  # NaN before two beats were seen
+    spo2 = spo2_engine.spo2
+    respiratory_rate = respiration.respiratory_rate  # NaN until it has a consistent estimate
+    body_temp = latest_temp
 
     heart_rate_color, spo2_color, respiratory_rate_color, body_temp_color = check_vital_signs(
-        heart_rate, spo2, respiratory_rate, body_temp)
+        heart_rate, spo2, respiratory_rate, body_temp, alarms.state[0])
 
     return (
-        f"{heart_rate:.1f} bpm", f"{spo2} %", f"{respiratory_rate} /min", f"{body_temp:.1f} °C",
+        format_heart_rate(heart_rate), format_spo2(spo2), format_respiratory_rate(respiratory_rate),
+        f"{body_temp:.1f} °C",
         {'backgroundColor': heart_rate_color, 'color': 'white', 'fontWeight': 'bold'},
         {'backgroundColor': spo2_color, 'color': 'white', 'fontWeight': 'bold'},
         {'backgroundColor': respiratory_rate_color, 'color': 'white', 'fontWeight': 'bold'},
@@ -157,5 +208,14 @@ def update_vital_signs(n):
     )
 
 
+# Graph updates are shared by the clients at the same tick and position, vitals by all clients
+# within the same second of data
+vitals_tick = int(sampling_rate)
+cache_callbacks(app, tick_cache, {
+    'graph-seq.data': lambda inputs, state: (('graphs', state[0]), ticker.seq()),
+    'heart-rate-value.children': lambda inputs, state: ('vitals', ticker.seq() // vitals_tick * vitals_tick),
+})
+
+
 if __name__ == '__main__':
-    app.run_server(debug=True)
\ No newline at end of file
+    app.run(debug=True)
\ No newline at end of file
@@ -1,51 +1,74 @@
-import time
-
 import dash
-import dash_core_components as dcc
-import dash_html_components as html
+from dash import dcc, html
 import numpy as np
-import pandas as pd
-from dash.dependencies import Output, Input
-import plotly.graph_objs as go
+from dash.dependencies import Output, Input, State
 import serial
 import threading
-import collections
-from alarm_engine import check_vital_signs  # For alarm checks
+from alarm_engine import VITALS, AlarmEngine, check_vital_signs  # For alarm checks
+from decimation import bucket_size
+from figure_stream import base_figure, extend_data
+from heart_rate_engine import BeatDetector, format_heart_rate
+import metrics
+from metrics import timed
+from numeric_channel import NumericChannel
+from render_pacer import REQUEST, RUNNING, pace, pacer_components
+from replay import ReplaySource
+from respiration_engine import RespirationEstimator, format_respiratory_rate
+from serial_ingest import SerialIngest, make_parser
+from ring_buffer import RingBuffer
+from spo2_engine import SpO2Engine, format_spo2, load_dual_recording
+from tick_cache import TickCache, Ticker, cache_callbacks
 
 DEBUG = False
 class Constants:
     port = 'COM9'
     baud_rate = 9600
+    serial_format = 'text'  # 'text' (one line per sample) or 'binary' (framed, see serial_ingest.py)
+    serial_channels = 1  # ECG[, PPG (infrared)[, red PPG[, body temperature]]]
     sampling_rate = 500
     window_size = 5*sampling_rate
+    plot_width = 1000  # points per trace the plots are decimated to (about their pixel width)
+    decimation = {'ecg': 'minmax', 'ppg': 'lttb'}
+    replay_speed = 1.0  # recording playback speed without a device (0.5-50), None = as fast as possible
+    numeric_history = 86400  # changes kept per slow numeric (temperature), see numeric_channel.py
 
 class DashApp:
     def __init__(self,):
         # Serial port setup
         if DEBUG:
-            self.ser = serial.Serial(Constants.port, Constants.baud_rate, write_timeout=0)
+            self.ser = serial.Serial(Constants.port, Constants.baud_rate, timeout=0.05, write_timeout=0)
             self.ser.close()
             self.ser.open()
+            self.ingest = SerialIngest(self.ser, make_parser(Constants.serial_format, Constants.serial_channels))
         else:
-            ecg_df = pd.read_csv('../data/ECG.csv', header=None, names=['ECG'])
-            ppg_df = pd.read_csv('../data/PPG.csv', header=None, names=['PPG'])
-            self.ecg_array = ecg_df.to_numpy().reshape(-1)
-            self.ppg_array = ppg_df.to_numpy().reshape(-1)
-            self.ecg_idx = 0
-            self.ppg_idx = 0
-
-        self.data_buffer = collections.deque(maxlen=Constants.window_size)
-        self.xticks      = collections.deque(maxlen=Constants.window_size)
-        self.ecg_buffer = collections.deque(maxlen=Constants.window_size)
-        self.ppg_buffer = collections.deque(maxlen=Constants.window_size)
+            # PPG (infrared) plus its synthetic red pair, so SpO2 works without a device
+            self.recording = load_dual_recording()
+            self.replay = ReplaySource(self.recording, ('ECG', 'PPG', 'PPG_RED'), speed=Constants.replay_speed)
+            self.recorded_temperature = self.recording.numeric('TEMP')
+
+        self.buffer = RingBuffer(('t', 'ecg', 'ppg', 'ppg_red'), 2 * Constants.window_size)
+        self.beat_detector = BeatDetector(Constants.sampling_rate)
+        self.respiration = RespirationEstimator(Constants.sampling_rate, self.beat_detector)
+        self.spo2 = SpO2Engine(Constants.sampling_rate)
+        # Body temperature, change-only: the recording's TEMP or the device's fourth channel
+        self.temperature = NumericChannel(max_changes=Constants.numeric_history)
+        # Latest vitals, replaced by the serial thread after every block (process_block)
+        self.vitals = dict.fromkeys(VITALS, np.nan)
+        # Hysteresis and debounce for the vitals' colours, evaluated once per second of data
+        self.alarms = AlarmEngine(1)
 
         self.setup_serial_thread()
         self.xplot_idx = 0
+        # Every client polling within one tick sees the same samples and gets the same cached response
+        self.ticker = Ticker(lambda: self.buffer.write_seq, interval=0.05)
+        self.tick_cache = TickCache(max_age=2 * Constants.sampling_rate)
 
         # Dash app setup
         self.app = dash.Dash(__name__)
+        metrics.serve(self.app.server)
         self.app.layout = self.create_layout()
         self.setup_callbacks()
+        self.setup_tick_cache()
 
     def setup_serial_thread(self):
         # Start serial reading in a separate thread
@@ -56,37 +79,47 @@ class DashApp:
     def read_serial(self):
         while True:
             if DEBUG:
-                line = self.ser.read(self.ser.in_waiting).decode('utf-8').strip()
-                if line:
-                    self.data_buffer.append(float(line))
-                    if len(self.xticks)==0:
-                        last_tick = 0
-                    else:
-                        last_tick = self.xticks[-1] + 1/Constants.sampling_rate
-                    self.xticks.append(last_tick)
-                    # Todo filter self.ecg_filtered
+                # Blocks for up to the port timeout, then parses everything that arrived at once
+                _, samples = self.ingest.read_block()
+                k = samples.shape[1]
+                if k:
+                    block = np.full((4, k), np.nan)
+                    block[0] = (self.buffer.write_seq + np.arange(k)) / Constants.sampling_rate
+                    n = min(len(samples), 3)
+                    block[1:1 + n] = samples[:n]
+                    self.buffer.extend(block)
+                    if len(samples) > 3:  # a fourth channel carries the body temperature
+                        self.temperature.extend(block[0], samples[3])
+                    self.process_block(*block[1:])
             else:
-                if len(self.xticks) == 0:
-                    last_tick = 0
-                else:
-                    last_tick = self.xticks[-1] + 1 / Constants.sampling_rate
-                self.xticks.append(last_tick)
-                self.ecg_buffer.append(self.ecg_array[self.ecg_idx])
-                self.ppg_buffer.append(self.ppg_array[self.ppg_idx])
-                self.ecg_idx = (self.ecg_idx + 1) % len(self.ecg_array)
-                self.ppg_idx = (self.ppg_idx + 1) % len(self.ppg_array)
-                self.ecg_filtered = list(self.ecg_buffer)
-                self.ppg_filtered = list(self.ppg_buffer)
-                time.sleep(0.01)
+                # Paced by the clock at the recording's sampling rate (times Constants.replay_speed)
+                seq, samples = self.replay.next_block()
+                k = samples.shape[1]
+                t = self.replay.timestamps(seq, k)
+                self.buffer.extend(np.vstack([t, samples]))
+                self.temperature.append(t[-1], self.recorded_temperature.at(self.replay.position(seq + k - 1)))
+                self.process_block(*samples)
+
+    def process_block(self, ecg, ppg, ppg_red):
+        # Feeds every new block to the beat detector, respiration and SpO2 engines, so they see the whole
+        # stream however often (or whether) a browser asks for the vitals
+        self.respiration.process(ppg, self.beat_detector.process(ecg))
+        self.spo2.process(ppg, ppg_red)
+        self.vitals = {'heart_rate': self.beat_detector.heart_rate or np.nan, 'spo2': self.spo2.spo2,
+                       'respiratory_rate': self.respiration.respiratory_rate, 'body_temp': self.temperature.latest}
+        end = self.buffer.write_seq
+        if (end - len(ecg)) // Constants.sampling_rate != end // Constants.sampling_rate:
+            self.alarms.update([[self.vitals[name] for name in VITALS]])
 
     def create_layout(self):
         return html.Div(style={'backgroundColor': 'black', 'color': 'white', 'padding': '20px'}, children=[
-            dcc.Interval(id='interval-component-graphs', interval=50, n_intervals=0),
+            *pacer_components('interval-component-graphs', interval=50),
+            dcc.Store(id='graph-seq'),
             dcc.Interval(id='interval-component-vitals', interval=1000, n_intervals=0),
             html.Div(style={'display': 'grid', 'gridTemplateColumns': 'repeat(5, 1fr)', 'gap': '10px'}, children=[
                 html.Div(
                     style={'gridColumn': 'span 4', 'gridRow': 'span 2', 'border': '1px solid white', 'padding': '10px'},
-                    children=[dcc.Graph(id='ecg-plot', config={'displayModeBar': False})]),
+                    children=[dcc.Graph(id='ecg-plot', figure=base_figure('ECG', 'red'), config={'displayModeBar': False})]),
                 html.Div(id='heart-rate-container', style={'border': '1px solid white', 'padding': '10px'}, children=[
                     html.Div(style={'display': 'flex', 'alignItems': 'center'}, children=[
                         html.H3("♥", style={'color': 'red', 'fontSize': '60px', 'margin': '0 10px 0 0'}),
@@ -104,7 +137,7 @@ class DashApp:
                          ]),
                 html.Div(
                     style={'gridColumn': 'span 4', 'gridRow': 'span 2', 'border': '1px solid white', 'padding': '10px'},
-                    children=[dcc.Graph(id='ppg-plot', config={'displayModeBar': False})]),
+                    children=[dcc.Graph(id='ppg-plot', figure=base_figure('PPG', 'lightblue'), config={'displayModeBar': False})]),
                 html.Div(id='spo2-container', style={'border': '1px solid white', 'padding': '10px'}, children=[
                     html.Div(style={'display': 'flex', 'alignItems': 'center'}, children=[
                         html.H3("🫁", style={'color': 'white', 'fontSize': '60px', 'margin': '0 10px 0 0'}),
@@ -122,24 +155,23 @@ class DashApp:
         ])
     def setup_callbacks(self):
         @self.app.callback(
-            [Output('ecg-plot', 'figure'),
-             Output('ppg-plot', 'figure')],
-            [Input('interval-component-graphs', 'n_intervals')]
+            [Output('ecg-plot', 'extendData'),
+             Output('ppg-plot', 'extendData'),
+             Output('graph-seq', 'data')],
+            [Input(REQUEST, 'data')],
+            [State('graph-seq', 'data')],
+            running=RUNNING
         )
-        def update_graphs(n):
-            if len(self.ecg_filtered) < 10:
-                return None, None
-
-            xticks = np.array(self.xticks)
-
-            ecg_fig = go.Figure()
-            ecg_fig.add_trace(go.Scatter(x=xticks, y=self.ecg_filtered, mode='lines', name='ECG', line=dict(color='red', width=5)))
-            ecg_fig.update_layout(title='ECG', plot_bgcolor='black', paper_bgcolor='black', font_color='white')
-
-            ppg_fig = go.Figure()
-            ppg_fig.add_trace(go.Scatter(x=xticks, y=self.ppg_filtered, mode='lines', name='PPG', line=dict(color='lightblue', width=5)))
-            ppg_fig.update_layout(title='PPG', plot_bgcolor='black', paper_bgcolor='black', font_color='white')
-            return ecg_fig, ppg_fig
+        @timed('callback_compute_seconds', 'Callback time before serialization', callback='update_graphs')
+        def update_graphs(n, since):
+            # Only the samples this browser has not seen yet; the figure itself was sent with the layout
+            bucket = bucket_size(Constants.window_size, Constants.plot_width, Constants.decimation)
+            since, updates = extend_data(self.buffer, ('ecg', 'ppg'), since, Constants.window_size, bucket,
+                                         Constants.decimation, until=self.ticker.seq())
+            if updates is None:
+                return dash.no_update, dash.no_update, dash.no_update
+            return updates[0], updates[1], since
+        pace(self.app, 'interval-component-graphs')
 
         @self.app.callback(
             [Output('heart-rate-value', 'children'),
@@ -152,25 +184,38 @@ class DashApp:
              Output('body-temp-container', 'style')],
             [Input('interval-component-vitals', 'n_intervals')]
         )
+        @timed('callback_compute_seconds', 'Callback time before serialization', callback='update_vital_signs')
         def update_vital_signs(n):
 
-            heart_rate = np.random.randint(42, 140)
-            spo2 = np.random.randint(92, 100)
-            respiratory_rate = np.random.randint(12, 20)
-            body_temp = np.random.randint(34, 40)
+            vitals = self.vitals
+            heart_rate = vitals['heart_rate']
+            spo2 = vitals['spo2']
+            respiratory_rate = vitals['respiratory_rate']  # NaN until it has a consistent estimate
+            body_temp = vitals['body_temp']  # NaN while the source has no temperature
 
             heart_rate_color, spo2_color, respiratory_rate_color, body_temp_color = check_vital_signs(
-                heart_rate, spo2, respiratory_rate, body_temp)
+                heart_rate, spo2, respiratory_rate, body_temp, self.alarms.state[0])
 
             return (
-                f"{heart_rate:.1f} bpm", f"{spo2} %", f"{respiratory_rate} /min", f"{body_temp:.1f} °C",
+                format_heart_rate(heart_rate), format_spo2(spo2), format_respiratory_rate(respiratory_rate),
+                '--' if np.isnan(body_temp) else f"{body_temp:.1f} °C",
                 {'backgroundColor': heart_rate_color, 'color': 'white', 'fontWeight': 'bold'},
                 {'backgroundColor': spo2_color, 'color': 'white', 'fontWeight': 'bold'},
                 {'backgroundColor': respiratory_rate_color, 'color': 'white', 'fontWeight': 'bold'},
                 {'backgroundColor': body_temp_color, 'color': 'white', 'fontWeight': 'bold'}
             )
+    def setup_tick_cache(self):
+        # Graph updates are shared by the clients at the same tick and position, vitals by all
+        # clients within the same second of data
+        vitals_tick = Constants.sampling_rate
+        cache_callbacks(self.app, self.tick_cache, {
+            'graph-seq.data': lambda inputs, state: (('graphs', state[0]), self.ticker.seq()),
+            'heart-rate-value.children': lambda inputs, state: (
+                'vitals', self.ticker.seq() // vitals_tick * vitals_tick),
+        })
+
     def run(self):
-        self.app.run_server(debug=True, use_reloader=False)
+        self.app.run(debug=True, use_reloader=False)
 
 
 if __name__ == '__main__':
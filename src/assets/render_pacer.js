@@ -0,0 +1,70 @@
+// Adaptive refresh of the polled graphs (see render_pacer.py). The graph interval's ticks only
+// become graph requests while no request is in flight; the time from a request to the updated
+// graphs is averaged and the interval follows it, so a slow server or browser gets fewer, newer
+// frames instead of a growing queue of stale ones.
+(function () {
+    var SMOOTHING = 0.3;  // weight of the newest frame in the average cost
+    var STEP = 10;  // ms the interval is rounded up to
+    var HYSTERESIS = 0.2;  // relative change needed before the interval is updated
+
+    var state = {busy: false, sentAt: 0, sent: 0, dropped: 0, cost: null, interval: null};
+
+    function now() {
+        return window.performance.now();
+    }
+
+    // Runs `fn` before the next paint, i.e. after Dash and Plotly applied the response
+    function beforePaint(fn) {
+        window.requestAnimationFrame(fn);
+    }
+
+    // Interval to poll at for the average frame cost (the browser is busy with graphs for at most
+    // `duty` of the time), or no_update while it is close to the current one
+    function adapt(config) {
+        var target = Math.min(Math.max(state.cost / config.duty, config.min), config.max);
+        target = Math.ceil(target / STEP) * STEP;
+        if (state.interval !== null && Math.abs(target - state.interval) <= HYSTERESIS * state.interval) {
+            return window.dash_clientside.no_update;
+        }
+        state.interval = target;
+        return target;
+    }
+
+    function request(n, busy, config) {
+        var trigger = window.dash_clientside.callback_context.triggered_id;
+        if (trigger === undefined || trigger === null || busy) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        if (trigger !== config.busy_id) {
+            // A timer tick: dropped while a request is in flight (unless that looks lost)
+            if (state.busy && now() - state.sentAt < 10 * config.max) {
+                state.dropped += 1;
+                throw window.dash_clientside.PreventUpdate;
+            }
+            state.busy = true;
+            state.sentAt = now();
+            state.sent += 1;
+            return state.sent;
+        }
+        if (!state.busy) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        // The response arrived: the frame is done once the graphs are updated
+        var sentAt = state.sentAt;
+        beforePaint(function () {
+            var cost = now() - sentAt;
+            state.cost = state.cost === null ? cost : state.cost + SMOOTHING * (cost - state.cost);
+            state.busy = false;
+            var interval = adapt(config);
+            if (interval !== window.dash_clientside.no_update) {
+                window.dash_clientside.set_props(config.interval_id, {interval: interval});
+            }
+        });
+        throw window.dash_clientside.PreventUpdate;
+    }
+
+    window.renderPacer = state;
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        pacer: {request: request}
+    });
+})();
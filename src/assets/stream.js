@@ -0,0 +1,53 @@
+// Push transport (see push_stream.py): when the page contains an element with id "push-stream",
+// subscribe to the Server-Sent Events URL in its data-url attribute and apply the events directly
+// to the Plotly graphs and vital sign elements, instead of polling through dcc.Interval.
+(function () {
+    var source = null;
+    var url = null;
+
+    function graph(id) {
+        return document.querySelector('#' + id + ' .js-plotly-plot');
+    }
+
+    function each(data, fn) {
+        Object.keys(data).forEach(function (id) { fn(id, data[id]); });
+    }
+
+    function open(streamUrl) {
+        var es = new EventSource(streamUrl);
+        es.addEventListener('window', function (e) {
+            each(JSON.parse(e.data).traces, function (id, trace) {
+                var g = graph(id);
+                trace = window.waveformCodec.decodeTrace(trace);
+                if (g) { window.Plotly.restyle(g, {x: [trace.x], y: [trace.y]}, [0]); }
+            });
+        });
+        es.addEventListener('samples', function (e) {
+            each(JSON.parse(e.data).traces, function (id, update) {
+                var g = graph(id);
+                update = window.waveformCodec.decodeUpdate(update);
+                if (g) { window.Plotly.extendTraces(g, update[0], update[1], update[2]); }
+            });
+        });
+        es.addEventListener('vitals', function (e) {
+            each(JSON.parse(e.data), function (id, vital) {
+                var el = document.getElementById(id);
+                if (!el) { return; }
+                if (vital.text !== undefined) { el.textContent = vital.text; }
+                if (vital.color !== undefined) { el.style.backgroundColor = vital.color; }
+            });
+        });
+        return es;
+    }
+
+    // Dash renders (and in multi_bed.py re-renders) the layout after this script loaded
+    setInterval(function () {
+        var el = document.getElementById('push-stream');
+        var next = el && window.Plotly ? el.getAttribute('data-url') : null;
+        if (next !== url) {
+            if (source) { source.close(); }
+            url = next;
+            source = url ? open(url) : null;
+        }
+    }, 500);
+})();
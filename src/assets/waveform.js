@@ -0,0 +1,42 @@
+// Decoder for the compact waveform payloads of waveform_codec.py: y as a base64 typed array and
+// x as x0 + offset * dx. Used by stream.js (push transport) and by the waveform.extendData
+// clientside callback (polling), which turns the server's encoded updates into extendData.
+(function () {
+    var TYPES = {i1: Int8Array, u1: Uint8Array, i2: Int16Array, u2: Uint16Array, i4: Int32Array, u4: Uint32Array,
+                 f4: Float32Array, f8: Float64Array};
+
+    function decodeArray(spec) {
+        // Little endian on the wire, which is the byte order of every browser platform
+        var bytes = atob(spec.bdata);
+        var buffer = new Uint8Array(bytes.length);
+        for (var i = 0; i < bytes.length; i++) { buffer[i] = bytes.charCodeAt(i); }
+        return new TYPES[spec.dtype](buffer.buffer);
+    }
+
+    // {x0, dx, y[, xi]} -> {x: [...], y: [...]}; plain JSON traces are passed through
+    function decodeTrace(trace) {
+        if (!trace || trace.x0 === undefined) { return trace; }
+        var y = decodeArray(trace.y);
+        var offsets = trace.xi ? decodeArray(trace.xi) : null;
+        var x = new Array(y.length);
+        for (var i = 0; i < y.length; i++) { x[i] = trace.x0 + (offsets ? offsets[i] : i) * trace.dx; }
+        return {x: x, y: Array.from(y)};
+    }
+
+    // [trace, trace indices, max points] -> Plotly.extendTraces arguments
+    function decodeUpdate(update) {
+        if (!update || update[0].x0 === undefined) { return update; }
+        var trace = decodeTrace(update[0]);
+        return [{x: [trace.x], y: [trace.y]}, update[1], update[2]];
+    }
+
+    window.waveformCodec = {decodeTrace: decodeTrace, decodeUpdate: decodeUpdate};
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        waveform: {
+            extendData: function (updates) {
+                if (!updates) { throw window.dash_clientside.PreventUpdate; }
+                return updates.map(decodeUpdate);
+            }
+        }
+    });
+})();
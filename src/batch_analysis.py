@@ -0,0 +1,210 @@
+# batch_analysis.py
+"""
+Offline analysis of whole recordings: heart rate / pulse rate / temperature trend (one row per
+second), alarm episodes and summary statistics over every sample.
+
+    python batch_analysis.py                                   # the bundled recording
+    python batch_analysis.py ../data/sessions/*.vsc -o results --workers 8
+
+Recordings are split into chunks that are processed in a process pool. Each chunk is read with
+enough overlap on both sides for the zero-phase filter and the heart rate window, and only owns
+the output rows of its core, so the stitched result is the same as one pass over the recording.
+Trend and episodes are written as Parquet when pyarrow is installed, CSV otherwise.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from alarm_engine import DEFAULT_LIMITS, evaluate_limits
+from heart_rate_engine import calculate_heart_rate
+from recording import DEFAULT_RECORDING, load_recording
+from streaming_filter import low_pass_filter
+
+CHANNELS = ('ECG', 'PPG', 'TEMP')
+SEVERITY_NAMES = ('normal', 'low', 'high')
+
+_open_sources = {}  # per worker process: path -> opened recording
+
+
+def open_source(path):
+    """
+    Recording (.vsr) or recorded session (.vsc) as (sampling rate, n samples, read(start, stop)),
+    where read returns {CHANNEL: values} (missing channels are NaN). Cached per process.
+    """
+    if path not in _open_sources:
+        if path.endswith('.vsc'):
+            from recorder import SessionReader
+
+            session = SessionReader(path)
+
+            def read(start, stop):
+                data = {name.upper(): values for name, values in session.read_samples(start, stop).items()}
+                return {name: data.get(name, np.full(stop - start, np.nan)) for name in CHANNELS}
+            _open_sources[path] = (session.sampling_rate, session.n_samples, read)
+        else:
+            recording = load_recording(path)
+
+            def read(start, stop):
+                # Numeric channels (stored change-only) are held at every sample of the chunk
+                t = np.arange(start, stop) / recording.sampling_rate
+                return {name: np.asarray(recording[name][start:stop], dtype=float) if name in recording.channels
+                        else recording.numerics[name].at(t) if name in recording.numerics
+                        else np.full(stop - start, np.nan) for name in CHANNELS}
+            _open_sources[path] = (recording.sampling_rate, recording.n_samples, read)
+    return _open_sources[path]
+
+
+def chunk_bounds(n_samples, sampling_rate, chunk_seconds):
+    # Chunk edges on whole seconds so every per-second row belongs to exactly one chunk
+    step = int(round(chunk_seconds)) * int(round(sampling_rate))
+    return [(start, min(start + step, n_samples)) for start in range(0, n_samples, step)]
+
+
+def analyse_chunk(path, start, stop, hr_window=5.0, margin=2.0):
+    """
+    Analyses the core [start, stop) of a recording. Runs in a worker process.
+
+    :param hr_window: Seconds of signal behind each heart rate value
+    :param margin: Extra seconds read on both sides so filter edge effects stay outside the core
+    :return: (trend rows as dict of columns, partial statistics per channel)
+    """
+    fs, n_samples, read = open_source(path)
+    rate = int(round(fs))
+    pad = int((hr_window + margin) * fs)
+    lo, hi = max(start - pad, 0), min(stop + int(margin * fs), n_samples)
+    data = read(lo, hi)
+
+    ecg = low_pass_filter(data['ECG'], cutoff_freq=40, sampling_rate=fs)
+    ppg = low_pass_filter(data['PPG'], cutoff_freq=5, sampling_rate=fs) \
+        if not np.isnan(data['PPG']).all() else data['PPG']
+    window = int(hr_window * fs)
+
+    # One row per whole second inside the core, each looking back hr_window seconds
+    ends = np.arange(-(-max(start, window) // rate) * rate, stop, rate)
+    rows = {name: [] for name in ('time', 'heart_rate', 'pulse_rate', 'body_temp', 'heart_rate_alarm',
+                                  'body_temp_alarm')}
+    for end in ends:
+        i, j = end - window - lo, end - lo
+        heart_rate = calculate_heart_rate(ecg[i:j], fs) or np.nan
+        pulse_rate = np.nan
+        if not np.isnan(ppg[i:j]).any():
+            pulse_rate = calculate_heart_rate(ppg[i:j], fs) or np.nan
+        temp = data['TEMP'][i:j]
+        body_temp = np.nanmean(temp) if not np.isnan(temp).all() else np.nan
+        # Stateless per row (no hysteresis/debounce), so chunks don't depend on each other
+        hr_code, _, _, temp_code = evaluate_limits([heart_rate, np.nan, np.nan, body_temp], DEFAULT_LIMITS[:, 0],
+                                                   DEFAULT_LIMITS[:, 1])
+        rows['time'].append(end / fs)
+        rows['heart_rate'].append(heart_rate)
+        rows['pulse_rate'].append(pulse_rate)
+        rows['body_temp'].append(body_temp)
+        rows['heart_rate_alarm'].append(int(hr_code))
+        rows['body_temp_alarm'].append(int(temp_code))
+
+    # count, sum, sum of squares, min, max of the raw core samples, combined in the parent
+    stats = {}
+    for name, values in data.items():
+        core = values[start - lo:stop - lo]
+        core = core[~np.isnan(core)]
+        stats[name] = [len(core), float(core.sum()), float(np.square(core).sum()),
+                       float(core.min()) if len(core) else np.nan, float(core.max()) if len(core) else np.nan]
+    return rows, stats
+
+
+def combine_stats(partials):
+    summary = {}
+    for name in CHANNELS:
+        parts = np.array([p[name] for p in partials], dtype=float)
+        n = parts[:, 0].sum()
+        if n == 0:
+            continue
+        mean = parts[:, 1].sum() / n
+        std = float(np.sqrt(max(parts[:, 2].sum() / n - mean ** 2, 0)))
+        summary[name] = {'samples': int(n), 'mean': mean, 'std': std, 'min': float(np.nanmin(parts[:, 3])),
+                         'max': float(np.nanmax(parts[:, 4]))}
+    return summary
+
+
+def alarm_episodes(trend, sampling_interval=1.0):
+    """
+    Contiguous runs of the same non-normal alarm state per vital, from the stitched trend.
+    """
+    episodes = []
+    for vital in ('heart_rate', 'body_temp'):
+        codes = trend[f'{vital}_alarm'].to_numpy()
+        edges = np.flatnonzero(np.diff(codes, prepend=-1, append=-1)) if len(codes) else np.empty(0, int)
+        for first, last in zip(edges[:-1], edges[1:]):
+            if codes[first] == 0:
+                continue
+            values = trend[vital].to_numpy()[first:last]
+            extreme = np.nanmin(values) if codes[first] == 1 else np.nanmax(values)
+            episodes.append({'vital': vital, 'severity': SEVERITY_NAMES[codes[first]],
+                             'start': trend['time'].iat[first] - sampling_interval, 'end': trend['time'].iat[last - 1],
+                             'duration': (last - first) * sampling_interval, 'extreme': extreme})
+    return pd.DataFrame(episodes, columns=['vital', 'severity', 'start', 'end', 'duration', 'extreme'])
+
+
+def write_table(frame, path_stem, fmt):
+    if fmt == 'parquet':
+        frame.to_parquet(path_stem + '.parquet', index=False)
+        return path_stem + '.parquet'
+    frame.to_csv(path_stem + '.csv', index=False)
+    return path_stem + '.csv'
+
+
+def analyse(path, executor, chunk_seconds=60, hr_window=5.0):
+    """
+    :return: (trend DataFrame, episodes DataFrame, summary dict)
+    """
+    fs, n_samples, _ = open_source(path)
+    bounds = chunk_bounds(n_samples, fs, chunk_seconds)
+    futures = [executor.submit(analyse_chunk, path, start, stop, hr_window) for start, stop in bounds]
+    results = [future.result() for future in futures]  # in chunk order, so the rows stay sorted
+
+    trend = pd.DataFrame({column: np.concatenate([rows[column] for rows, _ in results])
+                          for column in results[0][0]})
+    summary = {'path': os.path.abspath(path), 'sampling_rate': fs, 'samples': n_samples,
+               'duration': n_samples / fs, 'channels': combine_stats([stats for _, stats in results]),
+               'heart_rate': {'mean': float(trend['heart_rate'].mean()), 'min': float(trend['heart_rate'].min()),
+                              'max': float(trend['heart_rate'].max())}}
+    return trend, alarm_episodes(trend), summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', default=[DEFAULT_RECORDING], help='.vsr recordings or .vsc sessions')
+    parser.add_argument('-o', '--output', default='batch_results', help='output directory')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes (default: all cores)')
+    parser.add_argument('--chunk', type=float, default=60, help='seconds of signal per task (default 60)')
+    parser.add_argument('--hr-window', type=float, default=5.0, help='seconds behind each heart rate value')
+    parser.add_argument('--format', choices=('parquet', 'csv'), help='default: parquet if pyarrow is installed')
+    args = parser.parse_args()
+
+    fmt = args.format
+    if fmt is None:
+        try:
+            import pyarrow  # noqa: F401
+            fmt = 'parquet'
+        except ImportError:
+            fmt = 'csv'
+
+    os.makedirs(args.output, exist_ok=True)
+    if args.paths == [DEFAULT_RECORDING]:
+        load_recording()  # convert the bundled CSVs once, before the workers open the file
+    with ProcessPoolExecutor(args.workers) as executor:
+        for path in args.paths:
+            started = time.perf_counter()
+            trend, episodes, summary = analyse(path, executor, args.chunk, args.hr_window)
+            elapsed = time.perf_counter() - started
+            stem = os.path.join(args.output, os.path.splitext(os.path.basename(path))[0])
+            written = [write_table(trend, stem + '_trend', fmt), write_table(episodes, stem + '_episodes', fmt)]
+            with open(stem + '_summary.json', 'w') as f:
+                json.dump(summary, f, indent=2)
+            print(f'{path}: {summary["duration"]:.0f} s of signal in {elapsed:.2f} s '
+                  f'({summary["samples"] / elapsed:,.0f} samples/s, {args.workers} workers), '
+                  f'{len(episodes)} alarm episodes -> {", ".join(written)}, {stem}_summary.json')
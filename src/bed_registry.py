@@ -0,0 +1,248 @@
+# bed_registry.py
+import threading
+import time
+
+import numpy as np
+
+from alarm_engine import AlarmEngine, VITALS
+from heart_rate_engine import BeatDetector
+from metrics import counter, histogram
+from numeric_channel import NumericChannel
+from respiration_engine import RespirationEstimator
+from ring_buffer import RingBuffer
+from spo2_engine import SpO2Engine
+from streaming_filter import StreamingFilter
+
+# 'ppg' is the infrared PPG, 'ppg_red' its red pair for SpO2 (NaN when the source has only one PPG)
+SOURCE_CHANNELS = ('ecg', 'ppg', 'ppg_red')
+BUFFER_CHANNELS = ('t', 'ecg', 'ppg', 'ppg_red', 'ecg_filtered', 'ppg_filtered')
+# Slow numerics, kept change-only per bed instead of at waveform rate (see numeric_channel.py)
+NUMERIC_CHANNELS = ('temp',)
+NUMERIC_HISTORY = 86400  # changes kept per numeric channel
+
+pump_cycle_seconds = histogram('pump_cycle_seconds', 'BedRegistry pump cycle time (all beds)')
+pumped_samples = counter('pumped_samples_total', 'Samples pumped per bed')
+
+
+class RecordingSource:
+    """
+    Loops over a recording, starting at `offset` samples. read(n) returns the next n samples as a
+    (3, n) block in SOURCE_CHANNELS order (red PPG is NaN for recordings without PPG_RED); the
+    registry decides how many samples are due. numerics() gives the temperature at the last one.
+    """
+    def __init__(self, recording, offset=0):
+        self.sampling_rate = recording.sampling_rate
+        red = recording.channels.get('PPG_RED', np.full(len(recording), np.nan, dtype=np.float32))
+        self._channels = [recording['ECG'], recording['PPG'], red]
+        self._temp = recording.numeric('TEMP')
+        self._pos = offset % len(recording)
+
+    def read(self, n):
+        idx = np.arange(self._pos, self._pos + n) % len(self._channels[0])
+        self._pos = (self._pos + n) % len(self._channels[0])
+        return np.vstack([channel[idx] for channel in self._channels]).astype(float)
+
+    def numerics(self):
+        return {'temp': self._temp.at((self._pos - 1) % len(self._channels[0]) / self.sampling_rate)}
+
+
+class SerialSource:
+    """
+    Acquisition board on a serial port sending channels in SOURCE_CHANNELS order. read() ignores
+    the requested count and returns whatever has arrived (non-blocking), with NaN for channels the
+    board does not send. A fourth channel, if sent, is the body temperature.
+    """
+    def __init__(self, port, sampling_rate, baud_rate=9600, mode='binary', n_channels=2):
+        import serial
+        from serial_ingest import SerialIngest, make_parser
+
+        self.sampling_rate = sampling_rate
+        self.ingest = SerialIngest(serial.Serial(port, baud_rate, timeout=0), make_parser(mode, n_channels))
+        self._temp = np.nan
+
+    def read(self, n):
+        _, samples = self.ingest.read_block()
+        rows = min(len(samples), len(SOURCE_CHANNELS))
+        block = np.full((len(SOURCE_CHANNELS), samples.shape[1]), np.nan)
+        block[:rows] = samples[:rows]
+        if len(samples) > rows and samples.shape[1]:
+            self._temp = float(samples[rows, -1])
+        return block
+
+    def numerics(self):
+        return {'temp': self._temp}
+
+
+class Bed:
+    """
+    One patient: an acquisition source plus its own buffers, filters, beat detector, respiration
+    and SpO2 engines and vitals.
+    Only the registry's pump thread calls ingest(); the web callbacks read `buffer` and `vitals`.
+    """
+    def __init__(self, bed_id, source, window_size, slot=0, buffer=None):
+        """
+        :param buffer: Ring buffer with BUFFER_CHANNELS (e.g. in shared memory); a local one by default
+        """
+        self.bed_id = bed_id
+        self.slot = slot  # row of this bed in the registry's alarm arrays
+        self.source = source
+        self.sampling_rate = source.sampling_rate
+        self.buffer = buffer if buffer is not None else RingBuffer(BUFFER_CHANNELS, 2 * window_size)
+        self.ecg_filter = StreamingFilter(cutoff_freq=40, sampling_rate=self.sampling_rate, stage='ecg')
+        self.ppg_filter = StreamingFilter(cutoff_freq=5, sampling_rate=self.sampling_rate, stage='ppg')
+        self.beat_detector = BeatDetector(self.sampling_rate)
+        self.respiration = RespirationEstimator(self.sampling_rate, self.beat_detector)
+        self.spo2 = SpO2Engine(self.sampling_rate)
+        self.numerics = {name: NumericChannel(max_changes=NUMERIC_HISTORY) for name in NUMERIC_CHANNELS}
+        self.vitals = dict.fromkeys(VITALS, np.nan)
+
+    def pump(self, n):
+        block = self.source.read(n)
+        self.ingest(block, self.source.numerics())
+
+    def ingest(self, block, numerics=None):
+        """
+        :param block: Raw samples in SOURCE_CHANNELS order, shape (3, k): ECG, PPG (IR), red PPG
+        :param numerics: Current values of NUMERIC_CHANNELS (at the block's last sample), by name
+        """
+        k = block.shape[1]
+        if k == 0:
+            return
+        ecg, ppg, ppg_red = block
+        t = (self.buffer.write_seq + np.arange(k)) / self.sampling_rate
+        self.respiration.process(ppg, self.beat_detector.process(ecg))
+        self.spo2.process(ppg, ppg_red)
+        self.buffer.extend(np.vstack([t, ecg, ppg, ppg_red, self.ecg_filter.process(ecg),
+                                      self.ppg_filter.process(ppg)]))
+
+        self.vitals['heart_rate'] = self.beat_detector.heart_rate or np.nan
+        self.vitals['respiratory_rate'] = self.respiration.respiratory_rate
+        self.vitals['spo2'] = self.spo2.spo2
+        for name, value in (numerics or {}).items():
+            self.numerics[name].append(t[-1], value)
+        temp = (numerics or {}).get('temp', np.nan)
+        if not np.isnan(temp):
+            self.vitals['body_temp'] = temp
+
+
+class BedRegistry:
+    """
+    Hosts many beds in one process. A single pump thread wakes every `block_time` seconds, reads
+    the samples that are due from every source and pushes them through each bed's pipeline in
+    blocks, so the per-sample Python overhead is amortised across the block.
+
+    The pump is one thread sharing the GIL with the web server. A bed costs about 1 ms of CPU per
+    20 ms cycle (10 samples at 500 Hz), mostly per-call overhead, so one pump saturates a core at
+    about 20 beds; 32 beds kept it 98-100% busy with cycles of 80-120 ms. The target is 8 beds per
+    pump: `python multi_bed.py --beds 8 --check 30` measured 0.37 core with the pump busy 40-53%.
+    On the 1-core development VM the worst cycles still reach 45-65 ms because the VM is descheduled
+    (steal time), so --check passes there only for a single bed.
+    Running it in its own process (acquisition.py) keeps the web server off its GIL.
+    """
+    def __init__(self, sampling_rate, window_size, block_time=0.02, max_beds=64, buffer_factory=None):
+        """
+        :param buffer_factory: Optional callable (bed_id, slot, channels, capacity) -> ring buffer for new
+                               beds, e.g. SharedRingBuffer.create (see acquisition.py)
+        """
+        self.sampling_rate = sampling_rate
+        self.buffer_factory = buffer_factory
+        self.window_size = window_size
+        self.block_time = block_time
+        self.beds = {}
+        self.alarms = AlarmEngine(max_beds)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.listeners = []  # callables run by the pump thread after every cycle (e.g. push publishers)
+        # Pump statistics: cycles, busy seconds, worst cycle, samples per bed
+        self.stats = {'cycles': 0, 'busy': 0.0, 'max_cycle': 0.0, 'samples': 0}
+
+    def add_bed(self, bed_id, source):
+        with self._lock:
+            free = sorted(set(range(len(self.alarms.state))) - {bed.slot for bed in self.beds.values()})
+            if not free:
+                raise ValueError(f'Registry is limited to {len(self.alarms.state)} beds')
+            buffer = None
+            if self.buffer_factory is not None:
+                buffer = self.buffer_factory(bed_id, free[0], BUFFER_CHANNELS, 2 * self.window_size)
+            bed = Bed(bed_id, source, self.window_size, slot=free[0], buffer=buffer)
+            self.beds[bed_id] = bed
+            return bed
+
+    def remove_bed(self, bed_id):
+        with self._lock:
+            bed = self.beds.pop(bed_id)
+            self.alarms.reset(bed.slot)
+
+    def __getitem__(self, bed_id):
+        return self.beds[bed_id]
+
+    def __len__(self):
+        return len(self.beds)
+
+    def pump(self, n):
+        """
+        Moves n samples per bed through the pipelines and re-evaluates the alarms.
+        """
+        with self._lock:
+            beds = list(self.beds.values())
+        for bed in beds:
+            bed.pump(n)
+        self.evaluate_alarms(beds)
+        for listener in self.listeners:
+            listener()
+
+    def evaluate_alarms(self, beds=None):
+        """
+        Runs the alarm engine over all beds at once; empty slots are NaN and keep their state.
+        """
+        beds = list(self.beds.values()) if beds is None else beds
+        values = np.full(self.alarms.state.shape, np.nan)
+        for bed in beds:
+            values[bed.slot] = [bed.vitals[name] for name in VITALS]
+        return self.alarms.update(values)
+
+    def alarm_codes(self, bed_id):
+        """
+        Severity codes of one bed in VITALS order.
+        """
+        return self.alarms.state[self.beds[bed_id].slot]
+
+    def _run(self):
+        start = time.monotonic()
+        sent = 0
+        while not self._stop.is_set():
+            cycle_start = time.monotonic()
+            due = int((cycle_start - start) * self.sampling_rate) - sent
+            if due > 0:
+                self.pump(due)
+                sent += due
+                self.stats['samples'] = sent
+                pumped_samples.inc(due)
+            busy = time.monotonic() - cycle_start
+            pump_cycle_seconds.observe(busy)
+            self.stats['cycles'] += 1
+            self.stats['busy'] += busy
+            self.stats['max_cycle'] = max(self.stats['max_cycle'], busy)
+            self._stop.wait(max(self.block_time - busy, 0))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def synthetic_registry(n_beds, recording, window_size, **kwargs):
+    """
+    Registry with n_beds beds replaying the same recording at evenly spread offsets, for load
+    testing without hardware.
+    """
+    registry = BedRegistry(recording.sampling_rate, window_size, max_beds=max(n_beds, 64), **kwargs)
+    for i in range(n_beds):
+        registry.add_bed(f'bed-{i + 1:02d}', RecordingSource(recording, offset=i * len(recording) // n_beds))
+    return registry
@@ -0,0 +1,568 @@
+# benchmark.py
+"""
+Headless benchmarks of the ingest -> filter -> detect -> render pipeline on the bundled recording.
+Every case drives the real code path (Farzad.acquire, SerialIngest, the engines, the figure helpers
+and full Dash callback round-trips through the Flask test client) and reports throughput, p50/p99
+latency per call and peak traced memory.
+
+    python benchmark.py                                  # all cases, table on stdout
+    python benchmark.py -o results.json                  # also save the results
+    python benchmark.py -k dash -k filter                # only cases whose name contains 'dash' or 'filter'
+    python benchmark.py -o new.json --compare old.json   # p50 / throughput change against an earlier run
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+CASES = {}
+
+
+def case(name, unit='calls'):
+    """
+    Registers a benchmark. The decorated function does the setup and returns (fn, items): fn is
+    timed per call and processes `items` units (samples, frames, ...) each time.
+    """
+    def register(setup):
+        CASES[name] = (setup, unit)
+        return setup
+    return register
+
+
+class MemorySerial:
+    """
+    In-memory stand-in for a serial port (read()/in_waiting) that loops over the given bytes.
+    """
+    def __init__(self, data, chunk=4096):
+        self.data = data
+        self.chunk = chunk
+        self.pos = 0
+
+    @property
+    def in_waiting(self):
+        return self.chunk
+
+    def read(self, n):
+        if self.pos + n > len(self.data):
+            self.pos = 0
+        block = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return block
+
+
+def callback_body(outputs, inputs, state=()):
+    """
+    JSON body of a /_dash-update-component request, as the dash renderer sends it.
+
+    :param outputs: List of (component id, property)
+    :param inputs: List of (component id, property, value); `state` likewise
+    """
+    specs = [{'id': i, 'property': p} for i, p in outputs]
+    name = '..' + '...'.join(f'{i}.{p}' for i, p in outputs) + '..' if len(outputs) > 1 else \
+        f'{outputs[0][0]}.{outputs[0][1]}'
+    return {'output': name, 'outputs': specs if len(specs) > 1 else specs[0], 'changedPropIds': [],
+            'inputs': [{'id': i, 'property': p, 'value': v} for i, p, v in inputs],
+            'state': [{'id': i, 'property': p, 'value': v} for i, p, v in state]}
+
+
+def dash_call(client, outputs, inputs, state=()):
+    """
+    POSTs one callback round-trip the way the dash renderer does.
+
+    :param outputs: List of (component id, property)
+    :param inputs: List of (component id, property, value); `state` likewise
+    :return: Decoded response (the 'response' dict of the Dash reply)
+    """
+    body = callback_body(outputs, inputs, state)
+    name = body['output']
+    response = client.post('/_dash-update-component', json=body)
+    if response.status_code == 204:
+        return {}
+    if response.status_code != 200:
+        raise RuntimeError(f'Callback {name} failed with HTTP {response.status_code}')
+    return response.get_json()['response']
+
+
+def recording_data():
+    from recording import load_recording
+
+    recording = load_recording()
+    return recording, np.asarray(recording['ECG'], dtype=float), np.asarray(recording['PPG'], dtype=float)
+
+
+def farzad(prefill=0):
+    """
+    The monitor GUI as main_RB.MainOP sets it up (recording playback, layout and callbacks), without
+    starting its threads. The replay runs unthrottled, so acquire() returns one block immediately.
+    """
+    from get_data import Farzad
+
+    gui = Farzad()
+    gui.load()
+    gui.replay.set_speed(None)
+    gui.app.layout = gui.set_layout()
+    gui.setup_callbacks()
+    while gui.buffer.write_seq < prefill:
+        gui.acquire()
+    return gui
+
+
+@case('ingest/farzad_acquire', unit='samples')
+def bench_acquire():
+    gui = farzad()
+    return gui.acquire, gui.replay.block_size
+
+
+@case('ingest/serial_binary', unit='frames')
+def bench_serial_binary():
+    from serial_ingest import SerialIngest, encode_frames, make_parser
+
+    _, ecg, ppg = recording_data()
+    data = encode_frames(np.vstack([ecg[:50000], ppg[:50000]]).astype(int))
+    ingest = SerialIngest(MemorySerial(data), make_parser('binary', 2))
+    frames = 2 * 4096 // (len(data) // 50000)
+    return ingest.read_block, frames
+
+
+@case('ingest/serial_text', unit='lines')
+def bench_serial_text():
+    from serial_ingest import SerialIngest, make_parser
+
+    _, ecg, _ = recording_data()
+    data = ''.join(f'{v:.0f}\n' for v in ecg[:50000]).encode('ascii')
+    ingest = SerialIngest(MemorySerial(data), make_parser('text', 1))
+    lines = 2 * 4096 * 50000 // len(data)
+    return ingest.read_block, lines
+
+
+@case('ingest/numeric_temp', unit='samples')
+def bench_numeric_temp():
+    """
+    The recorded temperature held at waveform rate, ingested 20 ms at a time into a change-only
+    NumericChannel (what a device repeating the value per sample costs).
+    """
+    from numeric_channel import NumericChannel
+
+    recording, _, _ = recording_data()
+    temp = recording.numeric('TEMP')
+    t = np.arange(10 ** 6) / recording.sampling_rate
+    values = temp.at(t % recording.duration)
+    channel = NumericChannel(max_changes=86400)
+    chunks = iter(zip(np.array_split(t, 10 ** 5), np.array_split(values, 10 ** 5)))
+    return (lambda: channel.extend(*next(chunks))), 10
+
+
+@case('filter/low_pass_filter', unit='samples')
+def bench_low_pass():
+    from streaming_filter import low_pass_filter
+
+    _, ecg, _ = recording_data()
+    window = ecg[:1000]
+    return (lambda: low_pass_filter(window, 40, 500)), len(window)
+
+
+@case('filter/streaming', unit='samples')
+def bench_streaming_filter():
+    from streaming_filter import StreamingFilter
+
+    _, ecg, _ = recording_data()
+    stream = StreamingFilter(cutoff_freq=40, sampling_rate=500, smoothing_lag=125, stage='benchmark')
+    chunks = iter(np.array_split(np.resize(ecg, 10 ** 6), 10 ** 5))
+    return (lambda: stream.process(next(chunks))), 10
+
+
+@case('detect/calculate_heart_rate', unit='samples')
+def bench_calculate_heart_rate():
+    from heart_rate_engine import calculate_heart_rate
+
+    _, ecg, _ = recording_data()
+    window = ecg[:2500]
+    return (lambda: calculate_heart_rate(window, 500)), len(window)
+
+
+@case('detect/beat_detector', unit='samples')
+def bench_beat_detector():
+    from heart_rate_engine import BeatDetector
+
+    _, ecg, _ = recording_data()
+    detector = BeatDetector(500)
+    chunks = iter(np.array_split(np.resize(ecg, 10 ** 6), 10 ** 5))
+    return (lambda: detector.process(next(chunks))), 10
+
+
+@case('detect/respiration', unit='samples')
+def bench_respiration():
+    from heart_rate_engine import BeatDetector
+    from respiration_engine import RespirationEstimator
+
+    _, ecg, ppg = recording_data()
+    detector = BeatDetector(500)
+    estimator = RespirationEstimator(500, detector)
+    chunks = iter(zip(np.array_split(np.resize(ecg, 10 ** 6), 10 ** 5),
+                      np.array_split(np.resize(ppg, 10 ** 6), 10 ** 5)))
+
+    def step():
+        ecg_chunk, ppg_chunk = next(chunks)
+        estimator.process(ppg_chunk, detector.process(ecg_chunk))
+    return step, 10
+
+
+@case('detect/spo2', unit='samples')
+def bench_spo2():
+    from spo2_engine import SpO2Engine, load_dual_recording
+
+    recording = load_dual_recording()
+    engine = SpO2Engine(500)
+    chunks = iter(zip(np.array_split(np.resize(np.asarray(recording['PPG'], dtype=float), 10 ** 6), 10 ** 5),
+                      np.array_split(np.resize(np.asarray(recording['PPG_RED'], dtype=float), 10 ** 6), 10 ** 5)))
+    return (lambda: engine.process(*next(chunks))), 10
+
+
+@case('alarm/check_vital_signs')
+def bench_check_vital_signs():
+    """
+    One patient's vitals through a 1-bed AlarmEngine and their colours, as the single-patient apps do.
+    """
+    from alarm_engine import AlarmEngine, check_vital_signs
+
+    alarms = AlarmEngine(1)
+    return (lambda: check_vital_signs(72, 97, 16, 37.0, alarms.update([[72, 97, 16, 37.0]])[0])), 1
+
+
+@case('render/full_redraw', unit='figures')
+def bench_full_redraw():
+    """
+    What update_graphs does on a slider change: decimated window plus both figures, serialized.
+    """
+    import plotly.io as pio
+    from decimation import bucket_size
+    from figure_stream import base_figure, window_data
+    from GUI_RB import Constants
+
+    gui = farzad(Constants.max_window)
+    bucket = bucket_size(Constants.window_size, Constants.plot_width, Constants.decimation)
+
+    def run():
+        _, ((ecg_x, ecg_y), (ppg_x, ppg_y)) = window_data(gui.buffer, ('ecg', 'ppg'), Constants.window_size, bucket,
+                                                          Constants.decimation)
+        pio.to_json(base_figure('ECG', 'red', x=ecg_x, y=ecg_y))
+        pio.to_json(base_figure('PPG', 'lightblue', x=ppg_x, y=ppg_y))
+    return run, 2
+
+
+@case('render/extend_data', unit='samples')
+def bench_extend_data():
+    """
+    Steady-state update_graphs: one acquired block per tick turned into extendData payloads.
+    """
+    from decimation import bucket_size
+    from figure_stream import extend_data
+    from GUI_RB import Constants
+
+    gui = farzad(Constants.window_size)
+    bucket = bucket_size(Constants.window_size, Constants.plot_width, Constants.decimation)
+    state = {'since': None}
+
+    def run():
+        gui.acquire()
+        state['since'], _ = extend_data(gui.buffer, ('ecg', 'ppg'), state['since'], Constants.window_size, bucket,
+                                        Constants.decimation)
+    return run, gui.replay.block_size
+
+
+def serialized_window(encoding):
+    """
+    json.dumps of a decimated 5 s ECG window as sent to the browser, as JSON lists or typed arrays.
+    """
+    from decimation import bucket_size, decimate
+    from waveform_codec import encode_trace
+
+    _, ecg, _ = recording_data()
+    x, y = decimate(np.arange(2500) / 500, ecg[:2500], bucket_size(2500, 1000), 'minmax')
+    if encoding == 'binary':
+        return lambda: json.dumps(encode_trace(x, y, 1 / 500))
+    return lambda: json.dumps({'x': [x.tolist()], 'y': [y.tolist()]})
+
+
+@case('render/serialize_window_json', unit='payloads')
+def bench_serialize_json():
+    return serialized_window('json'), 1
+
+
+@case('render/serialize_window_binary', unit='payloads')
+def bench_serialize_binary():
+    return serialized_window('binary'), 1
+
+
+@case('render/pyramid_24h', unit='figures')
+def bench_pyramid():
+    """
+    Envelope of a 24 h window from a pyramid over 24 h of ECG.
+    """
+    from pyramid import Pyramid
+
+    _, ecg, _ = recording_data()
+    pyramid = Pyramid(('ecg',), 500)
+    for start in range(0, 24 * 3600 * 500, len(ecg)):
+        pyramid.append(ecg[None, :min(len(ecg), 24 * 3600 * 500 - start)])
+    return (lambda: pyramid.envelope('ecg', 0, pyramid.n_samples, 1000)), 1
+
+
+@case('dash/gui_update_graphs', unit='requests')
+def bench_dash_gui_graphs():
+    from GUI_RB import Constants
+
+    gui = farzad(Constants.window_size)
+    client = gui.app.server.test_client()
+    outputs = [('ecg-plot', 'figure'), ('ppg-plot', 'figure'), ('ecg-plot', 'extendData'),
+               ('ppg-plot', 'extendData'), ('graph-seq', 'data')]
+    state = {'since': None}
+
+    def run():
+        gui.acquire()
+        reply = dash_call(client, outputs, [('graph-request', 'data', 1), ('my-slider', 'value', 2)],  # 10 s
+                          [('graph-seq', 'data', state['since'])])
+        state['since'] = reply.get('graph-seq', {}).get('data', state['since'])
+    return run, 1
+
+
+@case('dash/gui_update_vital_signs', unit='requests')
+def bench_dash_gui_vitals():
+    from GUI_RB import VITAL_CARDS, Constants
+
+    gui = farzad(Constants.window_size)
+    client = gui.app.server.test_client()
+    outputs = [('heart-rate-value', 'children'), ('spo2-value', 'children'), ('respiratory-rate-value', 'children'),
+               ('body-temp-value', 'children'), ('connection-status', 'children')]
+    outputs += [(card, 'style') for card in VITAL_CARDS]
+    return (lambda: dash_call(client, outputs, [('interval-component-vitals', 'n_intervals', 1)])), 1
+
+
+@case('dash/app_update_graphs', unit='requests')
+def bench_dash_app_graphs():
+    import app
+
+    app.replay.set_speed(None)  # one block per poll instead of whatever the clock says is due
+    state = {'since': None, 'tick': 0}
+    app.ticker.clock, app.ticker.interval = (lambda: state['tick']), 1  # a new data tick per request
+    client = app.app.server.test_client()
+    outputs = [('graph-data', 'data'), ('graph-seq', 'data')]
+
+    def run():
+        state['tick'] += 1
+        reply = dash_call(client, outputs, [('graph-request', 'data', 1)],
+                          [('graph-seq', 'data', state['since'])])
+        state['since'] = reply.get('graph-seq', {}).get('data', state['since'])
+    return run, 1
+
+
+@case('dash/app_update_graphs_20_clients', unit='requests')
+def bench_dash_app_graphs_shared():
+    """
+    20 browsers polling within the same data tick: one computes the update, the others get the
+    cached response bytes.
+    """
+    import app
+
+    app.replay.set_speed(None)
+    state = {'since': None, 'tick': 0}
+    app.ticker.clock, app.ticker.interval = (lambda: state['tick']), 1
+    client = app.app.server.test_client()
+    outputs = [('graph-data', 'data'), ('graph-seq', 'data')]
+
+    def run():
+        state['tick'] += 1
+        for _ in range(20):
+            reply = dash_call(client, outputs, [('graph-request', 'data', 1)],
+                              [('graph-seq', 'data', state['since'])])
+        state['since'] = reply.get('graph-seq', {}).get('data', state['since'])
+    return run, 20
+
+
+@case('dash/app_update_vital_signs', unit='requests')
+def bench_dash_app_vitals():
+    import app
+
+    client = app.app.server.test_client()
+    outputs = [(f'{name}-value', 'children') for name in ('heart-rate', 'spo2', 'respiratory-rate', 'body-temp')]
+    outputs += [(f'{name}-container', 'style') for name in ('heart-rate', 'spo2', 'respiratory-rate', 'body-temp')]
+    return (lambda: dash_call(client, outputs, [('interval-component-vitals', 'n_intervals', 1)])), 1
+
+
+@case('record/session_chunk', unit='samples')
+def bench_session_chunk():
+    """
+    Compressing and appending one 1 s chunk of ECG + PPG, as the Record button's writer thread does.
+    """
+    import tempfile
+    from recorder import SessionWriter
+
+    _, ecg, ppg = recording_data()
+    directory = tempfile.mkdtemp()
+    writer = SessionWriter(os.path.join(directory, 'benchmark.vsc'), ('ecg', 'ppg'), 500)
+    chunks = iter(range(10 ** 9))
+
+    def run():
+        i = next(chunks) * 500 % (len(ecg) - 500)
+        writer.write(i, i / 500, np.vstack([ecg[i:i + 500], ppg[i:i + 500]]))
+    return run, 500
+
+
+@case('metrics/observe_enabled')
+def bench_metrics_enabled():
+    import metrics
+
+    hist = metrics.histogram('benchmark_seconds', 'benchmark.py overhead probe')
+
+    def run():
+        metrics.enabled = True
+        with hist.time():
+            pass
+    return run, 1
+
+
+@case('metrics/observe_disabled')
+def bench_metrics_disabled():
+    import metrics
+
+    hist = metrics.histogram('benchmark_seconds', 'benchmark.py overhead probe')
+
+    def run():
+        metrics.enabled = False
+        with hist.time():
+            pass
+    return run, 1
+
+
+@case('startup/main_RB', unit='starts')
+def bench_startup():
+    """
+    Cold start of main_RB.py in a fresh interpreter until its server answers (showing 'Connecting…'
+    while engines and recording load). Fails when a start exceeds Constants.startup_budget.
+    """
+    import socket
+    import urllib.request
+
+    from GUI_RB import Constants
+
+    src = os.path.dirname(os.path.abspath(__file__))
+
+    def run():
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, 'main_RB.py', '--no-browser', '--port', str(port)], cwd=src,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                try:
+                    urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1).read()
+                    break
+                except OSError:
+                    if proc.poll() is not None or time.perf_counter() - start > 10 * Constants.startup_budget:
+                        raise RuntimeError('main_RB.py did not start')
+                    time.sleep(0.01)
+        finally:
+            proc.terminate()
+            proc.wait()
+        elapsed = time.perf_counter() - start
+        if elapsed > Constants.startup_budget:
+            raise RuntimeError(f'main_RB.py answered after {elapsed:.2f} s, budget {Constants.startup_budget} s')
+    return run, 1
+
+
+def measure(fn, items, min_time=1.0, max_calls=100000, warmup=3):
+    """
+    Times fn per call until min_time has passed, then runs it a few more times under tracemalloc
+    (separately, tracing slows every allocation down).
+
+    :return: Dict with calls, throughput (items/s), p50/p99/max latency (ms) and peak memory (KiB)
+    """
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < max_calls and time.perf_counter() - start < min_time:
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+    latencies = np.array(latencies)
+
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for _ in range(min(len(latencies), 10)):
+        fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'calls': len(latencies),
+        'throughput': items * len(latencies) / latencies.sum(),
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'max_ms': float(latencies.max() * 1000),
+        'peak_kib': (peak - baseline) / 1024,
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def run(patterns=(), min_time=1.0):
+    results = {}
+    for name, (setup, unit) in CASES.items():
+        if patterns and not any(p in name for p in patterns):
+            continue
+        fn, items = setup()
+        results[name] = dict(measure(fn, items, min_time), unit=unit)
+        r = results[name]
+        print(f'{name:32s} {r["throughput"]:>12,.0f} {unit + "/s":12s} p50 {r["p50_ms"]:8.3f} ms  '
+              f'p99 {r["p99_ms"]:8.3f} ms  peak {r["peak_kib"]:9.1f} KiB', flush=True)
+    return results
+
+
+def compare(results, baseline):
+    print(f'\nAgainst {baseline["environment"].get("commit") or "baseline"}:')
+    for name, r in results.items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        print(f'{name:32s} p50 {r["p50_ms"] / old["p50_ms"] - 1:+7.1%}  '
+              f'throughput {r["throughput"] / old["throughput"] - 1:+7.1%}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-k', dest='patterns', action='append', default=[], help='run cases containing this text')
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    parser.add_argument('--compare', metavar='JSON', help='earlier results to compare against')
+    parser.add_argument('--min-time', type=float, default=1.0, help='seconds per case (default 1)')
+    parser.add_argument('--list', action='store_true', help='list the cases and exit')
+    args = parser.parse_args()
+
+    if args.list:
+        print('\n'.join(CASES))
+        sys.exit(0)
+
+    report = {'environment': environment(), 'results': run(args.patterns, args.min_time)}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report['results'], json.load(f))
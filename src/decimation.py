@@ -0,0 +1,85 @@
+# decimation.py
+import numpy as np
+
+# Points each method emits per bucket of input samples (LTTB emits two like minmax, so traces
+# decimated with either can share one bucket size and sequence alignment)
+POINTS_PER_BUCKET = {'stride': 1, 'lttb': 2, 'minmax': 2}
+
+
+def bucket_size(n_samples, n_pixels, method='minmax'):
+    """
+    Samples per bucket so that a window of n_samples ends up with about n_pixels points.
+
+    :param method: Decimation method, or a dict of methods per channel for channels sharing the
+                   bucket (sized for the method emitting the most points per bucket)
+    """
+    points = max(POINTS_PER_BUCKET[m] for m in (method.values() if isinstance(method, dict) else [method]))
+    return max(1, int(np.ceil(n_samples * points / n_pixels)))
+
+
+def minmax(x, y, n_buckets):
+    """
+    Keeps the minimum and the maximum of each bucket (in time order), so no peak is ever dropped.
+    Trailing samples that don't fill a bucket are ignored.
+
+    :return: (x, y) with 2 * n_buckets points
+    """
+    x, y = np.asarray(x), np.asarray(y)
+    size = len(y) // n_buckets if n_buckets else 0
+    if size <= 1:
+        return x, y
+    rows = y[:n_buckets * size].reshape(n_buckets, size)
+    imin, imax = rows.argmin(axis=1), rows.argmax(axis=1)
+    idx = np.stack([np.minimum(imin, imax), np.maximum(imin, imax)], axis=1)
+    idx = (idx + (np.arange(n_buckets) * size)[:, None]).reshape(-1)
+    return x[idx], y[idx]
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: keeps the first and last point and, per bucket, the point
+    forming the largest triangle with the previously kept point and the next bucket's average.
+    The per-bucket search is vectorized; only the walk over buckets is a Python loop.
+
+    :return: (x, y) with n_out points
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    # Average of every bucket, used as the third triangle corner for the bucket before it
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+    avg_x, avg_y = np.append(avg_x[1:], x[-1]), np.append(avg_y[1:], y[-1])
+
+    idx = np.empty(n_out, dtype=int)
+    idx[0], idx[-1] = 0, n - 1
+    prev = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs((x[prev] - avg_x[i]) * (y[lo:hi] - y[prev]) - (x[prev] - x[lo:hi]) * (avg_y[i] - y[prev]))
+        prev = lo + int(np.argmax(area))
+        idx[i + 1] = prev
+    return x[idx], y[idx]
+
+
+def decimate(x, y, bucket, method='minmax'):
+    """
+    Reduces (x, y) to POINTS_PER_BUCKET points per `bucket` samples with the given method:
+    'minmax', 'lttb' or 'stride' (plain x[::bucket], which can drop peaks). The point count only
+    depends on the number of complete buckets, so streamed chunks add up to `max_points`.
+    """
+    if bucket <= 1:
+        return np.asarray(x), np.asarray(y)
+    n_buckets = len(y) // bucket
+    if method == 'minmax':
+        return minmax(x, y, n_buckets)
+    if method == 'lttb':
+        # A single bucket (a small streamed chunk) is too short for triangles: keep its min and max
+        return lttb(x, y, 2 * n_buckets) if n_buckets > 1 else minmax(x, y, n_buckets)
+    if method == 'stride':
+        return np.asarray(x)[::bucket], np.asarray(y)[::bucket]
+    raise ValueError(f'Unknown decimation method {method!r}')
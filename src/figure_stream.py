@@ -0,0 +1,81 @@
+# figure_stream.py
+import plotly.graph_objs as go
+
+from decimation import POINTS_PER_BUCKET, decimate
+from waveform_codec import encode_trace
+
+
+def base_figure(title, color, width=5, x=(), y=()):
+    """
+    Static figure (styling, layout, one trace) sent to the browser once with the layout or on a
+    full redraw. Live data is then appended with `extend_data` through the graph's extendData
+    property.
+    """
+    fig = go.Figure(go.Scatter(x=list(x), y=list(y), mode='lines', name=title, line=dict(color=color, width=width)))
+    # uirevision keeps the user's zoom/pan while data is streamed in
+    fig.update_layout(title=title, plot_bgcolor='black', paper_bgcolor='black', font_color='white', uirevision=title)
+    return fig
+
+
+def decimate_view(buffer, seq, view, channels, bucket, methods):
+    """
+    Decimates a ring buffer view starting at sequence number `seq`. Buckets are aligned on
+    absolute sequence numbers so consecutive chunks line up; only complete buckets are used.
+
+    :return: (sequence number after the last used sample, list of (x, y) per channel)
+    """
+    start = (-seq) % bucket
+    n_full = max(view.shape[1] - start, 0) // bucket * bucket
+    view = view[:, start:start + n_full]
+    x = buffer.channel(view, 't')
+    traces = [decimate(x, buffer.channel(view, channel), bucket, methods.get(channel, 'stride'))
+              for channel in channels]
+    return seq + start + n_full if n_full else seq, traces
+
+
+def max_points(window, bucket=1, method='stride'):
+    """
+    Number of points a trace showing `window` samples keeps in the browser.
+    """
+    return -(-window // bucket) * POINTS_PER_BUCKET[method]
+
+
+def window_data(buffer, channels, window, bucket=1, methods=None):
+    """
+    Latest `window` samples, decimated per channel, for a full redraw.
+
+    :return: (next since, list of (x, y) per channel)
+    """
+    seq, view = buffer.window(window)
+    return decimate_view(buffer, seq, view, channels, bucket, methods or {})
+
+
+def extend_data(buffer, channels, since, window, bucket=1, methods=None, until=None, dx=None):
+    """
+    Builds extendData payloads with the samples a client has not seen yet.
+
+    :param buffer: RingBuffer with a 't' channel
+    :param channels: Buffer channels to send, one payload per channel (i.e. per graph)
+    :param since: Sequence number of the next sample the client needs (None for a new client)
+    :param window: Number of samples each trace shows in the browser
+    :param bucket: Samples per decimation bucket; only complete buckets are sent
+    :param methods: Decimation method per channel ('minmax', 'lttb', 'stride'; default 'stride')
+    :param until: Only use samples before this sequence number (e.g. a tick's write_seq, so the
+                  payload doesn't depend on samples written meanwhile); all available by default
+    :param dx: Sample spacing of the 't' channel. When given, each trace is sent as a compact
+               waveform_codec payload (typed arrays, x as start + step) instead of JSON lists
+    :return: (next since, list of extendData values) or (since, None) if there is nothing new
+    """
+    methods = methods or {}
+    end = buffer.write_seq if until is None else min(until, buffer.write_seq)
+    if since is None or not buffer.is_valid(since):
+        since = max(end - window, 0)
+    seq, view = buffer.read(since, window + buffer.write_seq - end)
+    view = view[:, :max(end - seq, 0)]
+    since, traces = decimate_view(buffer, seq, view, channels, bucket, methods)
+    if len(traces[0][0]) == 0:
+        return since, None
+    updates = [[encode_trace(x, y, dx) if dx else dict(x=[x.tolist()], y=[y.tolist()]), [0],
+                max_points(window, bucket, methods.get(channel, 'stride'))]
+               for channel, (x, y) in zip(channels, traces)]
+    return since, updates
@@ -1,9 +1,13 @@
-import time
-import pandas as pd
-import serial
+import traceback
 from GUI_RB import *
+from metrics import counter, gauge
+from replay import ReplaySource
+from serial_ingest import SerialIngest, make_parser
+from spo2_engine import load_dual_recording
 
 DEBUG = False
+
+ingested_samples = counter('samples_ingested_total', 'Samples written to the ring buffer by the acquisition loop')
 #class Constants:
  #   port = 'COM9'
   #  baud_rate = 9600
@@ -13,52 +17,68 @@ DEBUG = False
 class Farzad(GUI):
     def __init__(self):
         super().__init__()
-        self.ecg_filtered = []
-        self.ppg_filtered = []
+        self.xplot_idx = 0
+
+    def load(self):
+        # Engines plus the device or recording, loaded by run_farzad() while run_soheil() already serves
+        super().load()
         if DEBUG:
-            self.ser = serial.Serial(Constants.port, Constants.baud_rate, write_timeout=0)
+            import serial
+
+            self.ser = serial.Serial(Constants.port, Constants.baud_rate, timeout=0.05, write_timeout=0)
             self.ser.close()
             self.ser.open()
+            self.ingest = SerialIngest(self.ser, make_parser(Constants.serial_format, Constants.serial_channels))
+            counter('samples_dropped_total', 'Frames lost on the serial link (sequence gaps)',
+                    fn=lambda: self.ingest.stats['dropped'])
+            counter('serial_resyncs_total', 'Serial parser resynchronisations', fn=lambda: self.ingest.stats['resyncs'])
+            gauge('serial_backlog_bytes', 'Bytes waiting in the serial port', fn=lambda: self.ser.in_waiting)
         else:
-            ecg_df = pd.read_csv('ECG.csv', header=None, names=['ECG'])
-            ppg_df = pd.read_csv('PPG.csv', header=None, names=['PPG'])
-            self.ecg_array = ecg_df.to_numpy().reshape(-1)
-            self.ppg_array = ppg_df.to_numpy().reshape(-1)
-            self.ecg_idx = 0
-            self.ppg_idx = 0
-
-        self.data_buffer = collections.deque(maxlen=Constants.window_size)
-        # self.xticks = collections.deque(maxlen=Constants.window_size)
-        self.ecg_buffer = collections.deque(maxlen=Constants.window_size)
-        self.ppg_buffer = collections.deque(maxlen=Constants.window_size)
-
-        self.xplot_idx = 0
+            # PPG (infrared) plus its synthetic red pair, so SpO2 works without a device
+            self.recording = load_dual_recording()
+            # Paced by the clock at the recording's sampling rate (times Constants.replay_speed)
+            self.replay = ReplaySource(self.recording, ('ECG', 'PPG', 'PPG_RED'), speed=Constants.replay_speed)
+            self.recorded_temperature = self.recording.numeric('TEMP')
+        self.ready.set()
 
+    def acquire(self):
+        # One acquisition step (also driven headless by benchmark.py)
+        if DEBUG:
+            # Blocks for up to the port timeout, then parses everything that arrived at once
+            _, samples = self.ingest.read_block()
+            k = samples.shape[1]
+            if k:
+                block = np.full((4, k), np.nan)
+                block[0] = (self.buffer.write_seq + np.arange(k)) / Constants.sampling_rate
+                n = min(len(samples), 3)
+                block[1:1 + n] = samples[:n]
+                self.buffer.extend(block)
+                if len(samples) > 3:  # a fourth channel carries the body temperature
+                    self.temperature.extend(block[0], samples[3])
+                self.process_block(*block[1:])
+                self.pyramid.append(block[1:3])
+                ingested_samples.inc(k)
+                self.notify_publishers()
+        else:
+            # Waits until the next block is due, like the device would send it
+            seq, samples = self.replay.next_block()
+            k = samples.shape[1]
+            t = self.replay.timestamps(seq, k)
+            self.buffer.extend(np.vstack([t, samples]))
+            self.temperature.append(t[-1], self.recorded_temperature.at(self.replay.position(seq + k - 1)))
+            self.process_block(*samples)
+            self.pyramid.append(samples[:2])
+            ingested_samples.inc(k)
+            self.notify_publishers()
 
     def run_farzad(self):
-        while True:
-            if DEBUG:
-                line = self.ser.read(self.ser.in_waiting).decode('utf-8').strip()
-                if line:
-                    self.data_buffer.append(float(line))
-                    if len(self.xticks) == 0:
-                        last_tick = 0
-                    else:
-                        last_tick = self.xticks[-1] + 1 / Constants.sampling_rate
-                    self.xticks.append(last_tick)
-                    # Todo filter self.ecg_filtered
-            else:
-                if len(self.xticks) == 0:
-                    last_tick = 0
-                else:
-                    last_tick = self.xticks[-1] + 1 / Constants.sampling_rate
-                self.xticks.append(last_tick)
-                self.ecg_buffer.append(self.ecg_array[self.ecg_idx])
-                self.ppg_buffer.append(self.ppg_array[self.ppg_idx])
-                self.ecg_idx = (self.ecg_idx + 1) % len(self.ecg_array)
-                self.ppg_idx = (self.ppg_idx + 1) % len(self.ppg_array)
-                self.ecg_filtered = list(self.ecg_buffer)
-                self.ppg_filtered = list(self.ppg_buffer)
-                self.ecg = self.ecg_filtered
-                self.ppg = self.ppg_filtered
-                time.sleep(0.01)
+        # Runs in an executor whose future nobody waits on: a failure is printed here and shown on the
+        # status line, instead of vanishing with the page stuck on CONNECTING
+        try:
+            self.load()
+            while True:
+                self.acquire()
+        except Exception as e:
+            self.acquisition_error = e
+            traceback.print_exc()
+            self.notify_publishers()
@@ -1,15 +1,22 @@
 # heart_rate_engine.py
+import collections
+
 import numpy as np
-from scipy.signal import find_peaks
 
+from metrics import timed
+from streaming_filter import StreamingFilter
+
+@timed('heart_rate_seconds', 'calculate_heart_rate time per window')
 def calculate_heart_rate(signal, sampling_rate=400):
     """
     Calculates the heart rate from the given signal using peak detection.
     
     :param signal: ECG or PPG signal (list or numpy array)
-    :param sampling_rate: Sampling rate of the signal in Hz (default is 1000 Hz)
+    :param sampling_rate: Sampling rate of the signal in Hz (default is 400 Hz)
     :return: Estimated heart rate in bpm (beats per minute)
     """
+    from scipy.signal import find_peaks  # imported on use, see streaming_filter.py
+
     # Find peaks (R-peaks for ECG or pulses for PPG)
     peaks, _ = find_peaks(signal, height=np.max(signal)*0.5, distance=sampling_rate*0.4)  # Detect peaks
     
@@ -23,4 +30,144 @@ def calculate_heart_rate(signal, sampling_rate=400):
     avg_interval = np.mean(peak_intervals)  # Average time between peaks
     heart_rate_bpm = 60 / avg_interval  # Convert to beats per minute
     
-    return heart_rate_bpm
\ No newline at end of file
+    return heart_rate_bpm
+
+def format_heart_rate(rate):
+    """
+    Display text of a heart rate ('--' while there is none).
+    """
+    return '--' if np.isnan(rate) else f"{rate:.1f} bpm"
+
+class BeatDetector:
+    """
+    Streaming R-peak / pulse detector. Feed it chunks of raw samples as they arrive; it band-passes
+    them, keeps adaptive signal/noise peak levels (Pan-Tompkins style) and an RR-interval history,
+    so each call costs O(new samples). Heart rate and the beats respiration uses come from this one pass.
+
+    Beat positions are absolute sample indices of the peak in the band-passed signal (a constant
+    filter delay after the raw peak, which cancels out in RR intervals).
+    """
+    def __init__(self, sampling_rate, band=(5, 15), refractory=0.25, learning_time=2.0, rr_history=32):
+        """
+        :param sampling_rate: Sampling rate of the signal in Hz
+        :param band: Pass band in Hz used for detection ((5, 15) for ECG QRS, e.g. (0.5, 8) for PPG)
+        :param refractory: Minimum time between beats in seconds
+        :param learning_time: Seconds of signal used to initialise the thresholds
+        :param rr_history: Number of RR intervals kept for the heart rate
+        """
+        self.sampling_rate = sampling_rate
+        self._filter = StreamingFilter(band, sampling_rate, order=2, btype='band', stage='beat_detector')
+        self.refractory = int(refractory * sampling_rate)
+        self._learning = int(learning_time * sampling_rate)
+        self.beats = collections.deque(maxlen=rr_history + 1)  # absolute sample index of each beat
+        self.amplitudes = collections.deque(maxlen=rr_history + 1)  # band-passed peak value per beat
+        self.rr_intervals = collections.deque(maxlen=rr_history)  # seconds
+        self.reset()
+
+    def reset(self):
+        """
+        Starts over as on a new signal, e.g. after a gap in the stream: the thresholds are learned
+        again and sample indices restart at 0.
+        """
+        self._filter.reset()
+        self._learn_buffer = []
+        self.signal_level = None
+        self.noise_level = None
+        self.n_samples = 0  # absolute index of the next input sample
+        self.beats.clear()
+        self.amplitudes.clear()
+        self.rr_intervals.clear()
+        self._last_rr = False  # whether the last beat appended an RR interval
+        self._open = None  # (start, peak index, peak value) of an above-threshold region still open
+        self._last_decay = 0
+
+    @property
+    def threshold(self):
+        return self.noise_level + 0.25 * (self.signal_level - self.noise_level)
+
+    @timed('beat_detector_seconds', 'BeatDetector time per chunk')
+    def process(self, chunk):
+        """
+        :param chunk: New raw samples (1-D)
+        :return: (absolute sample index, amplitude) of each beat detected in this chunk, the
+                 amplitude being the band-passed peak value also kept in `amplitudes`
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        start = self.n_samples
+        self.n_samples += len(chunk)
+        feature = self._filter.process(chunk) ** 2
+
+        if self.signal_level is None:
+            self._learn_buffer.append(feature)
+            learned = np.concatenate(self._learn_buffer)
+            if len(learned) < self._learning:
+                return []
+            self._learn_buffer = []
+            self.signal_level = 0.25 * learned.max()
+            self.noise_level = 0.5 * learned.mean()
+
+        # Contiguous regions above the threshold; the beat is the maximum of each region
+        above = np.concatenate([[False], feature > self.threshold, [False]])
+        edges = np.flatnonzero(np.diff(above.astype(np.int8)))
+        regions = list(zip(edges[::2], edges[1::2]))
+
+        new_beats = []
+        if self._open is not None:
+            if regions and regions[0][0] == 0:
+                lo, hi = regions.pop(0)
+                peak = lo + int(np.argmax(feature[lo:hi]))
+                if feature[peak] > self._open[2]:
+                    self._open = (self._open[0], start + peak, feature[peak])
+                if hi < len(feature):
+                    self._close_region(*self._open[1:], new_beats)
+                    self._open = None
+            else:
+                self._close_region(*self._open[1:], new_beats)
+                self._open = None
+
+        for lo, hi in regions:
+            peak = lo + int(np.argmax(feature[lo:hi]))
+            if hi == len(feature):  # may continue in the next chunk
+                self._open = (start + lo, start + peak, feature[peak])
+            else:
+                self._close_region(start + peak, feature[peak], new_beats)
+
+        # Halve the signal level for every 2 s without a beat (e.g. after a gain change)
+        quiet_since = max(self.beats[-1] if self.beats else self._learning, self._last_decay)
+        if self.n_samples - quiet_since > 2 * self.sampling_rate:
+            self.signal_level *= 0.5
+            self._last_decay = self.n_samples
+        return new_beats
+
+    def _close_region(self, peak, value, new_beats):
+        # Adds the beat to new_beats, or updates the last one there when a bigger peak replaces it
+        if self.beats and peak - self.beats[-1] < self.refractory:
+            if value > self.amplitudes[-1]:
+                # A bigger peak inside the refractory period replaces the previous one
+                if new_beats and new_beats[-1][0] == self.beats[-1]:
+                    new_beats[-1] = (peak, value)
+                self.beats[-1] = peak
+                self.amplitudes[-1] = value
+                if self._last_rr:
+                    self.rr_intervals[-1] = (peak - self.beats[-2]) / self.sampling_rate
+            else:
+                self.noise_level = 0.875 * self.noise_level + 0.125 * value
+            return
+
+        self.signal_level = 0.875 * self.signal_level + 0.125 * value
+        rr = (peak - self.beats[-1]) / self.sampling_rate if self.beats else np.inf
+        self._last_rr = rr < 2.5  # longer gaps are signal loss, not an RR interval
+        if self._last_rr:
+            self.rr_intervals.append(rr)
+        self.beats.append(peak)
+        self.amplitudes.append(value)
+        new_beats.append((peak, value))
+
+    @property
+    def heart_rate(self):
+        """
+        Heart rate in bpm from the median of the recent RR intervals (0 until two beats were seen).
+        """
+        if not self.rr_intervals:
+            return 0
+        return 60 / np.median(self.rr_intervals)
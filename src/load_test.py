@@ -0,0 +1,305 @@
+# load_test.py
+"""
+How many dashboard viewers one box sustains. Starts the polling server locally on the replayed
+recording, then simulates N browser sessions: each polls update_graphs and update_vital_signs
+through /_dash-update-component at the layout's interval, carrying its graph-seq like the real
+page. Per step it reports the achieved request rate, latency percentiles, errors, dropped ticks and
+the server's CPU and memory.
+
+    python load_test.py                                    # app.py, 1-50 sessions
+    python load_test.py --clients 10 20 40 80 --duration 20 -o load.json
+    python load_test.py --target multi_bed --beds 8        # central station (--poll), sessions spread over beds
+
+Like the browser pacer (render_pacer.py) a session only polls again once its previous request
+returned; ticks that pass meanwhile are counted as dropped. The pacer's interval back-off is not
+simulated, so this is the worst case. Sessions are threads of this process: check the client CPU
+column, a saturated load generator understates the server.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from benchmark import callback_body
+
+APP_VITALS = ('heart-rate', 'spo2', 'respiratory-rate', 'body-temp')
+
+
+def app_callbacks(session):
+    """
+    (name, default interval in ms, interval component id, request(state) -> (outputs, inputs, state),
+    update(state, response)) of the callbacks a browser on app.py polls.
+    """
+    def graphs(state):
+        state['n'] = state.get('n', 0) + 1
+        return ([('graph-data', 'data'), ('graph-seq', 'data')], [('graph-request', 'data', state['n'])],
+                [('graph-seq', 'data', state.get('since'))])
+
+    def vitals(state):
+        outputs = [(f'{name}-value', 'children') for name in APP_VITALS] + \
+                  [(f'{name}-container', 'style') for name in APP_VITALS]
+        return outputs, [('interval-component-vitals', 'n_intervals', 1)], []
+    return [('graphs', 40, 'interval-component-graphs', graphs, update_since),
+            ('vitals', 1000, 'interval-component-vitals', vitals, None)]
+
+
+def multi_bed_callbacks(session, beds=1):
+    from alarm_engine import VITALS
+
+    pathname = f'/bed/bed-{session % beds + 1:02d}'
+
+    def graphs(state):
+        state['n'] = state.get('n', 0) + 1
+        return ([('ecg-plot', 'extendData'), ('ppg-plot', 'extendData'), ('graph-seq', 'data')],
+                [('graph-request', 'data', state['n'])],
+                [('url', 'pathname', pathname), ('graph-seq', 'data', state.get('since'))])
+
+    def vitals(state):
+        outputs = [(f'{name}-value', 'children') for name in VITALS] + \
+                  [(f'{name}-container', 'style') for name in VITALS]
+        return outputs, [('interval-component-vitals', 'n_intervals', 1)], [('url', 'pathname', pathname)]
+    return [('graphs', 100, 'interval-component-graphs', graphs, update_since),
+            ('vitals', 1000, 'interval-component-vitals', vitals, None)]
+
+
+def update_since(state, response):
+    state['since'] = response.get('graph-seq', {}).get('data', state.get('since'))
+
+
+TARGETS = {'app': app_callbacks, 'multi_bed': multi_bed_callbacks}
+
+
+def serve(target, port, beds):
+    """
+    Runs the target's server (no debugger or reloader, so this is the process being measured).
+    """
+    if target == 'app':
+        import app
+
+        app.app.run(debug=False, port=port, threaded=True)
+    else:
+        from multi_bed import create_app, window_size
+        from bed_registry import synthetic_registry
+        from spo2_engine import load_dual_recording
+
+        registry = synthetic_registry(beds, load_dual_recording(), window_size).start()
+        create_app(registry, push=False).run(debug=False, port=port, threaded=True)
+
+
+def start_server(target, port, beds, timeout=60):
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', target, '--port', str(port),
+                                '--beds', str(beds)], cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    start = time.monotonic()
+    while True:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/_dash-layout')
+            layout = json.loads(connection.getresponse().read())
+            return process, layout
+        except (OSError, ValueError):
+            if process.poll() is not None or time.monotonic() - start > timeout:
+                process.kill()
+                raise RuntimeError(f'{target} server did not start on port {port}')
+            time.sleep(0.1)
+
+
+def find_interval(layout, component_id):
+    """
+    The `interval` prop of the dcc.Interval with this id in a layout JSON (None if not in it).
+    """
+    if isinstance(layout, dict):
+        props = layout.get('props', {})
+        if layout.get('type') == 'Interval' and props.get('id') == component_id:
+            return props.get('interval')
+        return next((found for found in map(lambda v: find_interval(v, component_id), layout.values())
+                     if found is not None), None)
+    if isinstance(layout, list):
+        return next((found for found in (find_interval(v, component_id) for v in layout) if found is not None),
+                    None)
+    return None
+
+
+def process_usage(pid):
+    """
+    (CPU seconds, resident bytes) of a process: psutil when installed, /proc otherwise, NaN without either.
+    """
+    try:
+        import psutil
+
+        process = psutil.Process(pid)
+        times = process.cpu_times()
+        return times.user + times.system, process.memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/status') as f:
+            rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK'), rss
+    except (OSError, StopIteration, IndexError):
+        return np.nan, np.nan
+
+
+class Poller(threading.Thread):
+    """
+    One callback of one simulated browser: requests on the interval's ticks, one at a time.
+    """
+    def __init__(self, port, interval, request, update, stop):
+        super().__init__(daemon=True)
+        self.port = port
+        self.interval = interval
+        self.request = request
+        self.update = update
+        self.stop = stop
+        self.state = {}
+        self.recording = False
+        self.latencies = []
+        self.errors = 0
+        self.dropped = 0
+        self.bytes = 0
+
+    def call(self, connection):
+        outputs, inputs, state = self.request(self.state)
+        body = json.dumps(callback_body(outputs, inputs, state))
+        connection.request('POST', '/_dash-update-component', body, {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        data = response.read()
+        if response.status == 204:
+            return len(data)
+        if response.status != 200:
+            raise http.client.HTTPException(f'HTTP {response.status}')
+        if self.update is not None:
+            self.update(self.state, json.loads(data)['response'])
+        return len(data)
+
+    def run(self):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        tick = time.monotonic() + random.uniform(0, self.interval)  # sessions don't start in lockstep
+        while not self.stop.is_set():
+            self.stop.wait(max(tick - time.monotonic(), 0))
+            start = time.monotonic()
+            try:
+                size = self.call(connection)
+                ok = True
+            except (OSError, http.client.HTTPException, ValueError, KeyError):
+                connection.close()
+                ok = False
+            end = time.monotonic()
+            if self.recording:
+                if ok:
+                    self.latencies.append(end - start)
+                    self.bytes += size
+                else:
+                    self.errors += 1
+            # Ticks that passed during the request are dropped, the next one is polled
+            missed = int((end - tick) // self.interval)
+            if self.recording:
+                self.dropped += missed
+            tick += (missed + 1) * self.interval
+        connection.close()
+
+
+def run_step(target, port, n_clients, intervals, server_pid, duration, warmup, beds):
+    stop = threading.Event()
+    pollers = {}
+    for session in range(n_clients):
+        callbacks = TARGETS[target](session, beds) if target == 'multi_bed' else TARGETS[target](session)
+        for name, _, component_id, request, update in callbacks:
+            pollers.setdefault(name, []).append(Poller(port, intervals[name], request, update, stop))
+    everyone = [p for group in pollers.values() for p in group]
+    for poller in everyone:
+        poller.start()
+
+    time.sleep(warmup)
+    for poller in everyone:
+        poller.recording = True
+    cpu0, _ = process_usage(server_pid)
+    client0 = time.process_time()
+    start = time.monotonic()
+    peak_rss = 0
+    while time.monotonic() - start < duration:
+        time.sleep(min(0.5, duration))
+        peak_rss = max(peak_rss, process_usage(server_pid)[1])
+    elapsed = time.monotonic() - start
+    for poller in everyone:
+        poller.recording = False
+    cpu1, _ = process_usage(server_pid)
+    client = time.process_time() - client0
+    stop.set()
+    for poller in everyone:
+        poller.join()
+
+    result = {'clients': n_clients, 'server_cpu': (cpu1 - cpu0) / elapsed, 'server_rss_mb': peak_rss / 2 ** 20,
+              'client_cpu': client / elapsed}
+    for name, group in pollers.items():
+        latencies = np.concatenate([p.latencies for p in group]) if group else np.empty(0)
+        requests = len(latencies)
+        ticks = requests + sum(p.errors + p.dropped for p in group)
+        percentiles = np.percentile(latencies, [50, 95, 99]) * 1000 if requests else [np.nan] * 3
+        result[name] = {'rate': requests / elapsed, 'target_rate': n_clients / intervals[name], 'p50_ms': float(percentiles[0]), 'p95_ms': float(percentiles[1]),
+                        'p99_ms': float(percentiles[2]), 'errors': sum(p.errors for p in group),
+                        'dropped': sum(p.dropped for p in group) / max(ticks, 1),
+                        'kib_per_request': sum(p.bytes for p in group) / max(requests, 1) / 1024}
+    return result
+
+
+def print_row(r):
+    g, v = r['graphs'], r['vitals']
+    print(f'{r["clients"]:7d} {g["rate"]:8.1f}/{g["target_rate"]:<7.0f} {g["p50_ms"]:7.1f} {g["p95_ms"]:7.1f} '
+          f'{g["p99_ms"]:7.1f} {g["dropped"]:7.1%} {v["rate"]:6.1f} {v["p99_ms"]:7.1f} '
+          f'{g["errors"] + v["errors"]:6d} {r["server_cpu"]:6.2f} {r["server_rss_mb"]:7.0f} {r["client_cpu"]:6.2f}',
+          flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', choices=sorted(TARGETS), default='app')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 5, 10, 20, 50], help='sessions per step')
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds per step (default 10)')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds before measuring each step')
+    parser.add_argument('--beds', type=int, default=4, help='beds of the multi_bed target')
+    parser.add_argument('--port', type=int, default=8060)
+    parser.add_argument('--budget', type=float, default=100, help='graph p99 (ms) a step must stay under')
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    parser.add_argument('--serve', choices=sorted(TARGETS), help=argparse.SUPPRESS)  # the server subprocess
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.beds)
+        sys.exit(0)
+
+    server, layout = start_server(args.target, args.port, args.beds)
+    try:
+        # The intervals the page would poll at: from the served layout where it has them
+        intervals = {name: (find_interval(layout, component_id) or default) / 1000
+                     for name, default, component_id, _, _ in TARGETS[args.target](0)}
+        print(f'{args.target}: graphs every {intervals["graphs"] * 1000:.0f} ms, '
+              f'vitals every {intervals["vitals"] * 1000:.0f} ms, {args.duration:g} s per step')
+        print(f'{"clients":>7} {"graphs/s (target)":>16} {"p50 ms":>7} {"p95 ms":>7} {"p99 ms":>7} {"dropped":>7} '
+              f'{"vit/s":>6} {"p99 ms":>7} {"errors":>6} {"cpu":>6} {"rss MB":>7} {"client":>6}')
+        results = []
+        for n in args.clients:
+            results.append(run_step(args.target, args.port, n, intervals, server.pid, args.duration, args.warmup,
+                                    args.beds))
+            print_row(results[-1])
+    finally:
+        server.terminate()
+        server.wait()
+
+    within = [r['clients'] for r in results if r['graphs']['p99_ms'] <= args.budget
+              and r['graphs']['errors'] + r['vitals']['errors'] == 0]
+    print(f'Graph p99 under {args.budget:g} ms without errors up to {max(within)} clients' if within
+          else f'No step kept graph p99 under {args.budget:g} ms without errors')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'target': args.target, 'intervals': intervals, 'budget_ms': args.budget, 'results': results},
+                      f, indent=2)
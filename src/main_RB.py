@@ -1,18 +1,27 @@
+import argparse
 from concurrent import futures
 import sys
 import webbrowser
 from get_data import *
 
 class MainOP(Farzad):
-    def __init__(self):
+    def __init__(self, browser=True):
+        # Only the server is set up here; engines, recording and device load in run_farzad(), and the
+        # page shows CONNECTING until they are up (or CONNECTION_FAILED if they raise)
         super().__init__()
         self.app.layout = self.set_layout()
         self.setup_callbacks()
-        webbrowser.open('http://127.0.0.1:8050/')
+        if browser:
+            webbrowser.open(f'http://127.0.0.1:{Constants.server_port}/')
 
         with futures.ThreadPoolExecutor() as executor:
-            executor.submit(self.run_farzad)
             executor.submit(self.run_soheil)
+            executor.submit(self.run_farzad)
 
 if __name__ == '__main__':
-    sys.exit(MainOP())
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=Constants.server_port)
+    parser.add_argument('--no-browser', action='store_true', help="don't open the monitor in a browser")
+    args = parser.parse_args()
+    Constants.server_port = args.port
+    sys.exit(MainOP(browser=not args.no_browser))
@@ -0,0 +1,225 @@
+# metrics.py
+"""
+Hot-path instrumentation: counters, gauges and histograms exposed in the Prometheus text format.
+
+    from metrics import counter, histogram, timed
+    samples = counter('samples_ingested_total', 'Samples written to the ring buffer')
+    samples.inc(k)
+    with histogram('filter_seconds', 'Filter time per block', stage='ecg').time():
+        ...
+
+metrics.serve(server) adds /metrics to a Flask (Dash) server plus duration / size histograms of
+every Dash callback request. Set VITALS_METRICS=0 (or metrics.enabled = False) to turn recording
+off; every call then returns after a single flag check.
+"""
+import bisect
+import os
+import threading
+import time
+
+enabled = os.environ.get('VITALS_METRICS', '1') != '0'
+
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+SIZE_BUCKETS = (100, 300, 1000, 3000, 10000, 30000, 100000, 300000, 1000000)
+
+# name -> [type, help, {label tuple: metric}]
+REGISTRY = {}
+_registry_lock = threading.Lock()
+
+
+class Counter:
+    """
+    Monotonic count. With `fn` the value is read from fn() at scrape time instead (e.g. counters
+    that already live in another object).
+    """
+    kind = 'counter'
+
+    def __init__(self, fn=None):
+        self.value = 0
+        self.fn = fn
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        if not enabled:
+            return
+        with self._lock:
+            self.value += n
+
+    def samples(self, name, labels):
+        yield name, labels, self.fn() if self.fn else self.value
+
+
+class Gauge(Counter):
+    """
+    Value that goes up and down: set() it or give `fn` to read it at scrape time.
+    """
+    kind = 'gauge'
+
+    def set(self, value):
+        if enabled:
+            self.value = value
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Histogram:
+    """
+    Cumulative bucket counts plus sum and count, as Prometheus histograms.
+    """
+    kind = 'histogram'
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        if not enabled:
+            return
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        """
+        Context manager observing the duration of its block (in seconds).
+        """
+        return _Timer(self) if enabled else _NULL_TIMER
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            yield name + '_bucket', labels + (('le', format_value(bound)),), cumulative
+        yield name + '_sum', labels, total
+        yield name + '_count', labels, cumulative
+
+
+def _metric(cls, name, help, labels, **kwargs):
+    key = tuple(sorted(labels.items()))
+    with _registry_lock:
+        family = REGISTRY.setdefault(name, [cls.kind, help, {}])
+        if family[0] != cls.kind:
+            raise ValueError(f'Metric {name} is already registered as a {family[0]}')
+        if key not in family[2]:
+            family[2][key] = cls(**kwargs)
+        return family[2][key]
+
+
+def counter(name, help, fn=None, **labels):
+    return _metric(Counter, name, help, labels, fn=fn)
+
+
+def gauge(name, help, fn=None, **labels):
+    return _metric(Gauge, name, help, labels, fn=fn)
+
+
+def histogram(name, help, buckets=TIME_BUCKETS, **labels):
+    return _metric(Histogram, name, help, labels, buckets=buckets)
+
+
+def timed(name, help, **labels):
+    """
+    Decorator recording the duration of every call in the histogram `name`.
+    """
+    def decorate(fn):
+        hist = histogram(name, help, **labels)
+
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                hist.observe(time.perf_counter() - start)
+        wrapper.__name__, wrapper.__doc__, wrapper.__wrapped__ = fn.__name__, fn.__doc__, fn
+        return wrapper
+    return decorate
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+def render():
+    """
+    All registered metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    with _registry_lock:
+        families = [(name, kind, help, list(metrics.items())) for name, (kind, help, metrics) in REGISTRY.items()]
+    for name, kind, help, metrics in sorted(families):
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, metric in metrics:
+            for sample, sample_labels, value in metric.samples(name, labels):
+                lines.append(f'{sample}{_label_text(sample_labels)} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _callback_name(request):
+    # Dash posts the callback's outputs as "..id.prop...id.prop.." (or "id.prop" for one output)
+    body = request.get_json(silent=True) or {}
+    return str(body.get('output', '')).strip('.').replace('...', ',')
+
+
+def serve(server, path='/metrics'):
+    """
+    Adds the metrics endpoint to a Flask server and records duration and response size of each Dash
+    callback request (labelled with the callback's outputs). Network time to the browser is not
+    included; compare with the browser's timings.
+    """
+    from flask import Response, g, request
+
+    @server.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @server.after_request
+    def _record_request(response):
+        if enabled and request.path.endswith('/_dash-update-component'):
+            callback = _callback_name(request)
+            histogram('dash_callback_seconds', 'Dash callback request time (server side, incl. serialization)',
+                      callback=callback).observe(time.perf_counter() - g.metrics_start)
+            if response.content_length is not None:
+                histogram('dash_response_bytes', 'Dash callback response size', SIZE_BUCKETS,
+                          callback=callback).observe(response.content_length)
+        return response
+
+    server.add_url_rule(path, 'metrics', lambda: Response(render(), mimetype='text/plain; version=0.0.4'))
+    return server
@@ -0,0 +1,218 @@
+# multi_bed.py
+"""
+Central-station server: many beds in one process, an overview grid at / and a per-bed monitor at
+/bed/<bed id>.
+
+    python multi_bed.py --beds 8                # synthetic load from the bundled recording
+    python multi_bed.py --beds 8 --check 30     # headless: verify the pump keeps up for 30 s
+    python multi_bed.py --poll                  # dcc.Interval polling instead of the push stream
+
+Scaling target: 8 beds at 500 Hz per pump (one core), see BedRegistry.
+"""
+import argparse
+import sys
+import time
+
+import dash
+from dash import dcc, html
+import dash.dependencies as dd
+import numpy as np
+
+from alarm_engine import VITALS, severity_colors
+from bed_registry import synthetic_registry
+from decimation import bucket_size
+from figure_stream import base_figure, extend_data
+import metrics
+from metrics import timed
+from push_stream import BufferPublisher, StreamHub
+from render_pacer import REQUEST, RUNNING, pace, pacer_components
+from spo2_engine import load_dual_recording
+
+window_size = 2500  # 5 s at 500 Hz per bed view
+plot_width = 1000  # points per trace the plots are decimated to (about their pixel width)
+decimation = {'ecg_filtered': 'minmax', 'ppg_filtered': 'lttb'}
+VITAL_FORMATS = {'heart_rate': '{:.0f} bpm', 'spo2': '{:.0f} %', 'respiratory_rate': '{:.0f} /min',
+                 'body_temp': '{:.1f} °C'}
+VITAL_ICONS = {'heart_rate': '♥', 'spo2': '🫁', 'respiratory_rate': '🌬️', 'body_temp': '🌡️'}
+
+
+def format_vital(name, value):
+    return '--' if np.isnan(value) else VITAL_FORMATS[name].format(value)
+
+
+def bed_from_path(registry, pathname):
+    bed_id = (pathname or '').rstrip('/').rsplit('/', 1)[-1]
+    return registry.beds.get(bed_id)
+
+
+def overview_layout():
+    return html.Div([
+        dcc.Interval(id='interval-overview', interval=1000, n_intervals=0),
+        html.H2('Central station'),
+        html.Div(id='overview-grid',
+                 style={'display': 'grid', 'gridTemplateColumns': 'repeat(8, 1fr)', 'gap': '10px'}),
+    ])
+
+
+def bed_layout(bed_id, push=True):
+    return html.Div([
+        *pacer_components('interval-component-graphs', interval=100, disabled=push),
+        dcc.Store(id='graph-seq'),
+        dcc.Interval(id='interval-component-vitals', interval=1000, n_intervals=0, disabled=push),
+        html.Div(id='push-stream', **{'data-url': f'/stream/{bed_id}' if push else ''}),
+        dcc.Link('← overview', href='/', style={'color': 'white'}),
+        html.H2(bed_id),
+        html.Div(style={'display': 'grid', 'gridTemplateColumns': 'repeat(5, 1fr)', 'gap': '10px'}, children=[
+            html.Div(style={'gridColumn': 'span 4', 'border': '1px solid white', 'padding': '10px'},
+                     children=[dcc.Graph(id='ecg-plot', figure=base_figure('ECG', 'red', width=2),
+                                         config={'displayModeBar': False}),
+                               dcc.Graph(id='ppg-plot', figure=base_figure('PPG', 'lightblue', width=2),
+                                         config={'displayModeBar': False})]),
+            html.Div(children=[
+                html.Div(id=f'{name}-container', style={'border': '1px solid white', 'padding': '10px'}, children=[
+                    html.Span(VITAL_ICONS[name], style={'fontSize': '40px', 'marginRight': '10px'}),
+                    html.Span(id=f'{name}-value', style={'fontSize': '40px', 'fontWeight': 'bold'})
+                ]) for name in VITALS
+            ]),
+        ]),
+    ])
+
+
+def bed_vitals(registry, bed):
+    """
+    Vitals of one bed as pushed to the browser: element id -> text / background colour.
+    """
+    colors = severity_colors(registry.alarm_codes(bed.bed_id), [bed.vitals[name] for name in VITALS])
+    vitals = {f'{name}-value': {'text': format_vital(name, bed.vitals[name])} for name in VITALS}
+    vitals.update({f'{name}-container': {'color': color} for name, color in zip(VITALS, colors)})
+    return vitals
+
+
+def add_push_streams(app, registry):
+    """
+    One Server-Sent Events stream per bed at /stream/<bed id>, published from the registry's pump
+    thread right after new samples were ingested.
+    """
+    publishers = {}
+    for bed in registry.beds.values():
+        publishers[bed.bed_id] = BufferPublisher(
+            StreamHub(), bed.buffer, {'ecg-plot': 'ecg_filtered', 'ppg-plot': 'ppg_filtered'}, window_size,
+            bucket_size(window_size, plot_width, decimation), decimation,
+            vitals_fn=lambda bed=bed: bed_vitals(registry, bed), dx=1 / bed.sampling_rate)
+
+    def stream(bed_id):
+        if bed_id not in publishers:
+            return 'Unknown bed', 404
+        return publishers[bed_id].hub.response()
+
+    app.server.add_url_rule('/stream/<bed_id>', 'stream', stream)
+    registry.listeners.append(lambda: [publisher.publish_new() for publisher in publishers.values()])
+    return publishers
+
+
+def create_app(registry, push=True):
+    app = dash.Dash(__name__, suppress_callback_exceptions=True)
+    app.title = 'Central station'
+    app.layout = html.Div(style={'backgroundColor': 'black', 'color': 'white', 'padding': '20px'}, children=[
+        dcc.Location(id='url'),
+        html.Div(id='page'),
+    ])
+    metrics.serve(app.server)
+    if push:
+        add_push_streams(app, registry)
+
+    @app.callback(dd.Output('page', 'children'), dd.Input('url', 'pathname'))
+    def render_page(pathname):
+        bed = bed_from_path(registry, pathname)
+        return bed_layout(bed.bed_id, push) if bed is not None else overview_layout()
+
+    @app.callback(dd.Output('overview-grid', 'children'), dd.Input('interval-overview', 'n_intervals'))
+    def update_overview(n):
+        tiles = []
+        for bed in list(registry.beds.values()):
+            colors = severity_colors(registry.alarm_codes(bed.bed_id), [bed.vitals[name] for name in VITALS])
+            tiles.append(dcc.Link(href=f'/bed/{bed.bed_id}', style={'color': 'white', 'textDecoration': 'none'}, children=[
+                html.Div(style={'border': '1px solid white', 'padding': '6px'}, children=[
+                    html.B(bed.bed_id),
+                    *[html.Div(f'{VITAL_ICONS[name]} {format_vital(name, bed.vitals[name])}',
+                               style={'backgroundColor': color}) for name, color in zip(VITALS, colors)]
+                ])
+            ]))
+        return tiles
+
+    @app.callback(
+        [dd.Output('ecg-plot', 'extendData'),
+         dd.Output('ppg-plot', 'extendData'),
+         dd.Output('graph-seq', 'data')],
+        [dd.Input(REQUEST, 'data')],
+        [dd.State('url', 'pathname'),
+         dd.State('graph-seq', 'data')],
+        running=RUNNING
+    )
+    @timed('callback_compute_seconds', 'Callback time before serialization', callback='update_graphs')
+    def update_graphs(n, pathname, since):
+        bed = bed_from_path(registry, pathname)
+        if bed is None:
+            return dash.no_update, dash.no_update, dash.no_update
+        since, updates = extend_data(bed.buffer, ('ecg_filtered', 'ppg_filtered'), since, window_size,
+                                     bucket_size(window_size, plot_width, decimation), decimation)
+        if updates is None:
+            return dash.no_update, dash.no_update, dash.no_update
+        return updates[0], updates[1], since
+    pace(app, 'interval-component-graphs')
+
+    @app.callback(
+        [dd.Output(f'{name}-value', 'children') for name in VITALS]
+        + [dd.Output(f'{name}-container', 'style') for name in VITALS],
+        [dd.Input('interval-component-vitals', 'n_intervals')],
+        [dd.State('url', 'pathname')]
+    )
+    @timed('callback_compute_seconds', 'Callback time before serialization', callback='update_vital_signs')
+    def update_vital_signs(n, pathname):
+        bed = bed_from_path(registry, pathname)
+        if bed is None:
+            return [dash.no_update] * (2 * len(VITALS))
+        vitals = bed_vitals(registry, bed)
+        return (
+            [vitals[f'{name}-value']['text'] for name in VITALS]
+            + [{'backgroundColor': vitals[f'{name}-container']['color'], 'color': 'white', 'fontWeight': 'bold',
+                'border': '1px solid white', 'padding': '10px'} for name in VITALS]
+        )
+
+    return app
+
+
+def check(registry, seconds, margin=0.005):
+    """
+    Runs the registry headless and reports whether acquisition kept up with real time: (nearly)
+    every sample pumped and no cycle longer than the registry's block_time plus `margin` seconds.
+    """
+    cpu_start, wall_start = time.process_time(), time.monotonic()
+    registry.start()
+    time.sleep(seconds)
+    registry.stop()
+    cpu, wall = time.process_time() - cpu_start, time.monotonic() - wall_start
+
+    expected = int(seconds * registry.sampling_rate)
+    stats = registry.stats
+    print(f'{len(registry)} beds @ {registry.sampling_rate:g} Hz for {seconds} s')
+    print(f'  samples per bed: {stats["samples"]} (expected ~{expected})')
+    print(f'  CPU: {cpu / wall:.2f} cores, pump busy {stats["busy"] / wall:.1%}, '
+          f'worst cycle {stats["max_cycle"] * 1000:.1f} ms (budget {registry.block_time * 1000:.0f} ms)')
+    return stats['samples'] >= 0.98 * expected and stats['max_cycle'] <= registry.block_time + margin
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--beds', type=int, default=8)
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--check', type=float, metavar='SECONDS', help='run headless and report throughput')
+    parser.add_argument('--poll', action='store_true', help='poll with dcc.Interval instead of pushing over SSE')
+    args = parser.parse_args()
+
+    registry = synthetic_registry(args.beds, load_dual_recording(), window_size)
+    if args.check:
+        sys.exit(0 if check(registry, args.check) else 1)
+
+    registry.start()
+    create_app(registry, push=not args.poll).run(debug=False, port=args.port)
@@ -0,0 +1,261 @@
+# push_stream.py
+import collections
+import json
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from figure_stream import decimate_view, extend_data
+from metrics import counter, gauge
+from waveform_codec import encode_trace
+
+_hubs = weakref.WeakSet()
+published_events = counter('push_events_total', 'Events queued for push subscribers (one per subscriber)')
+published_bytes = counter('push_bytes_total', 'Bytes queued for push subscribers')
+dropped_events = counter('push_dropped_events_total', 'Events dropped because a subscriber fell behind')
+gauge('push_subscribers', 'Connected push subscribers', fn=lambda: sum(len(hub.subscribers) for hub in list(_hubs)))
+gauge('push_queue_depth', 'Events waiting in the push subscriber queues',
+      fn=lambda: sum(len(s._events) for hub in list(_hubs) for s in list(hub.subscribers)))
+
+
+class Subscriber:
+    """
+    One connected browser. Events wait in a bounded queue; when the client can't keep up the
+    oldest events are dropped (and counted) instead of letting the backlog grow.
+    """
+    def __init__(self, max_queue):
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._events = collections.deque()
+        self._cond = threading.Condition()
+
+    def put(self, message):
+        with self._cond:
+            if len(self._events) >= self.max_queue:
+                self._events.popleft()
+                self.dropped += 1
+                dropped_events.inc()
+            self._events.append(message)
+            self._cond.notify()
+
+    def get(self, timeout):
+        with self._cond:
+            self._cond.wait_for(lambda: self._events, timeout)
+            return self._events.popleft() if self._events else None
+
+
+class StreamHub:
+    """
+    Fan-out of Server-Sent Events to the connected browsers. Each event is serialized once and the
+    same bytes are queued for every subscriber.
+    """
+    def __init__(self, max_queue=50, keepalive=15):
+        self.max_queue = max_queue
+        self.keepalive = keepalive
+        self.subscribers = set()
+        self._lock = threading.Lock()
+        self.on_subscribe = None  # optional callable returning the initial messages for a new client
+        # Held while a client subscribes; a publisher shares its own lock here so nothing is
+        # published between a new client's initial messages and its registration
+        self.subscribe_lock = threading.RLock()
+        _hubs.add(self)
+
+    @staticmethod
+    def message(event, data):
+        return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'.encode('utf-8')
+
+    def publish(self, event, data):
+        with self._lock:
+            subscribers = list(self.subscribers)
+        if not subscribers:
+            return
+        message = self.message(event, data)
+        for subscriber in subscribers:
+            subscriber.put(message)
+        published_events.inc(len(subscribers))
+        published_bytes.inc(len(message) * len(subscribers))
+
+    def subscribe(self):
+        subscriber = Subscriber(self.max_queue)
+        with self.subscribe_lock:
+            for message in (self.on_subscribe() if self.on_subscribe else []):
+                subscriber.put(message)
+            with self._lock:
+                self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self.subscribers.discard(subscriber)
+
+    def events(self):
+        """
+        Generator of SSE bytes for one client; ends (and unsubscribes) when the client disconnects.
+        """
+        subscriber = self.subscribe()
+        try:
+            yield b'retry: 1000\n\n'
+            while True:
+                message = subscriber.get(self.keepalive)
+                yield message if message is not None else b': keepalive\n\n'
+        finally:
+            self.unsubscribe(subscriber)
+
+    def response(self):
+        """
+        Flask view: server.add_url_rule('/stream', 'stream', hub.response)
+        """
+        from flask import Response
+
+        return Response(self.events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def window_traces(traces, dx=None):
+    """
+    Data of a 'window' event redrawing whole traces: {graph id: encoded trace}.
+
+    :param traces: Dict of graph id -> (x, y)
+    """
+    return {graph_id: encode_trace(x, y, dx) if dx else {'x': np.asarray(x).tolist(), 'y': np.asarray(y).tolist()}
+            for graph_id, (x, y) in traces.items()}
+
+
+class BufferPublisher:
+    """
+    Publishes a ring buffer to a StreamHub: a 'window' event with the current (decimated) window
+    for each new client, 'samples' events (Plotly.extendTraces arguments) as data arrives and a
+    'vitals' event every `vitals_interval` seconds. The acquisition side calls notify() after
+    writing, so latency is bounded by data arrival plus `min_interval` (which also coalesces
+    samples into blocks).
+    """
+    def __init__(self, hub, buffer, traces, window, bucket=1, methods=None, vitals_fn=None, vitals_interval=1.0,
+                 min_interval=0.02, dx=None):
+        """
+        :param traces: Dict of graph id -> buffer channel
+        :param vitals_fn: Callable returning {element id: {'text': ..., 'color': ...}}
+        :param dx: Sample spacing of the buffer's 't' channel; given, traces are sent as compact typed
+                   arrays (see waveform_codec) instead of JSON lists
+        """
+        self.hub = hub
+        self.buffer = buffer
+        self.graph_ids = list(traces)
+        self.channels = list(traces.values())
+        self.window = window
+        self.bucket = bucket
+        self.methods = methods or {}
+        self.vitals_fn = vitals_fn
+        self.vitals_interval = vitals_interval
+        self.min_interval = min_interval
+        self.dx = dx
+        self.since = None
+        self._last_vitals = 0
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        hub.on_subscribe = self._initial_messages
+        hub.subscribe_lock = self._lock
+
+    def notify(self):
+        self._wake.set()
+
+    def _initial_messages(self):
+        with self._lock:
+            if self.since is None:
+                self.since = self.buffer.write_seq
+            end = self.since
+            seq, view = self.buffer.window(self.window + self.buffer.write_seq - end)
+            keep = end - seq
+            start = max(keep - self.window, 0)
+            _, traces = decimate_view(self.buffer, seq + start, view[:, start:keep], self.channels, self.bucket,
+                                      self.methods)
+        messages = [self.hub.message('window', {'traces': window_traces(dict(zip(self.graph_ids, traces)), self.dx)})]
+        if self.vitals_fn is not None:
+            messages.append(self.hub.message('vitals', self.vitals_fn()))
+        return messages
+
+    def publish_new(self):
+        """
+        Publishes the samples written since the last call (nothing is serialized without subscribers).
+        """
+        with self._lock:
+            if not self.hub.subscribers:
+                self.since = self.buffer.write_seq
+                return
+            self.since, updates = extend_data(self.buffer, self.channels, self.since, self.window, self.bucket,
+                                              self.methods, dx=self.dx)
+            if updates is not None:
+                self.hub.publish('samples', {'seq': self.since, 'traces': dict(zip(self.graph_ids, updates))})
+
+        now = time.monotonic()
+        if self.vitals_fn is not None and now - self._last_vitals >= self.vitals_interval:
+            self._last_vitals = now
+            self.hub.publish('vitals', self.vitals_fn())
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.vitals_interval)
+            self._wake.clear()
+            self.publish_new()
+            time.sleep(self.min_interval)
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+
+class WindowPublisher:
+    """
+    Publishes windows that are recomputed as a whole instead of extended, e.g. a min/max envelope
+    of the last hours from a pyramid.Pyramid: a 'window' event for each new client and then every
+    `refresh` seconds while anyone is subscribed, plus the 'vitals' events of BufferPublisher.
+    """
+    def __init__(self, hub, window_fn, refresh=1.0, vitals_fn=None, dx=None):
+        """
+        :param window_fn: Callable returning {graph id: (x, y)}
+        :param vitals_fn: Callable returning {element id: {'text': ..., 'color': ...}}
+        :param dx: Sample spacing of x (see BufferPublisher)
+        """
+        self.hub = hub
+        self.window_fn = window_fn
+        self.refresh = refresh
+        self.vitals_fn = vitals_fn
+        self.dx = dx
+        self._stop = threading.Event()
+        hub.on_subscribe = self._messages
+
+    def notify(self):
+        pass  # refreshed on its own clock, not per block
+
+    def _messages(self):
+        messages = [self.hub.message('window', {'traces': window_traces(self.window_fn(), self.dx)})]
+        if self.vitals_fn is not None:
+            messages.append(self.hub.message('vitals', self.vitals_fn()))
+        return messages
+
+    def publish_new(self):
+        """
+        Publishes the current window and vitals (nothing is computed without subscribers).
+        """
+        if not self.hub.subscribers:
+            return
+        self.hub.publish('window', {'traces': window_traces(self.window_fn(), self.dx)})
+        if self.vitals_fn is not None:
+            self.hub.publish('vitals', self.vitals_fn())
+
+    def _run(self):
+        while not self._stop.wait(self.refresh):
+            self.publish_new()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,217 @@
+# pyramid.py
+import sys
+import threading
+import time
+
+import numpy as np
+
+from decimation import minmax
+
+
+class _Level:
+    """
+    min / max / sum of consecutive buckets of one pyramid level, in growable arrays. With
+    `max_entries` the oldest entries are dropped once twice that many are stored (so the arrays
+    stop growing and dropping costs O(1) per entry on average).
+    """
+    def __init__(self, n_channels, bucket, dtype, max_entries=None):
+        self.bucket = bucket  # samples per entry
+        self.max_entries = max_entries
+        self.first = 0  # number of the oldest entry kept
+        self.n = 0  # number of entries appended so far (entry i is stored at i - first)
+        size = 1024 if max_entries is None else min(1024, 2 * max_entries)
+        self.min = np.empty((n_channels, size), dtype)
+        self.max = np.empty((n_channels, size), dtype)
+        self.sum = np.empty((n_channels, size), np.float64)
+
+    def append(self, mins, maxs, sums):
+        k = mins.shape[1]
+        self.n += k
+        if self.max_entries is not None and k > self.max_entries:
+            mins, maxs, sums = (values[:, k - self.max_entries:] for values in (mins, maxs, sums))
+            k = self.max_entries
+            self.first = self.n - k
+        kept = self.n - k - self.first
+        if self.max_entries is not None and kept + k > 2 * self.max_entries:
+            # Keep the newest max_entries (including the new ones)
+            drop = kept + k - self.max_entries
+            for values in (self.min, self.max, self.sum):
+                values[:, :kept - drop] = values[:, drop:kept]
+            self.first += drop
+            kept -= drop
+        if kept + k > self.min.shape[1]:
+            size = max(2 * self.min.shape[1], kept + k)
+            if self.max_entries is not None:
+                size = min(size, 2 * self.max_entries)
+            for name in ('min', 'max', 'sum'):
+                grown = np.empty((mins.shape[0], size), getattr(self, name).dtype)
+                grown[:, :kept] = getattr(self, name)[:, :kept]
+                setattr(self, name, grown)
+        self.min[:, kept:kept + k] = mins
+        self.max[:, kept:kept + k] = maxs
+        self.sum[:, kept:kept + k] = sums
+
+
+class Pyramid:
+    """
+    Multi-resolution min / max / mean index of a multi-channel stream, built incrementally as
+    blocks arrive. Level i summarises buckets of `base * factor**i` samples, so any range (5 s or
+    24 h) is drawn from the finest level that still gives at most `n_points` buckets: bounded time
+    and memory per query, whatever the range, without touching the raw samples.
+
+    Times are sample based: sample `seq` is at `start_time + seq / sampling_rate`.
+
+    With `retention` every level keeps the last `retention` samples (up to twice that), so memory
+    stays bounded however long the monitor runs; older ranges are no longer returned.
+    """
+    def __init__(self, channels, sampling_rate, base=64, factor=4, levels=8, start_time=0.0, dtype=np.float32,
+                 raw_fn=None, retention=None):
+        """
+        :param channels: Channel names
+        :param base: Samples per bucket of the finest level
+        :param factor: Buckets of one level merged into one bucket of the next
+        :param raw_fn: Optional callable (start seq, stop seq) -> raw block (n_channels, k), or None when
+                       those samples are gone; used for ranges short enough to show raw samples
+        :param retention: Samples of history to keep (None: everything); blocks passed to append()
+                          should be shorter than this
+        """
+        self.channels = tuple(channels)
+        self.index = {name: i for i, name in enumerate(self.channels)}
+        self.sampling_rate = sampling_rate
+        self.base = base
+        self.factor = factor
+        self.start_time = start_time
+        self.raw_fn = raw_fn
+        self.n_samples = 0
+        self.retention = retention
+        # A few extra entries per level for the ones the next level hasn't merged yet
+        self.levels = [_Level(len(self.channels), base * factor ** i, dtype,
+                              None if retention is None else -(-retention // (base * factor ** i)) + factor)
+                       for i in range(levels)]
+        self._tail = np.empty((len(self.channels), 0))  # samples not yet in a complete finest bucket
+        self._lock = threading.Lock()  # one writer (acquisition) and concurrent queries (callbacks)
+
+    def append(self, block):
+        """
+        Adds samples, shape (n_channels, k). Cost is proportional to the new samples only.
+        """
+        block = np.asarray(block, dtype=float)
+        with self._lock:
+            self._append(block)
+
+    def _append(self, block):
+        self.n_samples += block.shape[1]
+        data = np.concatenate([self._tail, block], axis=1) if self._tail.shape[1] else block
+        n_full = data.shape[1] // self.base * self.base
+        self._tail = data[:, n_full:].copy()
+        if n_full == 0:
+            return
+        buckets = data[:, :n_full].reshape(len(self.channels), -1, self.base)
+        # NaN (channels a device doesn't send) stays NaN in min/max/mean
+        self.levels[0].append(buckets.min(axis=2), buckets.max(axis=2), buckets.sum(axis=2))
+
+        for lower, upper in zip(self.levels, self.levels[1:]):
+            done = upper.n * self.factor
+            ready = (lower.n - done) // self.factor * self.factor
+            if ready == 0:
+                break
+            shape = (len(self.channels), -1, self.factor)
+            sl = slice(done - lower.first, done - lower.first + ready)
+            upper.append(lower.min[:, sl].reshape(shape).min(axis=2), lower.max[:, sl].reshape(shape).max(axis=2),
+                         lower.sum[:, sl].reshape(shape).sum(axis=2))
+
+    def time(self, seq):
+        return self.start_time + np.asarray(seq) / self.sampling_rate
+
+    def seq(self, t):
+        return int(round((t - self.start_time) * self.sampling_rate))
+
+    def _collect(self, level, start, stop):
+        """
+        Buckets of `level` covering [start, stop), with the part the level hasn't summarised yet
+        filled in from the finer levels (and finally the raw tail).
+
+        :return: List of (first seq, bucket size, min, max, mean) per contiguous piece
+        """
+        if level < 0:
+            tail_start = self.n_samples - self._tail.shape[1]
+            lo, hi = max(start, tail_start), min(stop, self.n_samples)
+            if hi <= lo:
+                return []
+            values = self._tail[:, lo - tail_start:hi - tail_start]
+            return [(lo, 1, values, values, values)]
+        lvl = self.levels[level]
+        covered = lvl.n * lvl.bucket
+        pieces = []
+        first, last = max(start // lvl.bucket, lvl.first), min(-(-stop // lvl.bucket), lvl.n)
+        if last > first:
+            sl = slice(first - lvl.first, last - lvl.first)
+            pieces.append((first * lvl.bucket, lvl.bucket, lvl.min[:, sl], lvl.max[:, sl], lvl.sum[:, sl] / lvl.bucket))
+        if stop > covered:
+            pieces += self._collect(level - 1, max(start, covered), stop)
+        return pieces
+
+    def query(self, start, stop, n_points=1000):
+        """
+        Summary of samples [start, stop) with at most about n_points buckets (plus a few finer
+        ones for the newest, not yet summarised samples).
+
+        :return: (bucket start times, min, max, mean), the last three of shape (n_channels, k).
+                 For short ranges with raw_fn these are the raw samples (min == max == mean).
+        """
+        start, stop = max(int(start), 0), min(int(stop), self.n_samples)
+        span = stop - start
+        if span <= 0:
+            empty = np.empty((len(self.channels), 0))
+            return np.empty(0), empty, empty, empty
+        if self.raw_fn is not None and span <= n_points * self.base // 2:
+            raw = self.raw_fn(start, stop)
+            if raw is not None and raw.shape[1] == span:
+                return self.time(np.arange(start, stop)), raw, raw, raw
+
+        level = 0
+        while level < len(self.levels) - 1 and span / self.levels[level].bucket > n_points:
+            level += 1
+        with self._lock:
+            pieces = self._collect(level, start, stop)
+            t = np.concatenate([first + size * np.arange(mins.shape[1]) for first, size, mins, _, _ in pieces])
+            mins, maxs, means = (np.concatenate([piece[i] for piece in pieces], axis=1) for i in (2, 3, 4))
+        return self.time(t), mins, maxs, means
+
+    def envelope(self, channel, start, stop, n_points=1000):
+        """
+        (x, y) line through every bucket's min and max (in that order), for plotting a range without
+        losing peaks; raw samples are min-max decimated to about n_points.
+        """
+        t, mins, maxs, _ = self.query(start, stop, max(n_points // 2, 1))
+        i = self.index[channel]
+        if mins is maxs:
+            return minmax(t, mins[i], max(n_points // 2, 1)) if len(t) > n_points else (t, mins[i])
+        return np.repeat(t, 2), np.stack([mins[i], maxs[i]], axis=1).reshape(-1)
+
+    @property
+    def nbytes(self):
+        return sum(lvl.min.nbytes + lvl.max.nbytes + lvl.sum.nbytes for lvl in self.levels)
+
+
+if __name__ == '__main__':
+    # python pyramid.py [hours]  ->  build time, memory and query times for a long synthetic stream
+    from recording import load_recording
+
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 24
+    recording = load_recording()
+    fs = recording.sampling_rate
+    ecg, ppg = np.asarray(recording['ECG'], float), np.asarray(recording['PPG'], float)
+    pyramid = Pyramid(('ecg', 'ppg'), fs)
+    n_total, block = int(hours * 3600 * fs), int(60 * fs)
+    started = time.perf_counter()
+    for start in range(0, n_total, block):
+        idx = np.arange(start, min(start + block, n_total)) % len(ecg)
+        pyramid.append(np.vstack([ecg[idx], ppg[idx]]))
+    print(f'{hours:g} h ({n_total:,} samples x 2 channels) indexed in {time.perf_counter() - started:.1f} s, '
+          f'{pyramid.nbytes / 2 ** 20:.1f} MiB')
+    for seconds in (5, 60, 3600, hours * 3600):
+        n = int(seconds * fs)
+        started = time.perf_counter()
+        x, y = pyramid.envelope('ecg', n_total - n, n_total, 1000)
+        print(f'  last {seconds:>8g} s: {len(x)} points in {(time.perf_counter() - started) * 1000:.2f} ms')
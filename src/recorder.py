@@ -0,0 +1,318 @@
+# recorder.py
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from metrics import counter, histogram
+
+# Session file layout (append-only):
+#   MAGIC (4 bytes) | header length (uint32) | JSON header
+#   chunk* where chunk = CHUNK_MAGIC | first seq (uint64) | time of first sample (float64, unix)
+#                        | n samples (uint32) | payload length (uint32) | CRC32 of payload (uint32) | payload
+# The payload is the chunk's samples (channel-major, header dtype), byte-shuffled and zlib-compressed.
+# A crash can only leave a truncated last chunk, which readers detect with the length/CRC and skip.
+# The timestamp index (<path>.idx: first seq, time, file offset, n samples per chunk) is a cache
+# that can always be rebuilt by scanning the chunks.
+MAGIC = b'VSC1'
+CHUNK_MAGIC = b'CHNK'
+CHUNK = struct.Struct('<4sQdIII')
+INDEX_DTYPE = np.dtype([('seq', '<u8'), ('time', '<f8'), ('offset', '<u8'), ('n', '<u4')])
+SESSION_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'data', 'sessions')
+
+recorded_samples = counter('recorder_samples_total', 'Samples written to session files')
+recorded_bytes = counter('recorder_bytes_total', 'Compressed bytes written to session files')
+lost_samples = counter('recorder_lost_samples_total', 'Samples overwritten in the ring buffer before they were recorded')
+write_seconds = histogram('recorder_chunk_seconds', 'Time to compress and write one chunk')
+
+
+def _shuffle(block):
+    # Grouping the n-th byte of every value together makes slowly changing signals compress far better
+    return block.view(np.uint8).reshape(-1, block.dtype.itemsize).T.tobytes()
+
+
+def _unshuffle(data, dtype, shape):
+    itemsize = np.dtype(dtype).itemsize
+    raw = np.frombuffer(data, np.uint8).reshape(itemsize, -1).T.copy()
+    return raw.view(dtype).reshape(shape)
+
+
+class SessionWriter:
+    """
+    Appends chunks to a session file (and its index). Used by Recorder's writer thread; not thread safe.
+    """
+    def __init__(self, path, channels, sampling_rate, dtype=np.float32, level=6, fsync_interval=5.0, **meta):
+        """
+        :param dtype: Storage dtype; float32 holds ADC values up to 24 bits exactly
+        :param fsync_interval: Seconds between fsyncs (every chunk is flushed to the OS right away)
+        """
+        self.path = path
+        self.channels = tuple(channels)
+        self.dtype = np.dtype(dtype)
+        self.level = level
+        self.fsync_interval = fsync_interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        header = json.dumps(dict(meta, channels=list(self.channels), dtype=self.dtype.str,
+                                 sampling_rate=float(sampling_rate))).encode('utf-8')
+        self._file = open(path, 'xb')
+        self._file.write(MAGIC + struct.pack('<I', len(header)) + header)
+        self._index = open(path + '.idx', 'wb')
+        self._last_sync = time.monotonic()
+        self.sync()
+
+    def write(self, first_seq, first_time, block):
+        """
+        :param block: Shape (n_channels, k)
+        """
+        block = np.ascontiguousarray(block, dtype=self.dtype)
+        payload = zlib.compress(_shuffle(block), self.level)
+        offset = self._file.tell()
+        self._file.write(CHUNK.pack(CHUNK_MAGIC, first_seq, first_time, block.shape[1], len(payload),
+                                    zlib.crc32(payload)))
+        self._file.write(payload)
+        self._file.flush()
+        self._index.write(np.array([(first_seq, first_time, offset, block.shape[1])], INDEX_DTYPE).tobytes())
+        self._index.flush()
+        if time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+        return CHUNK.size + len(payload)
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self._file.close()
+        self._index.close()
+
+
+class Recorder:
+    """
+    Records ring buffer channels to a session file from a background thread. The thread wakes every
+    `chunk_time` seconds and copies whatever was written since its last pass, so acquisition and
+    the UI never wait for the disk: a slow disk only delays the writer, and if it falls behind by
+    more than the ring buffer's capacity the overwritten samples are counted as lost (the gap shows
+    up as a jump in the chunks' sequence numbers).
+    """
+    def __init__(self, buffer, path, channels=('ecg', 'ppg'), sampling_rate=500, chunk_time=1.0, **writer_kwargs):
+        self.buffer = buffer
+        self.path = path
+        self.channels = tuple(channels)
+        self.sampling_rate = sampling_rate
+        self.chunk_time = chunk_time
+        self.writer_kwargs = writer_kwargs
+        self.lost = 0
+        self.samples = 0
+        self.bytes = 0
+        self.error = None  # exception that stopped the writer thread (or start())
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def recording(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._stop.clear()
+        # Recording starts with the next sample; its wall-clock time anchors the timestamps
+        self._since = self.buffer.write_seq
+        self._start_seq, self._start_time = self._since, time.time()
+        self._writer = SessionWriter(self.path, self.channels, self.sampling_rate, start_time=self._start_time,
+                                     **self.writer_kwargs)
+        self._thread = threading.Thread(target=self._run, name='recorder', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Writes what is left and closes the file.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _copy_new(self):
+        buffer = self.buffer
+        if not buffer.is_valid(self._since):
+            skipped = max(buffer.write_seq, buffer.claim_seq) - buffer.capacity - self._since
+            self._since += skipped
+            self.lost += skipped
+            lost_samples.inc(skipped)
+        seq, view = buffer.read(self._since)
+        rows = [buffer.index[name] for name in self.channels]
+        block = view[rows]  # fancy indexing copies
+        if not buffer.is_valid(seq):
+            return None, None  # overrun while copying; picked up as lost on the next pass
+        self._since = seq + view.shape[1]
+        return seq, block
+
+    def _run(self):
+        try:
+            while True:
+                stopping = self._stop.wait(self.chunk_time)
+                seq, block = self._copy_new()
+                if block is not None and block.shape[1]:
+                    with write_seconds.time():
+                        first_time = self._start_time + (seq - self._start_seq) / self.sampling_rate
+                        n_bytes = self._writer.write(seq, first_time, block)
+                    self.samples += block.shape[1]
+                    self.bytes += n_bytes
+                    recorded_samples.inc(block.shape[1])
+                    recorded_bytes.inc(n_bytes)
+                if stopping:
+                    break
+        except Exception as e:
+            self.error = e  # recording is False from now on; re-raised so the traceback is printed
+            raise
+        finally:
+            self._writer.close()
+
+
+def session_path(directory=SESSION_DIR):
+    """
+    New session file named after the current time, with a counter when another session started
+    within the same second (e.g. Stop and Record again).
+    """
+    base = os.path.join(directory, time.strftime('session-%Y%m%d-%H%M%S'))
+    path, n = base + '.vsc', 1
+    while os.path.exists(path):
+        n += 1
+        path = f'{base}-{n}.vsc'
+    return path
+
+
+class SessionReader:
+    """
+    Reads a session file written by Recorder, including one that is still being written or was cut
+    off by a crash (the truncated tail is ignored).
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, length = struct.unpack('<4sI', f.read(8))
+            if magic != MAGIC:
+                raise ValueError(f'{path} is not a session file')
+            self.header = json.loads(f.read(length))
+            self._data_start = 8 + length
+        self.channels = tuple(self.header['channels'])
+        self.dtype = np.dtype(self.header['dtype'])
+        self.sampling_rate = self.header['sampling_rate']
+        self.index = self._load_index()
+
+    def _load_index(self):
+        size = os.path.getsize(self.path)
+        try:
+            with open(self.path + '.idx', 'rb') as f:
+                data = f.read()
+            index = np.frombuffer(data[:len(data) // INDEX_DTYPE.itemsize * INDEX_DTYPE.itemsize], INDEX_DTYPE)
+            # Only trust entries whose chunk is completely in the file (a crash can cut the last one)
+            index = index[index['offset'] + CHUNK.size <= size]
+            if len(index):
+                with open(self.path, 'rb') as f:
+                    f.seek(int(index['offset'][-1]))
+                    length = CHUNK.unpack(f.read(CHUNK.size))[4]
+                if index['offset'][-1] + CHUNK.size + length > size:
+                    index = index[:-1]
+            return index
+        except OSError:
+            return self.scan()
+
+    def scan(self):
+        """
+        Rebuilds the index from the chunks themselves, stopping at the first incomplete or corrupt one.
+        """
+        entries = []
+        with open(self.path, 'rb') as f:
+            f.seek(self._data_start)
+            while True:
+                offset = f.tell()
+                head = f.read(CHUNK.size)
+                if len(head) < CHUNK.size:
+                    break
+                magic, seq, first_time, n, length, crc = CHUNK.unpack(head)
+                payload = f.read(length)
+                if magic != CHUNK_MAGIC or len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                entries.append((seq, first_time, offset, n))
+        return np.array(entries, INDEX_DTYPE)
+
+    def _read_chunk(self, f, entry):
+        f.seek(int(entry['offset']))
+        magic, seq, _, n, length, crc = CHUNK.unpack(f.read(CHUNK.size))
+        payload = f.read(length)
+        if magic != CHUNK_MAGIC or len(payload) < length or zlib.crc32(payload) != crc:
+            return None
+        return _unshuffle(zlib.decompress(payload), self.dtype, (len(self.channels), n))
+
+    def read(self, start_time=None, end_time=None):
+        """
+        Samples between two unix timestamps (the whole session by default).
+
+        :return: (time of each sample, dict of channel name -> values)
+        """
+        index = self.index
+        lo = 0 if start_time is None else max(np.searchsorted(index['time'], start_time, 'right') - 1, 0)
+        hi = len(index) if end_time is None else np.searchsorted(index['time'], end_time, 'right')
+        times, blocks = [], []
+        with open(self.path, 'rb') as f:
+            for entry in index[lo:hi]:
+                block = self._read_chunk(f, entry)
+                if block is None:
+                    break
+                blocks.append(block)
+                times.append(entry['time'] + np.arange(block.shape[1]) / self.sampling_rate)
+        if not blocks:
+            return np.empty(0), {name: np.empty(0, self.dtype) for name in self.channels}
+        t, data = np.concatenate(times), np.concatenate(blocks, axis=1)
+        keep = np.ones(len(t), bool)
+        if start_time is not None:
+            keep &= t >= start_time
+        if end_time is not None:
+            keep &= t < end_time
+        return t[keep], {name: data[i][keep] for i, name in enumerate(self.channels)}
+
+    @property
+    def n_samples(self):
+        return int(self.index['n'].sum())
+
+    def read_samples(self, start, stop):
+        """
+        Samples [start, stop) counted over the chunks in file order (gaps are not filled in).
+
+        :return: Dict of channel name -> values
+        """
+        ends = np.cumsum(self.index['n'].astype(np.int64))
+        lo, hi = np.searchsorted(ends, start, 'right'), np.searchsorted(ends, stop, 'left') + 1
+        blocks = []
+        with open(self.path, 'rb') as f:
+            for entry in self.index[lo:hi]:
+                block = self._read_chunk(f, entry)
+                if block is None:
+                    break
+                blocks.append(block)
+        data = np.concatenate(blocks, axis=1) if blocks else np.empty((len(self.channels), 0), self.dtype)
+        first = ends[lo - 1] if lo else 0
+        return {name: data[i, start - first:stop - first] for i, name in enumerate(self.channels)}
+
+    def summary(self):
+        n = int(self.index['n'].sum()) if len(self.index) else 0
+        gaps = int(np.count_nonzero(np.diff(self.index['seq'].astype(np.int64)) != self.index['n'][:-1])) \
+            if len(self.index) > 1 else 0
+        raw = n * len(self.channels) * self.dtype.itemsize
+        size = os.path.getsize(self.path)
+        return {'chunks': len(self.index), 'samples': n, 'duration': n / self.sampling_rate, 'gaps': gaps,
+                'bytes': size, 'compression': raw / max(size, 1)}
+
+
+if __name__ == '__main__':
+    # python recorder.py session.vsc  ->  summary of a recorded session
+    for path in sys.argv[1:]:
+        print(path, SessionReader(path).summary())
@@ -0,0 +1,215 @@
+# recording.py
+import json
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+
+from numeric_channel import NumericChannel, change_points
+
+# File layout:
+#   MAGIC (4 bytes) | header length (uint32, little endian) | JSON header | padding | channel data
+# Every channel is stored contiguously (channel-major) and starts on a DATA_ALIGN boundary, so
+# the loader can hand out zero-copy numpy views straight from one shared read-only mmap.
+# Waveform channels hold n_samples values at the sampling rate; numeric channels (version 2) only
+# their changes: n values plus their times (float64 seconds) at times_offset.
+MAGIC = b'VSR1'
+FORMAT_VERSION = 2
+DATA_ALIGN = 64
+DEFAULT_SAMPLING_RATE = 500
+DATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'data')
+DEFAULT_RECORDING = os.path.join(DATA_DIR, 'recording.vsr')
+CSV_CHANNELS = {'ECG': 'ECG.csv', 'PPG': 'PPG.csv', 'TEMP': 'TEMP.csv'}
+CSV_NUMERICS = ('TEMP',)  # repeated at waveform rate in the CSVs, stored change-only
+
+
+def _align(offset):
+    return (offset + DATA_ALIGN - 1) // DATA_ALIGN * DATA_ALIGN
+
+
+def _compact_dtype(values):
+    """
+    Picks the smallest dtype that holds the values without loss (integer CSVs become uint16/int16
+    etc., anything with a fractional part becomes float32).
+    """
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.integer):
+        lo, hi = values.min(), values.max()
+        for dtype in (np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32):
+            info = np.iinfo(dtype)
+            if info.min <= lo and hi <= info.max:
+                return np.dtype(dtype)
+        return np.dtype(np.int64)
+    return np.dtype(np.float32)
+
+
+def write_recording(path, channels, sampling_rate, numerics=None):
+    """
+    Writes a multi-channel recording.
+
+    :param path: Output file
+    :param channels: Dict of channel name -> 1-D array (all the same length)
+    :param sampling_rate: Sampling rate in Hz, stored in the header
+    :param numerics: Dict of channel name -> (times in s, values) of a change-only numeric channel
+    """
+    arrays = {name: np.ascontiguousarray(values) for name, values in channels.items()}
+    lengths = {len(values) for values in arrays.values()}
+    if len(lengths) != 1:
+        raise ValueError(f'All channels must have the same length, got {sorted(lengths)}')
+    n_samples = lengths.pop()
+    numerics = {name: (np.ascontiguousarray(times, dtype='<f8'), np.ascontiguousarray(values))
+                for name, (times, values) in (numerics or {}).items()}
+
+    # The header size depends on the offsets and vice versa, so reserve generously and pad.
+    header = {'version': FORMAT_VERSION, 'sampling_rate': float(sampling_rate), 'n_samples': n_samples,
+              'channels': []}
+    reserve = _align(len(MAGIC) + 4 + len(json.dumps(header)) + 128 * (len(arrays) + len(numerics) + 1))
+    offset = reserve
+    blocks = []
+    for name, values in arrays.items():
+        header['channels'].append({'name': name, 'dtype': values.dtype.str, 'offset': offset})
+        blocks.append((offset, values))
+        offset = _align(offset + values.nbytes)
+    for name, (times, values) in numerics.items():
+        meta = {'name': name, 'dtype': values.dtype.str, 'offset': offset, 'n': len(values)}
+        blocks.append((offset, values))
+        offset = _align(offset + values.nbytes)
+        meta['times_offset'] = offset
+        blocks.append((offset, times))
+        offset = _align(offset + times.nbytes)
+        header['channels'].append(meta)
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    if len(MAGIC) + 4 + len(header_bytes) > reserve:
+        raise ValueError('Recording header does not fit in the reserved space')
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        for offset, values in blocks:
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(values.tobytes())
+    os.replace(tmp_path, path)
+
+
+def convert_csv(path=DEFAULT_RECORDING, data_dir=DATA_DIR, sampling_rate=DEFAULT_SAMPLING_RATE,
+                csv_channels=CSV_CHANNELS, csv_numerics=CSV_NUMERICS):
+    """
+    Converts the single-column CSV files (ECG.csv, PPG.csv, TEMP.csv) into one binary recording.
+    Channels in `csv_numerics` are stored change-only.
+    """
+    import pandas as pd  # only needed for the one-off conversion
+
+    channels, numerics = {}, {}
+    for name, filename in csv_channels.items():
+        values = pd.read_csv(os.path.join(data_dir, filename), header=None).to_numpy().reshape(-1)
+        values = values.astype(_compact_dtype(values))
+        if name in csv_numerics:
+            changes = change_points(values)
+            numerics[name] = (changes / sampling_rate, values[changes])
+        else:
+            channels[name] = values
+    write_recording(path, channels, sampling_rate, numerics)
+    return path
+
+
+class Recording:
+    """
+    Read-only, memory-mapped view of a recording file. `channels` maps each waveform channel name
+    to a numpy array backed directly by the page cache, so opening is O(1) in the recording length
+    and several processes opening the same file share the same physical pages. `numerics` maps each
+    numeric channel name to a NumericChannel over its mapped changes.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a recording file')
+        header_len, = struct.unpack_from('<I', self._mmap, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(self._mmap[start:start + header_len].decode('utf-8'))
+
+        self.version = header.get('version', 1)
+        self.sampling_rate = header['sampling_rate']
+        self.n_samples = header['n_samples']
+        self.channels = {}
+        self.numerics = {}
+        for meta in header['channels']:
+            if 'times_offset' in meta:
+                times = np.frombuffer(self._mmap, dtype='<f8', count=meta['n'], offset=meta['times_offset'])
+                values = np.frombuffer(self._mmap, dtype=np.dtype(meta['dtype']), count=meta['n'],
+                                       offset=meta['offset'])
+                self.numerics[meta['name']] = NumericChannel.from_arrays(times, values)
+                continue
+            self.channels[meta['name']] = np.frombuffer(self._mmap, dtype=np.dtype(meta['dtype']),
+                                                        count=self.n_samples, offset=meta['offset'])
+
+    def __getitem__(self, name):
+        return self.channels[name]
+
+    def numeric(self, name):
+        """
+        Numeric channel `name`; a waveform channel of that name (older recordings store numerics at
+        waveform rate) is converted to its changes.
+        """
+        if name not in self.numerics and name in self.channels:
+            changes = change_points(self.channels[name])
+            self.numerics[name] = NumericChannel.from_arrays(changes / self.sampling_rate,
+                                                             np.asarray(self.channels[name])[changes])
+        return self.numerics[name]
+
+    def __len__(self):
+        return self.n_samples
+
+    @property
+    def duration(self):
+        return self.n_samples / self.sampling_rate
+
+    def close(self):
+        # Views handed out keep the mapping alive, so only drop our own references here.
+        self.channels = {}
+        self.numerics = {}
+        self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_recording(path=DEFAULT_RECORDING, data_dir=DATA_DIR):
+    """
+    Opens the binary recording, converting the bundled CSVs on first use (or when they are newer
+    than the binary file, or it was written in an older format).
+    """
+    if path == DEFAULT_RECORDING:
+        csv_paths = [os.path.join(data_dir, f) for f in CSV_CHANNELS.values()]
+        csv_mtime = max((os.path.getmtime(p) for p in csv_paths if os.path.exists(p)), default=0)
+        if not os.path.exists(path) or os.path.getmtime(path) < csv_mtime:
+            convert_csv(path, data_dir)
+        else:
+            with Recording(path) as recording:
+                stale = recording.version < FORMAT_VERSION
+            if stale:
+                convert_csv(path, data_dir)
+    return Recording(path)
+
+
+if __name__ == '__main__':
+    # python recording.py [output.vsr] [sampling_rate]
+    out = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_RECORDING
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_SAMPLING_RATE
+    convert_csv(out, sampling_rate=rate)
+    with Recording(out) as rec:
+        print(f'{out}: {rec.n_samples} samples @ {rec.sampling_rate:g} Hz, '
+              + ', '.join(f'{name} ({values.dtype})' for name, values in rec.channels.items())
+              + ''.join(f', {name} ({len(numeric)} changes)' for name, numeric in rec.numerics.items()))
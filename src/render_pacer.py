@@ -0,0 +1,54 @@
+# render_pacer.py
+"""
+Adaptive refresh for the polling transport. A dcc.Interval fires at a fixed rate whether or not
+the previous update_graphs round trip finished, so on a loaded server or a slow browser requests
+queue up and every frame shows older data than the one before. With the pacer
+(assets/render_pacer.js) between the timer and the graph callback:
+
+- a tick only becomes a graph request while no request is in flight (Dash's `running` flag);
+  ticks arriving meanwhile are dropped, and the next request still brings everything since the
+  last one (extend_data skips to the newest window when a client fell further behind)
+- the time from a request to the updated graphs is averaged, and the timer interval follows it
+  (interval = cost / duty, between the configured interval and `max_interval`), so it slows down
+  under load and speeds up again when frames get cheaper
+
+    children=[*pacer_components('interval-component-graphs', interval=40), ...]
+
+    @app.callback(..., [Input(REQUEST, 'data')], running=RUNNING)   # instead of the n_intervals input
+    def update_graphs(n, ...)                                       # n counts the requests sent
+    pace(app, 'interval-component-graphs')
+"""
+import dash
+from dash import dcc
+
+REQUEST = 'graph-request'  # Store the pacer writes the request number to; the graph callback's input
+BUSY = 'graph-busy'  # True while the graph callback is running
+CONFIG = 'graph-pacer'
+RUNNING = [(dash.Output(BUSY, 'data'), True, False)]
+
+
+def pacer_components(interval_id, interval, max_interval=1000, duty=0.8, disabled=False):
+    """
+    The graph timer and the stores the pacer uses, for the layout.
+
+    :param interval_id: Id of the graph dcc.Interval
+    :param interval: Fastest (and initial) refresh interval in ms
+    :param max_interval: Slowest refresh interval in ms under load
+    :param duty: Fraction of the time a client may spend waiting for and drawing frames
+    :param disabled: Disables the timer (e.g. with the push transport)
+    """
+    config = {'interval_id': interval_id, 'busy_id': BUSY, 'min': interval, 'max': max_interval, 'duty': duty}
+    return [dcc.Interval(id=interval_id, interval=interval, n_intervals=0, disabled=disabled),
+            dcc.Store(id=REQUEST), dcc.Store(id=BUSY, data=False), dcc.Store(id=CONFIG, data=config)]
+
+
+def pace(app, interval_id='interval-component-graphs'):
+    """
+    Registers the clientside callback turning the timer's ticks into graph requests.
+    """
+    app.clientside_callback(
+        dash.ClientsideFunction(namespace='pacer', function_name='request'),
+        dash.Output(REQUEST, 'data'),
+        [dash.Input(interval_id, 'n_intervals'), dash.Input(BUSY, 'data')],
+        [dash.State(CONFIG, 'data')]
+    )
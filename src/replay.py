@@ -0,0 +1,123 @@
+# replay.py
+import threading
+import time
+
+import numpy as np
+
+SPEED_RANGE = (0.5, 50.0)  # supported replay speeds (besides None, unthrottled)
+
+
+def check_speed(speed):
+    if speed is not None and not SPEED_RANGE[0] <= speed <= SPEED_RANGE[1]:
+        raise ValueError(f'Replay speed must be within {SPEED_RANGE[0]:g}-{SPEED_RANGE[1]:g} '
+                         f'(or None for unthrottled), got {speed}')
+
+
+class ReplaySource:
+    """
+    Plays a recording back at its true sampling rate (times `speed`), paced by a monotonic clock:
+    the number of samples handed out always follows the elapsed time, so there is no drift however
+    long the replay runs or however irregularly it is read. Loops at the end of the recording.
+
+    speed=None replays as fast as possible (blocks of `block_size` samples), for load tests and
+    benchmarks. Otherwise the speed is 0.5x-50x (SPEED_RANGE), for demos and soak tests.
+    """
+    def __init__(self, recording, channels=('ECG', 'PPG'), speed=1.0, offset=0, preroll=0,
+                 block_time=0.02, clock=time.monotonic):
+        """
+        :param recording: recording.Recording (or anything with sampling_rate, len() and [name])
+        :param offset: First sample to play
+        :param preroll: Samples that are due immediately at start (e.g. to fill a plot window)
+        :param block_time: Pacing granularity of next_block() in seconds
+        """
+        check_speed(speed)
+        self.sampling_rate = recording.sampling_rate
+        self.channels = [recording[name] for name in channels]
+        self.speed = speed
+        self.preroll = preroll
+        self.block_time = block_time
+        self.block_size = max(1, int(round(block_time * self.sampling_rate)))
+        self.clock = clock
+        self.seq = 0  # samples handed out so far (the next sample's sequence number)
+        self.skipped = 0  # due samples read(skip=True) dropped because the reader fell behind
+        self._length = len(recording)
+        self._offset = offset % self._length
+        self._start = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._start = self.clock()
+        return self
+
+    def set_speed(self, speed):
+        """
+        Changes the speed from now on without a jump in the sample position.
+        """
+        check_speed(speed)
+        with self._lock:
+            self.preroll = self.seq
+            self._start = self.clock()
+            self.speed = speed
+
+    def due(self):
+        """
+        Number of samples the clock says should have been handed out but weren't yet.
+        """
+        if self._start is None:
+            self.start()
+        if self.speed is None:
+            return self.block_size
+        elapsed = self.clock() - self._start
+        return self.preroll + int(elapsed * self.sampling_rate * self.speed) - self.seq
+
+    def _take(self, n):
+        idx = (self._offset + self.seq + np.arange(n)) % self._length
+        block = np.vstack([np.asarray(channel[idx], dtype=float) for channel in self.channels])
+        seq = self.seq
+        self.seq += n
+        return seq, block
+
+    def read(self, max_n=None, skip=False):
+        """
+        Non-blocking: all samples that are due now.
+
+        :param max_n: Return at most this many samples
+        :param skip: When more than max_n are due, drop the oldest and return the newest max_n (a
+                     reader that fell behind jumps to the present, like ring buffer readers);
+                     otherwise the rest stays due for the next read
+        :return: (sequence number of the first sample, block of shape (n_channels, k)); k may be 0
+        """
+        with self._lock:
+            n = max(self.due(), 0)
+            if max_n is not None and n > max_n:
+                if skip:
+                    self.seq += n - max_n
+                    self.skipped += n - max_n
+                n = max_n
+            return self._take(n)
+
+    def next_block(self):
+        """
+        Blocking: waits until at least `block_size` samples are due (like a device sending blocks)
+        and returns everything that is due by then.
+        """
+        while True:
+            with self._lock:
+                n = self.due()
+                if n >= self.block_size:
+                    return self._take(n)
+                wait = (self.block_size - n) / (self.sampling_rate * self.speed)
+            time.sleep(wait)
+
+    def timestamps(self, seq, k):
+        """
+        Recording time (s) of k samples starting at sequence number seq.
+        """
+        return (seq + np.arange(k)) / self.sampling_rate
+
+    def position(self, seq):
+        """
+        Time (s) within the recording of sequence number seq (wraps with the loop), for looking up
+        its numeric channels (Recording.numerics) at the replayed samples.
+        """
+        return (self._offset + seq) % self._length / self.sampling_rate
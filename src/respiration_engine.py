@@ -0,0 +1,197 @@
+# respiration_engine.py
+import collections
+
+import numpy as np
+
+from heart_rate_engine import BeatDetector
+from metrics import timed
+from streaming_filter import StreamingFilter
+
+
+class BreathCounter:
+    """
+    Counts breaths in one respiratory surrogate that is only known at beat times (e.g. R-peak
+    amplitude). New (time, value) points are linearly interpolated onto a uniform `rate` Hz grid,
+    band-passed to the breathing band and every upward zero crossing (with hysteresis against the
+    running RMS) is a breath. The cost per call is O(new beats).
+    """
+    def __init__(self, rate=4.0, band=(0.1, 0.7), breath_history=8, hysteresis=0.3):
+        """
+        :param rate: Rate of the uniform grid in Hz
+        :param band: Breathing band in Hz ((0.1, 0.7) is 6-42 breaths/min)
+        :param breath_history: Number of breath intervals the rate is the median of
+        :param hysteresis: Fraction of the running RMS the signal has to cross on both sides
+        """
+        self.rate = rate
+        self.band = band
+        self.hysteresis = hysteresis
+        self._filter = StreamingFilter(band, rate, order=2, btype='band', stage='respiration')
+        self.breaths = collections.deque(maxlen=breath_history + 1)  # times of the recent breaths
+        self.intervals = collections.deque(maxlen=breath_history)  # seconds
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets the points and breaths seen so far (e.g. after a gap in the stream).
+        """
+        self._filter.reset()
+        self._last = None  # (time, value) of the previous point
+        self._next_t = None  # next grid time
+        self._power = None  # running mean square of the band-passed signal
+        self._armed = False  # signal has been below -hysteresis since the last breath
+        self.breaths.clear()
+        self.intervals.clear()
+        self.time = 0.0  # time of the newest point
+
+    def add(self, times, values):
+        """
+        :param times: Times in seconds of the new points (increasing)
+        :param values: Surrogate value at each of these times
+        """
+        times, values = np.asarray(times, dtype=float), np.asarray(values, dtype=float)
+        keep = ~np.isnan(values)
+        times, values = times[keep], values[keep]
+        if len(times) == 0:
+            return
+        if self._last is None:
+            self._last, self._next_t = (times[0], values[0]), times[0]
+        t0, v0 = self._last
+        self._last = (times[-1], values[-1])
+        self.time = times[-1]
+        grid = np.arange(self._next_t, times[-1], 1 / self.rate)
+        if len(grid) == 0:
+            return
+        self._next_t = grid[-1] + 1 / self.rate
+        x = self._filter.process(np.interp(grid, np.concatenate([[t0], times]), np.concatenate([[v0], values])))
+
+        # Running RMS with a time constant of a few breaths, updated per grid sample
+        if self._power is None:
+            self._power = float(np.mean(x ** 2)) or 1e-12
+        alpha = 1 / (8 * self.rate)
+        for t, value in zip(grid, x):
+            self._power += alpha * (value * value - self._power)
+            level = self.hysteresis * np.sqrt(self._power)
+            if value < -level:
+                self._armed = True
+            elif value > level and self._armed:
+                self._armed = False
+                if self.breaths:
+                    interval = t - self.breaths[-1]
+                    if interval < 1.5 / self.band[0]:  # longer gaps are signal loss, not a breath
+                        self.intervals.append(interval)
+                self.breaths.append(t)
+
+    @property
+    def respiratory_rate(self):
+        """
+        Breaths per minute from the median of the recent breath intervals; NaN until three breaths
+        were seen or when the last breath is too long ago.
+        """
+        if len(self.intervals) < 2 or self.time - self.breaths[-1] > 1.5 / self.band[0]:
+            return np.nan
+        return 60 / np.median(self.intervals)
+
+
+class RespirationEstimator:
+    """
+    Streaming respiratory rate from the signals that are already acquired, without a respiration
+    sensor. Breathing modulates
+      - the R-peak amplitude of the ECG (ECG-derived respiration),
+      - the PPG pulse amplitude and
+      - the PPG baseline (mean of each pulse),
+    so each of these per-beat series gets its own BreathCounter. The reported rate is the median of
+    the available estimates, and NaN while they disagree by more than `agreement` breaths/min
+    (motion, arrhythmia), which keeps the alarm in its current state.
+
+    ECG beats come from the caller's BeatDetector (the one that also gives HR); PPG pulses are
+    found by an internal BeatDetector. Feed it the new samples of every block: process() costs
+    O(new samples) plus O(new beats).
+    """
+    def __init__(self, sampling_rate, ecg_detector=None, agreement=4.0, **counter_kwargs):
+        """
+        :param sampling_rate: Sampling rate of the ECG/PPG stream in Hz
+        :param ecg_detector: BeatDetector fed with the same ECG stream, or None without ECG
+        :param agreement: Largest spread (breaths/min) between the estimates that still gives a rate
+        :param counter_kwargs: Passed on to each BreathCounter
+        """
+        self.sampling_rate = sampling_rate
+        self.ecg_detector = ecg_detector
+        self.ppg_detector = BeatDetector(sampling_rate, band=(0.5, 8), refractory=0.3)
+        self.agreement = agreement
+        self.counters = {name: BreathCounter(**counter_kwargs) for name in ('ecg_amplitude', 'ppg_amplitude',
+                                                                             'ppg_baseline')}
+        self.reset()
+
+    def reset(self):
+        """
+        Starts over as on a new signal, e.g. after a gap in the stream. The ECG detector is the
+        caller's and has to be reset along with this.
+        """
+        self.ppg_detector.reset()
+        for counter in self.counters.values():
+            counter.reset()
+        self._ppg_tail = np.empty(0)  # raw PPG since the last pulse
+        self._tail_start = 0  # absolute index of _ppg_tail[0]
+        self._gap = True  # the next baseline would span a signal loss
+
+    @timed('respiration_seconds', 'RespirationEstimator time per block')
+    def process(self, ppg=None, ecg_beats=()):
+        """
+        :param ppg: New raw PPG samples (1-D), or None without PPG
+        :param ecg_beats: (index, amplitude) of the beats the ECG detector returned for the matching ECG
+                          samples
+        """
+        if len(ecg_beats) and self.ecg_detector is not None:
+            beats, amplitudes = np.asarray(ecg_beats, dtype=float).T
+            self.counters['ecg_amplitude'].add(beats / self.sampling_rate, np.sqrt(amplitudes))
+        if ppg is None or len(ppg) == 0:
+            return
+        ppg = np.asarray(ppg, dtype=float)
+        if np.isnan(ppg).all():  # a device without PPG
+            return
+        pulses = self.ppg_detector.process(ppg)
+
+        # Baseline of a pulse = mean of the raw PPG since the previous pulse
+        data = np.concatenate([self._ppg_tail, ppg])
+        baselines = []
+        for pulse, _ in pulses:
+            end = max(pulse - self._tail_start, 0)
+            baselines.append(np.nan if self._gap or end == 0 else np.mean(data[:end]))
+            data, self._tail_start, self._gap = data[end:], self._tail_start + end, False
+        limit = int(3 * self.sampling_rate)  # longer without a pulse is signal loss
+        if len(data) > limit:
+            data, self._tail_start, self._gap = data[-limit:], self.ppg_detector.n_samples - limit, True
+        self._ppg_tail = data
+
+        if pulses:
+            indices, amplitudes = np.asarray(pulses, dtype=float).T
+            times = indices / self.sampling_rate
+            self.counters['ppg_amplitude'].add(times, np.sqrt(amplitudes))
+            self.counters['ppg_baseline'].add(times, baselines)
+
+    def estimates(self):
+        """
+        Respiratory rate per surrogate in breaths/min (NaN where it has none).
+        """
+        return {name: counter.respiratory_rate for name, counter in self.counters.items()}
+
+    @property
+    def respiratory_rate(self):
+        """
+        Breaths per minute, the median of the available estimates (NaN without a consistent one).
+        """
+        rates = np.array([rate for rate in self.estimates().values() if not np.isnan(rate)])
+        if len(rates) == 0:
+            return np.nan
+        median = float(np.median(rates))
+        # With several estimates, at least two have to agree around the median
+        if len(rates) > 1 and np.count_nonzero(np.abs(rates - median) <= self.agreement / 2) < 2:
+            return np.nan
+        return median
+
+
+def format_respiratory_rate(rate):
+    """
+    Display text of a respiratory rate ('--' while there is no estimate).
+    """
+    return '--' if np.isnan(rate) else f"{rate:.0f} /min"
@@ -0,0 +1,118 @@
+# ring_buffer.py
+import time
+
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Preallocated multi-channel ring buffer for one writer (the acquisition thread) and any number
+    of readers (the Dash callbacks).
+
+    Every sample is written twice, at `i` and `i + capacity`, so the most recent `n <= capacity`
+    samples are always one contiguous slice and readers get a numpy view without copying. The
+    writer claims the samples it is about to write (`claim_seq`) before touching the storage and
+    publishes them by bumping `write_seq` afterwards, seqlock style, so readers never hand out
+    half-written samples. A view of `n` samples stays valid until the writer has added
+    another `capacity - n` samples; `is_valid` / `snapshot` check that with the sequence numbers.
+    """
+    def __init__(self, channels, capacity, dtype=np.float64):
+        """
+        :param channels: Channel names, e.g. ('t', 'ecg', 'ppg')
+        :param capacity: Number of samples kept per channel
+        :param dtype: Storage dtype shared by all channels
+        """
+        self.channels = tuple(channels)
+        self.index = {name: i for i, name in enumerate(self.channels)}
+        self.capacity = int(capacity)
+        self._data = np.zeros((len(self.channels), 2 * self.capacity), dtype=dtype)
+        # Total number of samples ever written (sequence number of the next sample)
+        self.write_seq = 0
+        # Sequence number up to which the writer may currently be modifying the storage
+        self.claim_seq = 0
+
+    def __len__(self):
+        return min(self.write_seq, self.capacity)
+
+    def append(self, *values):
+        """
+        Writes a single sample (one value per channel). O(1).
+        """
+        pos = self.write_seq % self.capacity
+        self.claim_seq = self.write_seq + 1
+        self._data[:, pos] = values
+        self._data[:, pos + self.capacity] = values
+        self.write_seq += 1
+
+    def extend(self, block):
+        """
+        Writes a block of samples, shape (n_channels, k). Only the last `capacity` samples are kept
+        if the block is larger than the buffer.
+        """
+        block = np.asarray(block)
+        k = block.shape[1]
+        if k == 0:
+            return
+        seq = self.write_seq
+        if k > self.capacity:
+            seq += k - self.capacity
+            block = block[:, -self.capacity:]
+            k = self.capacity
+
+        pos = seq % self.capacity
+        first = min(k, self.capacity - pos)
+        self.claim_seq = seq + k
+        for offset in (0, self.capacity):
+            self._data[:, offset + pos:offset + pos + first] = block[:, :first]
+            if first < k:
+                self._data[:, offset:offset + k - first] = block[:, first:]
+        self.write_seq = seq + k
+
+    def window(self, n=None):
+        """
+        Zero-copy view of the latest `n` samples (all available samples if `n` is None).
+
+        :return: (seq, view) where seq is the sequence number of the first sample and view has
+                 shape (n_channels, n)
+        """
+        end = self.write_seq
+        n = min(len(self), self.capacity if n is None else n)
+        start = (end - n) % self.capacity
+        return end - n, self._data[:, start:start + n]
+
+    def read(self, since, max_n=None):
+        """
+        Zero-copy view of the samples written since sequence number `since` (e.g. the `write_seq`
+        a reader saw last time), capped to the newest `max_n`. Samples that have already been
+        overwritten are skipped.
+
+        :return: (seq, view) like `window`
+        """
+        n = self.write_seq - since
+        if max_n is not None:
+            n = min(n, max_n)
+        return self.window(max(n, 0))
+
+    def is_valid(self, seq):
+        """
+        Whether samples from `seq` onwards (a view returned earlier) have not been overwritten yet.
+        """
+        return max(self.write_seq, self.claim_seq) - seq <= self.capacity
+
+    def snapshot(self, n=None, retries=3):
+        """
+        Consistent copy of the latest `n` samples, retrying if the writer overran the copy.
+        """
+        for _ in range(retries):
+            seq, view = self.window(n)
+            data = view.copy()
+            if self.is_valid(seq):
+                return seq, data
+            time.sleep(0)
+        raise RuntimeError('Ring buffer writer overran the reader; use a larger capacity')
+
+    def channel(self, view, name):
+        """
+        Row of a window/read view for the given channel name.
+        """
+        return view[self.index[name]]
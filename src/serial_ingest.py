@@ -0,0 +1,261 @@
+# serial_ingest.py
+import os
+import threading
+import time
+
+import numpy as np
+
+# Binary frame layout (little endian):
+#   SYNC (2 bytes) | sequence number (uint16) | n_channels samples (SAMPLE_DTYPE) | checksum (uint8)
+# The checksum is the sum of the sequence and sample bytes modulo 256.
+SYNC = b'\xa5\x5a'
+SAMPLE_DTYPE = np.dtype('<i4')
+
+
+def encode_frames(samples, first_seq=0, dtype=SAMPLE_DTYPE):
+    """
+    Encodes samples of shape (n_channels, k) into k binary frames (used by the fake device and
+    by firmware test tools).
+    """
+    samples = np.atleast_2d(np.asarray(samples))
+    n_channels, k = samples.shape
+    seq = ((first_seq + np.arange(k)) & 0xFFFF).astype('<u2')
+    body = np.concatenate([seq.view(np.uint8).reshape(k, 2),
+                           np.ascontiguousarray(samples.T.astype(dtype)).view(np.uint8).reshape(k, -1)], axis=1)
+    checksum = (body.sum(axis=1, dtype=np.uint32) & 0xFF).astype(np.uint8)
+    sync = np.tile(np.frombuffer(SYNC, np.uint8), (k, 1))
+    return np.concatenate([sync, body, checksum[:, None]], axis=1).tobytes()
+
+
+class BinaryFrameParser:
+    """
+    Parses a byte stream of fixed-size binary frames in bulk. Bytes are accumulated across calls,
+    so frames split over several reads are handled; corrupt frames are skipped by searching for
+    the next sync word, and gaps in the sequence numbers are counted as dropped frames.
+    """
+    def __init__(self, n_channels, dtype=SAMPLE_DTYPE):
+        self.n_channels = n_channels
+        self.dtype = np.dtype(dtype)
+        self.frame_size = len(SYNC) + 2 + n_channels * self.dtype.itemsize + 1
+        self._pending = b''
+        self._last_seq = None
+        self.frames = 0
+        self.dropped = 0
+        self.resyncs = 0
+        self.bad_bytes = 0
+
+    def _valid_rows(self, rows):
+        sync_ok = (rows[:, 0] == SYNC[0]) & (rows[:, 1] == SYNC[1])
+        checksum = rows[:, 2:-1].sum(axis=1, dtype=np.uint32) & 0xFF
+        return sync_ok & (checksum == rows[:, -1])
+
+    def feed(self, data):
+        """
+        :param data: Newly received bytes
+        :return: (seq, samples) with seq of shape (k,) and samples of shape (n_channels, k)
+        """
+        buf = np.frombuffer(self._pending + bytes(data), dtype=np.uint8)
+        size = self.frame_size
+        chunks = []
+        pos = 0
+        while len(buf) - pos >= size:
+            k = (len(buf) - pos) // size
+            rows = buf[pos:pos + k * size].reshape(k, size)
+            valid = self._valid_rows(rows)
+            n_ok = k if valid.all() else int(np.argmin(valid))
+            if n_ok:
+                chunks.append(rows[:n_ok])
+                pos += n_ok * size
+                continue
+
+            # Out of sync: jump to the next sync word after the bad frame start
+            nxt = bytes(buf[pos + 1:]).find(SYNC)
+            skip = len(buf) - pos - 1 if nxt < 0 else nxt + 1
+            self.bad_bytes += skip
+            self.resyncs += 1
+            pos += skip
+        self._pending = bytes(buf[pos:])
+
+        if not chunks:
+            return np.empty(0, dtype=np.uint16), np.empty((self.n_channels, 0), dtype=self.dtype)
+        rows = np.concatenate(chunks)
+        seq = np.ascontiguousarray(rows[:, 2:4]).view('<u2').reshape(-1)
+        samples = np.ascontiguousarray(rows[:, 4:-1]).view(self.dtype).reshape(-1, self.n_channels).T
+
+        prev = np.concatenate([[int(seq[0]) - 1 if self._last_seq is None else self._last_seq], seq[:-1]])
+        gaps = (seq.astype(np.int64) - prev.astype(np.int64) - 1) & 0xFFFF
+        self.dropped += int(gaps.sum())
+        self._last_seq = int(seq[-1])
+        self.frames += len(seq)
+        return seq, samples
+
+
+class TextFrameParser:
+    """
+    Tolerant parser for newline-terminated text samples, one line per sample with the channel
+    values separated by commas or whitespace. Partial lines are kept for the next read and
+    malformed lines are counted and skipped.
+    """
+    def __init__(self, n_channels=1):
+        self.n_channels = n_channels
+        self._pending = b''
+        self._seq = 0
+        self.frames = 0
+        self.dropped = 0
+        self.resyncs = 0
+        self.bad_bytes = 0
+
+    def _parse_line(self, line):
+        try:
+            values = [float(v) for v in line.replace(',', ' ').split()]
+        except ValueError:
+            return None
+        return values if len(values) == self.n_channels else None
+
+    def feed(self, data):
+        lines = (self._pending + bytes(data)).split(b'\n')
+        self._pending = lines.pop()
+        lines = [line.decode('ascii', 'replace').strip() for line in lines]
+        lines = [line for line in lines if line]
+
+        # Fast path: every line has n_channels fields, convert the whole block in one go (a short
+        # line next to a long one would otherwise shift all following samples across channels)
+        fields = [line.replace(',', ' ').split() for line in lines]
+        ok = all(len(f) == self.n_channels for f in fields)
+        if ok:
+            try:
+                values = np.array([v for f in fields for v in f], dtype=float)
+            except ValueError:
+                ok = False
+        if ok:
+            samples = values.reshape(-1, self.n_channels).T
+        else:
+            parsed = [self._parse_line(line) for line in lines]
+            bad = [line for line, v in zip(lines, parsed) if v is None]
+            self.bad_bytes += sum(len(line) + 1 for line in bad)
+            self.dropped += len(bad)
+            samples = np.array([v for v in parsed if v is not None], dtype=float).reshape(-1, self.n_channels).T
+
+        k = samples.shape[1]
+        seq = (self._seq + np.arange(k)) & 0xFFFF
+        self._seq += k
+        self.frames += k
+        return seq.astype(np.uint16), samples
+
+
+class SerialIngest:
+    """
+    Reads large blocks from a serial port (or anything with read()/in_waiting) and turns them into
+    numpy sample blocks. The port should have a read timeout; read_block() waits for at least one
+    byte up to that timeout instead of busy-polling in_waiting.
+    """
+    def __init__(self, ser, parser, block_size=4096):
+        self.ser = ser
+        self.parser = parser
+        self.block_size = block_size
+
+    def read_block(self):
+        """
+        :return: (seq, samples) as returned by the parser; empty arrays on timeout
+        """
+        data = self.ser.read(max(self.ser.in_waiting, 1))
+        waiting = self.ser.in_waiting
+        if data and waiting:
+            data += self.ser.read(min(waiting, self.block_size))
+        return self.parser.feed(data)
+
+    @property
+    def stats(self):
+        p = self.parser
+        return {'frames': p.frames, 'dropped': p.dropped, 'resyncs': p.resyncs, 'bad_bytes': p.bad_bytes}
+
+
+def make_parser(mode, n_channels):
+    if mode == 'binary':
+        return BinaryFrameParser(n_channels)
+    if mode == 'text':
+        return TextFrameParser(n_channels)
+    raise ValueError(f'Unknown serial format {mode!r}')
+
+
+class FakeDevice:
+    """
+    Pseudo-terminal that behaves like the acquisition board: a background thread writes the given
+    channels at `sampling_rate` in `mode` ('binary' or 'text'), looping over the data. Open `port`
+    with pyserial like a real device. `drop_every` skips every n-th frame to exercise gap detection.
+    POSIX only.
+    """
+    def __init__(self, channels, sampling_rate, mode='binary', block=10, drop_every=0):
+        import pty  # POSIX only
+
+        self.channels = np.atleast_2d(np.asarray(channels))
+        self.sampling_rate = sampling_rate
+        self.mode = mode
+        self.block = block
+        self.drop_every = drop_every
+        self._master, self._slave = pty.openpty()
+        try:
+            import tty
+            tty.setraw(self._slave)
+        except Exception:
+            pass
+        self.port = os.ttyname(self._slave)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _encode(self, block, seq):
+        if self.mode == 'binary':
+            if self.drop_every:
+                keep = (seq + np.arange(block.shape[1])) % self.drop_every != 0
+                return b''.join(encode_frames(block[:, i:i + 1], seq + i) for i in np.flatnonzero(keep))
+            return encode_frames(block, seq)
+        lines = '\n'.join(','.join(f'{v:g}' for v in sample) for sample in block.T)
+        return (lines + '\n').encode('ascii')
+
+    def _run(self):
+        n = self.channels.shape[1]
+        seq = 0
+        start = time.monotonic()
+        while not self._stop.is_set():
+            idx = np.arange(seq, seq + self.block) % n
+            os.write(self._master, self._encode(self.channels[:, idx], seq))
+            seq += self.block
+            delay = start + seq / self.sampling_rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    # Streams the bundled recording through a fake device and reads it back for a few seconds
+    import sys
+    import serial
+    from recording import load_recording
+
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'binary'
+    rec = load_recording()
+    with FakeDevice([rec['ECG'], rec['PPG']], rec.sampling_rate, mode=mode, drop_every=1000) as dev:
+        ingest = SerialIngest(serial.Serial(dev.port, timeout=0.05), make_parser(mode, 2))
+        total = 0
+        end = time.monotonic() + 3
+        while time.monotonic() < end:
+            seq, samples = ingest.read_block()
+            total += samples.shape[1]
+        print(f'{mode}: {total} samples in 3 s', ingest.stats)
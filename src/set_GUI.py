@@ -4,7 +4,7 @@ from dash import dcc
 from dash import html
 from dash.dependencies import Output, Input
 import plotly.graph_objs as go
-from alarm_engine import check_vital_signs  # For alarm checks
+from alarm_engine import AlarmEngine, check_vital_signs  # For alarm checks
 
 
 class Soheil:
@@ -12,6 +12,7 @@ class Soheil:
         self.ecg = None
         self.ppg = None
         self.xticks = None
+        self.alarms = AlarmEngine(1)  # hysteresis and debounce for the vitals' colours
         self.app = dash.Dash(__name__)
 
     def create_layout(self):
@@ -95,8 +96,9 @@ class Soheil:
             respiratory_rate = np.random.randint(12, 20)
             body_temp = np.random.randint(34, 40)
 
+            codes = self.alarms.update([[heart_rate, spo2, respiratory_rate, body_temp]])[0]
             heart_rate_color, spo2_color, respiratory_rate_color, body_temp_color = check_vital_signs(
-                heart_rate, spo2, respiratory_rate, body_temp)
+                heart_rate, spo2, respiratory_rate, body_temp, codes)
 
             return (
                 f"{heart_rate:.1f} bpm", f"{spo2} %", f"{respiratory_rate} /min", f"{body_temp:.1f} °C",
@@ -106,4 +108,4 @@ class Soheil:
                 {'backgroundColor': body_temp_color, 'color': 'white', 'fontWeight': 'bold'}
             )
     def run_soheil(self):
-        self.app.run_server(debug=True, use_reloader=False)
\ No newline at end of file
+        self.app.run(debug=True, use_reloader=False)
\ No newline at end of file
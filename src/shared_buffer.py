@@ -0,0 +1,168 @@
+# shared_buffer.py
+"""
+Ring buffers and arrays in multiprocessing.shared_memory, so one acquisition process can write
+and any number of web worker processes can read without copying or pickling. Every block starts
+with a small JSON header (channels, capacity, dtype, ...) so readers only need the name.
+"""
+import json
+import struct
+import sys
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from ring_buffer import RingBuffer
+
+MAGIC = b'VSHM'
+_PREFIX = struct.Struct('<4sI')  # magic, header length
+ALIGNMENT = 64
+
+
+def _data_offset(header):
+    return -(-(_PREFIX.size + len(header)) // ALIGNMENT) * ALIGNMENT
+
+
+def _create(name, meta, nbytes):
+    header = json.dumps(meta).encode('utf-8')
+    offset = _data_offset(header)
+    try:
+        shm = shared_memory.SharedMemory(name, create=True, size=offset + nbytes)
+    except FileExistsError:
+        # Left behind by a process that didn't shut down cleanly; the creator owns the name
+        stale = shared_memory.SharedMemory(name)
+        stale.close()
+        stale.unlink()
+        shm = shared_memory.SharedMemory(name, create=True, size=offset + nbytes)
+    shm.buf[:_PREFIX.size] = _PREFIX.pack(MAGIC, len(header))
+    shm.buf[_PREFIX.size:_PREFIX.size + len(header)] = header
+    return shm, offset
+
+
+def _attach(name):
+    """
+    :return: (shared memory, header dict, data offset)
+    """
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name, track=False)
+    else:
+        shm = shared_memory.SharedMemory(name)
+        # Before 3.13 every attaching process registers the block with its resource tracker, which
+        # would unlink it when that (reader) process exits
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    magic, length = _PREFIX.unpack(bytes(shm.buf[:_PREFIX.size]))
+    if magic != MAGIC:
+        shm.close()
+        raise ValueError(f'{name} is not a shared vitals block')
+    header = bytes(shm.buf[_PREFIX.size:_PREFIX.size + length])
+    return shm, json.loads(header), _data_offset(header)
+
+
+def _close(shm):
+    try:
+        shm.close()
+    except BufferError:
+        pass  # numpy views of the block are still alive; the mapping goes away with them
+
+
+class SharedRingBuffer(RingBuffer):
+    """
+    RingBuffer whose storage and sequence numbers live in shared memory. The creating process is
+    the single writer; attached readers get read-only views. The seqlock protocol of RingBuffer
+    (claim_seq before writing, write_seq after) works across processes because both counters are
+    aligned 64-bit words in the same block.
+    """
+    def __init__(self, shm, meta, offset, owner):
+        self._shm = shm
+        self._owner = owner
+        self.meta = meta
+        self.channels = tuple(meta['channels'])
+        self.index = {name: i for i, name in enumerate(self.channels)}
+        self.capacity = meta['capacity']
+        # write_seq, claim_seq
+        self._seqs = np.ndarray(2, dtype=np.int64, buffer=shm.buf, offset=offset)
+        self._data = np.ndarray((len(self.channels), 2 * self.capacity), dtype=meta['dtype'], buffer=shm.buf,
+                                offset=offset + ALIGNMENT)
+        if not owner:
+            self._seqs.flags.writeable = False
+            self._data.flags.writeable = False
+
+    @classmethod
+    def create(cls, name, channels, capacity, dtype=np.float64, **meta):
+        """
+        :param meta: Extra JSON-serializable fields for readers (e.g. sampling_rate)
+        """
+        meta = dict(meta, channels=list(channels), capacity=int(capacity), dtype=np.dtype(dtype).str)
+        nbytes = ALIGNMENT + len(channels) * 2 * int(capacity) * np.dtype(dtype).itemsize
+        shm, offset = _create(name, meta, nbytes)
+        buffer = cls(shm, meta, offset, owner=True)
+        buffer._seqs[:] = 0
+        return buffer
+
+    @classmethod
+    def attach(cls, name):
+        shm, meta, offset = _attach(name)
+        return cls(shm, meta, offset, owner=False)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def write_seq(self):
+        return int(self._seqs[0])
+
+    @write_seq.setter
+    def write_seq(self, value):
+        self._seqs[0] = value
+
+    @property
+    def claim_seq(self):
+        return int(self._seqs[1])
+
+    @claim_seq.setter
+    def claim_seq(self, value):
+        self._seqs[1] = value
+
+    def close(self):
+        """
+        Detaches; the owner also removes the block. Views handed out before must not be used after.
+        """
+        self._seqs = self._data = None
+        _close(self._shm)
+        if self._owner:
+            self._shm.unlink()
+
+
+class SharedArray:
+    """
+    Fixed-shape numpy array in shared memory plus a JSON header, e.g. the table of current vitals
+    and alarm states per bed. Single aligned float64 writes are atomic, so readers see each value
+    either old or new.
+    """
+    def __init__(self, shm, meta, offset, owner):
+        self._shm = shm
+        self._owner = owner
+        self.meta = meta
+        self.array = np.ndarray(tuple(meta['shape']), dtype=meta['dtype'], buffer=shm.buf, offset=offset)
+        if not owner:
+            self.array.flags.writeable = False
+
+    @classmethod
+    def create(cls, name, shape, dtype=np.float64, fill=0, **meta):
+        meta = dict(meta, shape=list(shape), dtype=np.dtype(dtype).str)
+        shm, offset = _create(name, meta, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        array = cls(shm, meta, offset, owner=True)
+        array.array[...] = fill
+        return array
+
+    @classmethod
+    def attach(cls, name):
+        shm, meta, offset = _attach(name)
+        return cls(shm, meta, offset, owner=False)
+
+    def close(self):
+        self.array = None
+        _close(self._shm)
+        if self._owner:
+            self._shm.unlink()
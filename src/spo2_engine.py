@@ -0,0 +1,189 @@
+# spo2_engine.py
+import collections
+import os
+
+import numpy as np
+
+from heart_rate_engine import BeatDetector
+from metrics import timed
+from recording import DATA_DIR, Recording, load_recording, write_recording
+from streaming_filter import low_pass_filter
+
+# Empirical linear calibration SpO2 = a - b * R of the ratio of ratios (a real probe needs its own)
+SPO2_CALIBRATION = (110.0, 25.0)
+DUAL_RECORDING = os.path.join(DATA_DIR, 'recording_dual.vsr')
+
+
+def ratio_of_ratios(red, ir, bounds):
+    """
+    Ratio of ratios of many pulses at once. Pulse i spans samples bounds[i]:bounds[i + 1]; AC is
+    its peak-to-trough amplitude and DC its mean, per wavelength.
+
+    :param red: Red PPG samples (1-D)
+    :param ir: Infrared PPG samples, same length
+    :param bounds: Increasing sample indices of the pulse boundaries (len(bounds) - 1 pulses)
+    :return: R = (AC_red / DC_red) / (AC_ir / DC_ir) per pulse (NaN for empty or flat pulses)
+    """
+    bounds = np.asarray(bounds, dtype=int)
+    lengths = np.diff(bounds)
+    if len(lengths) == 0 or bounds[-1] <= bounds[0]:
+        return np.full(len(lengths), np.nan)
+    data = np.vstack([red, ir])[:, bounds[0]:bounds[-1]]
+    starts = np.minimum(bounds[:-1] - bounds[0], data.shape[1] - 1)
+    ac = np.maximum.reduceat(data, starts, axis=1) - np.minimum.reduceat(data, starts, axis=1)
+    dc = np.add.reduceat(data, starts, axis=1) / np.maximum(lengths, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = (ac[0] / dc[0]) / (ac[1] / dc[1])
+    ratio[(lengths == 0) | ~np.isfinite(ratio) | (ac[1] <= 0) | (dc <= 0).any(axis=0)] = np.nan
+    return ratio
+
+
+class SpO2Engine:
+    """
+    Streaming SpO2 from a red/infrared PPG pair. Pulses are found on the IR channel by a
+    BeatDetector; every pulse-to-pulse interval is one cardiac cycle, so its peak-to-trough (AC)
+    and mean (DC) per wavelength give one ratio of ratios. All pulses of a block are evaluated in
+    one ratio_of_ratios() call, and the reported SpO2 is the calibrated median of the last
+    `beat_history` ratios. Feed it the new samples of every block: process() costs O(new samples).
+    """
+    def __init__(self, sampling_rate, calibration=SPO2_CALIBRATION, beat_history=8, min_beats=3, timeout=3.0):
+        """
+        :param sampling_rate: Sampling rate of the PPG stream in Hz
+        :param calibration: (a, b) of SpO2 = a - b * R
+        :param beat_history: Number of pulses SpO2 is smoothed over
+        :param min_beats: Pulses needed before SpO2 is reported
+        :param timeout: Seconds without a pulse after which SpO2 is NaN (probe off, motion)
+        """
+        self.sampling_rate = sampling_rate
+        self.calibration = calibration
+        self.min_beats = min_beats
+        self.detector = BeatDetector(sampling_rate, band=(0.5, 8), refractory=0.3)
+        self.ratios = collections.deque(maxlen=beat_history)
+        self._limit = int(timeout * sampling_rate)
+        self.reset()
+
+    def reset(self):
+        """
+        Starts over as on a new signal, e.g. after a gap in the stream.
+        """
+        self.detector.reset()
+        self.ratios.clear()
+        self._tail = np.empty((2, 0))  # raw red/IR since the last pulse
+        self._tail_start = 0  # absolute index of _tail[:, 0]
+        self._gap = True  # the next pulse interval would span a signal loss
+
+    @timed('spo2_seconds', 'SpO2Engine time per block')
+    def process(self, ir, red):
+        """
+        :param ir: New raw infrared PPG samples (1-D)
+        :param red: Matching raw red PPG samples (NaN without a red channel)
+        """
+        ir = np.asarray(ir, dtype=float)
+        red = np.asarray(red, dtype=float)
+        if len(ir) == 0 or np.isnan(ir).all():
+            return
+        pulses = self.detector.process(ir)
+        data = np.concatenate([self._tail, np.vstack([red, ir])], axis=1)
+
+        if pulses:
+            starts = np.array([pulse for pulse, _ in pulses]) - self._tail_start
+            bounds = np.concatenate([[0], np.clip(starts, 0, data.shape[1])])
+            ratios = ratio_of_ratios(data[0], data[1], bounds)
+            if self._gap:
+                ratios = ratios[1:]
+            self.ratios.extend(ratios[~np.isnan(ratios)])
+            data, self._tail_start, self._gap = data[:, bounds[-1]:], self._tail_start + bounds[-1], False
+        if data.shape[1] > self._limit:  # longer without a pulse is signal loss
+            data, self._tail_start, self._gap = data[:, -self._limit:], self.detector.n_samples - self._limit, True
+            self.ratios.clear()
+        self._tail = data
+
+    @property
+    def ratio(self):
+        """
+        Median ratio of ratios over the recent pulses (NaN with fewer than min_beats).
+        """
+        if len(self.ratios) < self.min_beats:
+            return np.nan
+        return float(np.median(self.ratios))
+
+    @property
+    def spo2(self):
+        """
+        SpO2 in % (NaN while there is no estimate).
+        """
+        a, b = self.calibration
+        return float(np.clip(a - b * self.ratio, 0, 100))
+
+
+def format_spo2(spo2):
+    """
+    Display text of an SpO2 value ('--' while there is no estimate).
+    """
+    return '--' if np.isnan(spo2) else f"{spo2:.0f} %"
+
+
+def desaturation(n_samples, sampling_rate, baseline=97.0, events=((120, 60, 86),)):
+    """
+    SpO2 profile per sample: `baseline` with raised-cosine dips.
+
+    :param events: (start s, duration s, nadir %) per dip
+    """
+    t = np.arange(n_samples) / sampling_rate
+    spo2 = np.full(n_samples, float(baseline))
+    for start, duration, nadir in events:
+        inside = (t >= start) & (t < start + duration)
+        spo2[inside] -= (baseline - nadir) * 0.5 * (1 - np.cos(2 * np.pi * (t[inside] - start) / duration))
+    return spo2
+
+
+def synthetic_red(ir, sampling_rate, spo2=97.0, calibration=SPO2_CALIBRATION, dc_ratio=0.8, noise=0.0, seed=0):
+    """
+    Red PPG channel that goes with a recorded (infrared) PPG for a given SpO2. The pulsatile part
+    of the IR signal around its baseline is scaled by the ratio of ratios the calibration gives for
+    `spo2`, so the pair reads back as that SpO2.
+
+    :param ir: Infrared PPG (e.g. data/PPG.csv)
+    :param spo2: SpO2 in %, a scalar or one value per sample (see desaturation())
+    :param dc_ratio: DC of red relative to IR
+    :param noise: Standard deviation of added white noise, relative to the IR pulse amplitude
+    """
+    ir = np.asarray(ir, dtype=float)
+    a, b = calibration
+    baseline = low_pass_filter(ir, 0.5, sampling_rate, order=2)
+    ratio = (a - np.broadcast_to(np.asarray(spo2, dtype=float), ir.shape)) / b
+    red = dc_ratio * (baseline + ratio * (ir - baseline))
+    if noise:
+        red += np.random.default_rng(seed).normal(0, noise * dc_ratio * np.std(ir - baseline), len(red))
+    return red
+
+
+def load_dual_recording(path=DUAL_RECORDING, spo2=None):
+    """
+    The bundled recording with a synthetic red channel (PPG_RED) next to PPG, which is used as the
+    infrared channel. Generated on first use (or when the bundled recording is newer).
+
+    :param spo2: SpO2 profile for the red channel; a desaturation episode at 2 min by default
+    """
+    with load_recording() as base:
+        if spo2 is not None or not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(base.path):
+            if spo2 is None:
+                spo2 = desaturation(len(base), base.sampling_rate)
+            red = synthetic_red(base['PPG'], base.sampling_rate, spo2)
+            temp = base.numeric('TEMP')
+            write_recording(path, {'ECG': base['ECG'], 'PPG': base['PPG'], 'PPG_RED': red.astype(np.float32)},
+                            base.sampling_rate, numerics={'TEMP': (temp.times, temp.values)})
+    return Recording(path)
+
+
+if __name__ == '__main__':
+    # python spo2_engine.py: replays the synthetic dual-wavelength recording through the engine
+    with load_dual_recording() as rec:
+        truth = desaturation(len(rec), rec.sampling_rate)
+        engine = SpO2Engine(rec.sampling_rate)
+        block = int(rec.sampling_rate)
+        for start in range(0, len(rec), block):
+            engine.process(rec['PPG'][start:start + block], rec['PPG_RED'][start:start + block])
+            if start // block % 10 == 0:
+                print(f'{start / rec.sampling_rate:6.0f} s  SpO2 {format_spo2(engine.spo2):>5}  '
+                      f'(generated {truth[min(start + block, len(rec)) - 1]:.0f} %)')
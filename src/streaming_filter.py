@@ -0,0 +1,112 @@
+# streaming_filter.py
+import numpy as np
+
+from metrics import histogram, timed
+
+# scipy.signal is imported where a filter is designed: it takes longer to import than the rest of
+# the monitor together, and the GUI starts serving before the first filter is built
+
+
+@timed('low_pass_filter_seconds', 'low_pass_filter time per window')
+def low_pass_filter(signal, cutoff_freq, sampling_rate, order=4, padding=True):
+    """
+    Zero-phase low-pass filter over a whole window (redesigns the filter on every call).
+    Kept for offline/batch use; live plots should use StreamingFilter.
+    """
+    from scipy.signal import butter, filtfilt
+
+    nyquist = 0.5 * sampling_rate
+    normal_cutoff = cutoff_freq / nyquist
+    b, a = butter(order, normal_cutoff, btype='low', analog=False)
+
+    if padding:
+        pad_len = 3 * max(len(b), len(a))
+        padded_signal = np.concatenate([signal[pad_len - 1::-1], signal, signal[:-pad_len - 1:-1]])
+        filtered_signal = filtfilt(b, a, padded_signal)
+        return filtered_signal[pad_len:-pad_len]
+    else:
+        return filtfilt(b, a, signal)
+
+
+class StreamingFilter:
+    """
+    Butterworth filter applied to a sample stream chunk by chunk. The coefficients are designed
+    once (second-order sections) and the filter state is kept per channel, so each call only costs
+    O(new samples).
+
+    With `smoothing_lag` > 0 the causal output is additionally run backwards over the last
+    `smoothing_lag` samples (a fixed-lag approximation of filtfilt). That removes most of the phase
+    delay for display at the price of emitting samples `smoothing_lag` samples late.
+    """
+    def __init__(self, cutoff_freq, sampling_rate, order=4, btype='low', n_channels=1, smoothing_lag=0,
+                 stage='other'):
+        """
+        :param cutoff_freq: Cutoff frequency in Hz (a (low, high) pair for btype='band')
+        :param sampling_rate: Sampling rate of the stream in Hz
+        :param order: Butterworth order
+        :param btype: 'low', 'high' or 'band'
+        :param n_channels: Number of channels filtered together (rows of the input block)
+        :param smoothing_lag: Length of the backward smoothing pass in samples (0 = causal only)
+        :param stage: `stage` label of this filter's filter_seconds histogram (e.g. 'ecg', 'ppg')
+        """
+        from scipy.signal import butter, sosfilt, sosfilt_zi
+
+        nyquist = 0.5 * sampling_rate
+        self.sos = butter(order, np.asarray(cutoff_freq) / nyquist, btype=btype, output='sos')
+        self.n_channels = n_channels
+        self.smoothing_lag = int(smoothing_lag)
+        self._zi_unit = sosfilt_zi(self.sos)[:, None, :]  # steady-state response to a unit step
+        self._sosfilt = sosfilt
+        self._zi = None
+        self._tail = np.empty((n_channels, 0))
+        self._seconds = histogram('filter_seconds', 'StreamingFilter time per block', stage=stage)
+
+    @property
+    def delay(self):
+        """
+        Number of samples the output lags behind the input.
+        """
+        return self.smoothing_lag
+
+    def reset(self):
+        self._zi = None
+        self._tail = np.empty((self.n_channels, 0))
+
+    def process(self, block):
+        """
+        Filters the newly arrived samples.
+
+        :param block: Shape (n_channels, k), or (k,) for a single channel
+        :return: Filtered samples in the same layout. With smoothing the output holds the samples
+                 that now have `smoothing_lag` samples of look-ahead, so its length can differ
+                 from k while the smoother fills up.
+        """
+        with self._seconds.time():
+            return self._process(block)
+
+    def _process(self, block):
+        block = np.asarray(block, dtype=float)
+        single = block.ndim == 1
+        x = block[None, :] if single else block
+        if x.shape[1] == 0:
+            return block
+
+        if self._zi is None:
+            # Start in steady state at the first sample to avoid the step transient
+            self._zi = self._zi_unit * x[:, 0][None, :, None]
+        y, self._zi = self._sosfilt(self.sos, x, axis=-1, zi=self._zi)
+
+        if self.smoothing_lag:
+            y = self._smooth(y)
+        return y[0] if single else y
+
+    def _smooth(self, y):
+        segment = np.concatenate([self._tail, y], axis=1)
+        n_out = max(segment.shape[1] - self.smoothing_lag, 0)
+        self._tail = segment[:, n_out:]
+        if n_out == 0:
+            return segment[:, :0]
+        reversed_segment = segment[:, ::-1]
+        zi = self._zi_unit * reversed_segment[:, 0][None, :, None]
+        backward, _ = self._sosfilt(self.sos, reversed_segment, axis=-1, zi=zi)
+        return backward[:, ::-1][:, :n_out]
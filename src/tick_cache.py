@@ -0,0 +1,168 @@
+# tick_cache.py
+"""
+Compute-once results for polling clients. Without it every browser session runs its own
+update_graphs / update_vital_signs on every poll, so 20 open screens decimate and serialize the
+same data 20 times per tick.
+
+    ticker = Ticker(lambda: buffer.write_seq, interval=0.04)    # one data tick per poll interval
+    cache = TickCache(max_age=2 * sampling_rate)               # ticks are sample sequence numbers
+    cache_callbacks(app, cache, {'graph-seq.data': lambda inputs, state: (('graphs', state[0]), ticker.seq())})
+
+The Ticker freezes the data a tick covers, the first request for a (key, tick) runs the Dash
+callback and every other client with the same key gets the stored response bytes.
+"""
+import collections
+import threading
+import time
+import weakref
+
+from metrics import counter, gauge
+
+_caches = weakref.WeakSet()
+cache_hits = counter('tick_cache_hits_total', 'Callback responses served from the tick cache')
+cache_misses = counter('tick_cache_misses_total', 'Callback responses computed for the tick cache')
+cache_evictions = counter('tick_cache_evictions_total', 'Tick cache entries evicted (stale tick or size bound)')
+gauge('tick_cache_bytes', 'Bytes held by tick caches', fn=lambda: sum(cache.nbytes for cache in list(_caches)))
+
+
+class Ticker:
+    """
+    Quantizes a growing sequence number (e.g. a ring buffer's write_seq) to ticks of `interval`
+    seconds. seq() returns the value read at the first call of the current tick, so all requests
+    within a tick see the same data; `on_tick` (e.g. advancing a replay) runs once per tick, before
+    the value is read.
+    """
+    def __init__(self, source, interval, on_tick=None, clock=time.monotonic):
+        """
+        :param source: Callable returning the current sequence number
+        :param interval: Tick length in seconds (about the clients' poll interval)
+        :param on_tick: Optional callable run once at the start of every tick
+        """
+        self.source = source
+        self.interval = interval
+        self.on_tick = on_tick
+        self.clock = clock
+        self._tick = None
+        self._seq = None
+        self._lock = threading.Lock()
+
+    def seq(self):
+        with self._lock:
+            tick = int(self.clock() / self.interval)
+            if tick != self._tick:
+                self._tick = tick
+                if self.on_tick is not None:
+                    self.on_tick()
+                self._seq = self.source()
+            return self._seq
+
+
+class TickCache:
+    """
+    Results keyed by (tick, key). The first caller of a key computes it while concurrent callers of
+    the same key wait for that result instead of computing it again. Ticks are increasing numbers
+    (sample sequence numbers); entries more than `max_age` behind the newest tick are evicted, and
+    at most `max_entries` / `max_bytes` are kept (least recently used first).
+    """
+    def __init__(self, max_age, max_entries=256, max_bytes=16 * 2 ** 20):
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.newest = None
+        self.nbytes = 0
+        self._entries = collections.OrderedDict()  # (tick, key) -> value
+        self._pending = {}  # (tick, key) -> Event set once the value is stored (or failed)
+        self._lock = threading.Lock()
+        _caches.add(self)
+
+    def get(self, key, tick, compute):
+        """
+        :param key: Hashable result key (e.g. the client's state the result depends on)
+        :param tick: Data tick the result belongs to
+        :param compute: Callable producing the value (bytes; its length counts towards max_bytes)
+        """
+        entry = (tick, key)
+        while True:
+            with self._lock:
+                if entry in self._entries:
+                    self._entries.move_to_end(entry)
+                    cache_hits.inc()
+                    return self._entries[entry]
+                pending = self._pending.get(entry)
+                if pending is None:
+                    pending = self._pending[entry] = threading.Event()
+                    break
+            pending.wait()  # another client is computing it; re-check (it may have failed)
+
+        cache_misses.inc()
+        try:
+            value = compute()
+            with self._lock:
+                self._store(entry, value)
+            return value
+        finally:
+            with self._lock:
+                del self._pending[entry]
+            pending.set()
+
+    def _store(self, entry, value):
+        tick = entry[0]
+        if self.newest is None or tick > self.newest:
+            self.newest = tick
+            for stale in [e for e in self._entries if e[0] < tick - self.max_age]:
+                self._evict(stale)
+        if tick < self.newest - self.max_age:
+            return
+        self._entries[entry] = value
+        self.nbytes += len(value)
+        while self._entries and (len(self._entries) > self.max_entries or self.nbytes > self.max_bytes):
+            self._evict(next(iter(self._entries)))
+
+    def _evict(self, entry):
+        self.nbytes -= len(self._entries.pop(entry))
+        cache_evictions.inc()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def cache_callbacks(app, cache, key_fns):
+    """
+    Serves the Dash callbacks named in `key_fns` from the cache. Register after metrics.serve() so
+    cached responses are still timed.
+
+    :param app: Dash app
+    :param key_fns: Dict of an output ('component-id.property') -> key_fn(inputs, state) returning
+                    (key, tick) for the callback's input/state values, or None to skip the cache
+    """
+    from dash.exceptions import PreventUpdate
+    from flask import Response, request
+
+    def dispatch():
+        # The callback's JSON, or nothing when it didn't update anything (shared as well)
+        try:
+            response = app.server.view_functions[request.endpoint]()  # Dash's own callback view
+        except PreventUpdate:
+            return b''
+        if isinstance(response, Response):
+            return response.get_data()
+        return response.encode('utf-8') if isinstance(response, str) else response
+
+    def values(body, name):
+        return [item.get('value') for item in body.get(name) or []]
+
+    @app.server.before_request
+    def _cached_callback():
+        if not request.path.endswith('/_dash-update-component'):
+            return None
+        body = request.get_json(silent=True) or {}
+        outputs = str(body.get('output', '')).strip('.').split('...')
+        key_fn = next((key_fns[output] for output in outputs if output in key_fns), None)
+        if key_fn is None:
+            return None
+        keyed = key_fn(values(body, 'inputs'), values(body, 'state'))
+        if keyed is None:
+            return None
+        key, tick = keyed
+        data = cache.get((tuple(outputs), key), tick, dispatch)
+        return Response(data, status=200 if data else 204, mimetype='application/json')
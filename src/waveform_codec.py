@@ -0,0 +1,97 @@
+# waveform_codec.py
+"""
+Compact encoding of waveform traces for the browser. Instead of JSON lists of decimal strings,
+y is sent as a base64 typed array (int16 for integer ADC samples, float32 otherwise) and x as
+start + step, plus base64 sample offsets when decimation left gaps:
+
+    {'x0': 12.5, 'dx': 0.002, 'y': {'dtype': 'f4', 'bdata': '...'}[, 'xi': {'dtype': 'u2', 'bdata': '...'}]}
+
+The typed array objects use Plotly's {'dtype', 'bdata'} layout; assets/waveform.js decodes them
+back into the arrays Plotly.extendTraces expects.
+
+    python waveform_codec.py    # payload size / serialization time against JSON lists
+"""
+import base64
+import json
+
+import numpy as np
+
+INT16 = np.iinfo(np.int16)
+
+
+def encode_array(values, dtype):
+    """
+    :return: {'dtype': dtype, 'bdata': base64 of the little-endian values}
+    """
+    data = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder('<'))
+    return {'dtype': dtype, 'bdata': base64.b64encode(data.tobytes()).decode('ascii')}
+
+
+def decode_array(spec):
+    return np.frombuffer(base64.b64decode(spec['bdata']), dtype=np.dtype(spec['dtype']).newbyteorder('<'))
+
+
+def y_dtype(y):
+    """
+    int16 when every value is an integer in range (raw ADC samples), float32 otherwise.
+    """
+    if len(y) and np.all(np.isfinite(y)) and INT16.min <= y.min() and y.max() <= INT16.max and np.all(y == np.rint(y)):
+        return 'i2'
+    return 'f4'
+
+
+def encode_trace(x, y, dx):
+    """
+    :param x: Sample times, on a grid of step `dx` (decimated traces may skip samples)
+    :param y: Values
+    :param dx: Sample spacing of x
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    trace = {'x0': float(x[0]) if len(x) else 0.0, 'dx': dx, 'y': encode_array(y, y_dtype(y))}
+    offsets = np.rint((x - trace['x0']) / dx).astype(np.int64)
+    if np.any(offsets != np.arange(len(offsets))):
+        trace['xi'] = encode_array(offsets, 'u2' if len(offsets) == 0 or offsets[-1] <= 0xFFFF else 'u4')
+    return trace
+
+
+def decode_trace(trace):
+    """
+    Inverse of encode_trace: (x, y) arrays (y as float32 / int16).
+    """
+    y = decode_array(trace['y'])
+    offsets = decode_array(trace['xi']) if 'xi' in trace else np.arange(len(y))
+    return trace['x0'] + offsets * trace['dx'], y
+
+
+def compare(x, y, dx, repeat=200):
+    """
+    Payload size and serialization time of one trace as today's JSON lists and as encode_trace().
+
+    :return: {'json': (bytes, seconds per call), 'binary': (bytes, seconds per call)}
+    """
+    import timeit
+
+    encoders = {'json': lambda: json.dumps({'x': [x.tolist()], 'y': [y.tolist()]}),
+                'binary': lambda: json.dumps(encode_trace(x, y, dx))}
+    return {name: (len(fn()), timeit.timeit(fn, number=repeat) / repeat) for name, fn in encoders.items()}
+
+
+if __name__ == '__main__':
+    from decimation import bucket_size, decimate
+    from recording import load_recording
+    from streaming_filter import low_pass_filter
+
+    recording = load_recording()
+    fs = recording.sampling_rate
+    window = int(5 * fs)
+    t = np.arange(window) / fs + 100.0
+    raw = np.asarray(recording['ECG'][:window], dtype=float)
+    filtered = low_pass_filter(raw, 40, fs)
+    cases = {'raw ECG, 5 s': (t, raw), 'filtered ECG, 5 s': (t, filtered),
+             'filtered ECG, min-max to 1000 px': decimate(t, filtered, bucket_size(window, 1000), 'minmax'),
+             'filtered ECG, 20 ms update': (t[:int(0.02 * fs)], filtered[:int(0.02 * fs)])}
+    print(f'{"payload":36} {"JSON bytes":>10} {"binary bytes":>12} {"JSON us":>8} {"binary us":>9}')
+    for name, (x, y) in cases.items():
+        result = compare(x, y, 1 / fs)
+        print(f'{name:36} {result["json"][0]:10d} {result["binary"][0]:12d} '
+              f'{result["json"][1] * 1e6:8.1f} {result["binary"][1] * 1e6:9.1f}')
@@ -0,0 +1,43 @@
+# wsgi.py
+"""
+Web worker of the multi-process deployment: attaches read-only to the shared memory published by
+acquisition.py and serves the central-station UI (multi_bed.py). Start as many workers as there
+are cores to spare; they share nothing but the read-only blocks.
+
+    python acquisition.py --beds 8 &
+    gunicorn -w 4 --threads 16 -b :8050 wsgi:server    # threads: each push stream holds one
+    python wsgi.py --beds 8                            # dev: starts acquisition and one worker
+
+Don't use gunicorn's --preload: the worker threads must be started after the fork.
+"""
+import argparse
+import os
+
+from acquisition import DEFAULT_NAME, SharedRegistry, start_acquisition
+from multi_bed import create_app
+
+
+def create_server(name=DEFAULT_NAME, push=True):
+    registry = SharedRegistry.attach(name)
+    app = create_app(registry, push=push)
+    registry.start()
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--beds', type=int, default=1)
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--name', default=DEFAULT_NAME)
+    parser.add_argument('--poll', action='store_true', help='poll with dcc.Interval instead of pushing over SSE')
+    args = parser.parse_args()
+
+    process, stop = start_acquisition(args.name, args.beds)
+    try:
+        create_server(args.name, push=not args.poll).run(debug=False, port=args.port, threaded=True)
+    finally:
+        stop.set()
+        process.join()
+else:
+    # Imported by the WSGI server in each worker process
+    server = create_server(os.environ.get('VITALS_SHM', DEFAULT_NAME)).server